@@ -0,0 +1,257 @@
+"""
+Row counts and checksums of MAG tables, by range of the first column
+
+`file_checksums` streams a raw file once with the parser of the loader,
+`db_checksums` scans the table once. Both return for each range of the first
+column (the id of the table; `key_range = id // range_size`) the number of rows
+and the sum of the hashes of the rows. The sum does not depend on the order of
+the rows, so the checksums of a range agree when the table has the same rows
+as the file, and a difference points to the ranges to look at.
+
+Values are compared as text; values in columns with numeric affinity are
+compared as floats, because sqlite converts "2.0" in a NUMERIC column to 2.
+
+The results are stored in the table `table_checksums` together with a
+fingerprint of the file (size and modification time) and of the table
+(`db_fingerprint`). Sides with an unchanged fingerprint are not scanned again
+(`scan_tables`, `table_checksums`). Tables are scanned in parallel by ranges of
+rowid; the checksums of the ranges add up to the checksums of the table. The
+fingerprint of a table changes when the loader writes a new build marker for it
+(`helpers.functions.write_build_marker`) and when rows are added at the end, but
+not when rows are updated or deleted in place; use --rescan then.
+"""
+
+import os
+import json
+import hashlib
+import sqlite3 as sqlite
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .functions import table_fingerprint, read_build_markers
+from .stream_load import read_rows
+
+
+modulus = 2 ** 63 # fits into sqlite INTEGER
+default_range_size = 100_000_000
+
+
+def numeric_columns(con, tbl):
+    "Indicator for each column of `tbl` whether it has INTEGER, REAL or NUMERIC affinity."
+    out = []
+    for row in con.execute(f"PRAGMA table_info({tbl})"):
+        decl_type = row[2].upper()
+        is_text = any(s in decl_type for s in ["CHAR", "CLOB", "TEXT"])
+        is_blob = decl_type == "" or "BLOB" in decl_type
+        out.append(not is_text and not is_blob)
+    return out
+
+
+def canonical(value, is_numeric):
+    if value is None:
+        return ""
+    if is_numeric:
+        try:
+            return repr(float(value))
+        except ValueError:
+            pass
+    return str(value)
+
+
+def row_hash(row, numeric):
+    s = "\t".join(canonical(v, n) for v, n in zip(row, numeric))
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8", errors="replace"), digest_size=8).digest(), "little")
+
+
+def key_range(key, range_size):
+    "Range of the first column; -1 for values that are not integers."
+    try:
+        return int(key) // range_size
+    except (TypeError, ValueError):
+        return -1
+
+
+def checksums(rows, numeric, range_size):
+    "dict {key_range: [n_rows, checksum]} of `rows`."
+    out = {}
+    for row in rows:
+        r = out.setdefault(key_range(row[0], range_size), [0, 0])
+        r[0] += 1
+        r[1] = (r[1] + row_hash(row, numeric)) % modulus
+    return out
+
+
+def file_fingerprint(filename):
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def file_checksums(db_file, tbl, filename, range_size):
+    "Checksums of the raw file `filename` of `tbl`."
+    con = sqlite.connect(f"file:{db_file}?mode=ro", uri=True)
+    numeric = numeric_columns(con, tbl)
+    con.close()
+    return checksums(read_rows(filename, len(numeric)), numeric, range_size)
+
+
+def db_fingerprint(con, tbl):
+    "`table_fingerprint` and build id of `tbl`; does not scan the table."
+    fingerprint = table_fingerprint(con, [tbl])[tbl]
+    if fingerprint is None:
+        return None
+    return fingerprint + [read_build_markers(con, [tbl])[tbl]]
+
+
+def db_checksums(db_file, tbl, range_size, low=None, high=None):
+    "Checksums of the rows of `tbl` in `db_file` with rowid in (`low`, `high`]; of all rows if None."
+    con = sqlite.connect(f"file:{db_file}?mode=ro", uri=True)
+    numeric = numeric_columns(con, tbl)
+    if low is None:
+        rows = con.execute(f"SELECT * FROM {tbl}")
+    else:
+        rows = con.execute(f"SELECT * FROM {tbl} WHERE rowid > ? AND rowid <= ?", (low, high))
+    out = checksums(rows, numeric, range_size)
+    con.close()
+    return out
+
+
+def rowid_ranges(con, tbl, n_parts):
+    "Split the rowids of `tbl` into `n_parts` ranges (low, high] of about the same length."
+    low, high = con.execute(f"SELECT MIN(rowid) - 1, MAX(rowid) FROM {tbl}").fetchone()
+    if high is None:
+        return [(0, 0)]
+    bounds = [low + (high - low) * i // n_parts for i in range(n_parts + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def add_checksums(out, values):
+    "Add the checksums `values` of some rows to the checksums `out` of other rows, in place."
+    for r, (n, c) in values.items():
+        o = out.setdefault(r, [0, 0])
+        o[0] += n
+        o[1] = (o[1] + c) % modulus
+    return out
+
+
+class ChecksumStore():
+    """Stored checksums in the table `table_checksums` of `con`.
+    Each scan also stores a row without key range, so that scans of empty files
+    and tables are stored as well.
+
+    Args:
+        con: sqlite connection in autocommit mode.
+    """
+    def __init__(self, con):
+        self.con = con
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS table_checksums (
+                tbl TEXT
+                , source TEXT
+                , fingerprint TEXT
+                , range_size INT
+                , key_range INT
+                , n_rows INT
+                , checksum INT
+                , date TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+    def get(self, tbl, source, fingerprint, range_size):
+        "Stored checksums if the fingerprint and range size are the same as in the last scan; else None."
+        rows = self.con.execute("""
+            SELECT key_range, n_rows, checksum
+            FROM table_checksums
+            WHERE tbl = ? AND source = ? AND fingerprint = ? AND range_size = ?
+        """, (tbl, source, json.dumps(fingerprint), range_size)).fetchall()
+        if len(rows) == 0:
+            return None
+        return {r: [n, c] for r, n, c in rows if r is not None}
+
+    def put(self, tbl, source, fingerprint, range_size, values):
+        self.con.execute("BEGIN")
+        self.con.execute("DELETE FROM table_checksums WHERE tbl = ? AND source = ?", (tbl, source))
+        self.con.executemany(
+            """INSERT INTO table_checksums (tbl, source, fingerprint, range_size, key_range, n_rows, checksum)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            [(tbl, source, json.dumps(fingerprint), range_size, r, n, c) 
+             for r, (n, c) in list(values.items()) + [(None, (None, None))]]
+        )
+        self.con.execute("COMMIT")
+
+
+def _scan(con, db_file, sources, range_size, n_jobs, rescan):
+    """Stored or new checksums of `sources`, a list of (table, source, fingerprint, tasks).
+    The checksums of a source are the sum of the checksums of its tasks; tasks of all
+    sources that changed run in `n_jobs` processes. Returns the checksums by (table, source)
+    and the list of (table, source) that were scanned.
+    """
+    store = ChecksumStore(con)
+    results, pending, fingerprints = {}, {}, {}
+    tasks = []
+    for tbl, source, fingerprint, source_tasks in sources:
+        stored = None if rescan else store.get(tbl, source, fingerprint, range_size)
+        if stored is not None:
+            results[(tbl, source)] = stored
+            continue
+        results[(tbl, source)] = {}
+        pending[(tbl, source)] = len(source_tasks)
+        fingerprints[(tbl, source)] = fingerprint
+        tasks += [((tbl, source), task) for task in source_tasks]
+
+    scanned = []
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = {executor.submit(*task): key for key, task in tasks}
+        for future in as_completed(futures):
+            key = futures[future]
+            add_checksums(results[key], future.result())
+            pending[key] -= 1
+            if pending[key] == 0:
+                store.put(*key, fingerprints[key], range_size, results[key])
+                scanned.append(key)
+    return results, scanned
+
+
+def db_source(con, db_file, tbl, range_size, n_parts):
+    "Source for `_scan` of the table `tbl`, scanned in `n_parts` ranges of rowid."
+    return (tbl, "db", db_fingerprint(con, tbl),
+            [(db_checksums, db_file, tbl, range_size, low, high) for low, high in rowid_ranges(con, tbl, n_parts)])
+
+
+def scan_tables(con, db_file, files, range_size, n_jobs=1, rescan=False):
+    """Checksums of the raw files and the tables in `db_file`. Files and tables 
+    with the same fingerprint as in the last scan are not scanned again, unless `rescan`.
+
+    Parameters
+    ----------
+    con: sqlite connection to `db_file` in autocommit mode, for the stored checksums.
+    files: dict {table: path of the raw file}
+    n_jobs: int
+        Number of processes. Each file is scanned by one process, each table by `n_jobs` processes.
+
+    Returns
+    ----------
+    results: dict {table: {"file": checksums, "db": checksums}}
+    scanned: list of (table, source) that were scanned, with source "file" or "db".
+    """
+    sources = []
+    for tbl, filename in files.items():
+        sources.append((tbl, "file", file_fingerprint(filename), [(file_checksums, db_file, tbl, filename, range_size)]))
+        sources.append(db_source(con, db_file, tbl, range_size, n_jobs))
+    values, scanned = _scan(con, db_file, sources, range_size, n_jobs, rescan)
+    results = {tbl: {source: values[(tbl, source)] for source in ["file", "db"]} for tbl in files.keys()}
+    return results, scanned
+
+
+def table_checksums(con, db_file, tables, range_size=default_range_size, n_jobs=1):
+    """Checksums of `tables` in `db_file`, as dict by table. Tables that changed since
+    their checksums were stored are scanned in `n_jobs` processes, by range of rowid.
+    `con` is a connection to `db_file` in autocommit mode, without open transaction.
+    """
+    sources = [db_source(con, db_file, tbl, range_size, n_jobs) for tbl in tables]
+    values, _ = _scan(con, db_file, sources, range_size, n_jobs, rescan=False)
+    return {tbl: values[(tbl, "db")] for tbl in tables}
+
+
+def compare(file_values, db_values):
+    "Key ranges where the row counts or checksums differ."
+    ranges = sorted(set(file_values.keys()) | set(db_values.keys()))
+    return [r for r in ranges if file_values.get(r) != db_values.get(r)]
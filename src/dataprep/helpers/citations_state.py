@@ -0,0 +1,269 @@
+"""
+Citation history of papers (paper_citations), with incremental rebuilds
+
+`build_paper_citations` creates paper_citations. With `incremental`, it only
+recomputes the citation history of the referenced papers whose citations may
+have changed since the last build, and compares only the parts of the inputs
+that changed:
+- the inputs PaperReferences, Papers and PaperMainFieldsOfStudy are summarised by
+  checksums by range of PaperId (`helpers.checksums.table_checksums`). They are
+  stored with the build markers that create_database.py and paper_fields.py
+  write, and computed again, in parallel, only for tables with a new marker.
+  The checksums at the last build are kept in citations_state_ranges; the
+  ranges whose checksums differ are the ranges that changed.
+- citations_state_refs: for each range of citing PaperIds and each PaperReferenceId,
+  the number and the sum of the citing PaperIds in PaperReferences
+- citations_state_papers: for each paper, Year, DocType and whether it is in
+  PaperMainFieldsOfStudy, which decide whether the paper is counted as
+  citing or cited paper
+Both are recomputed and compared only in the ranges that changed.
+A referenced paper is affected if its row in citations_state_refs changed, if
+its own row in citations_state_papers changed, or if the row of one of the
+papers citing it changed.
+
+Tables that are modified in place without a new build marker look unchanged;
+run a full build then.
+
+The affected PaperIds are added to the table citations_changed, from which
+paper_outcomes.py --incremental knows which papers to update.
+"""
+
+from .variables import keep_doctypes_citations, insert_questionmark_doctypes_citations
+from .checksums import default_range_size, table_checksums, compare
+
+
+input_tables = ["PaperReferences", "Papers", "PaperMainFieldsOfStudy"]
+state_tables = ["citations_state_refs", "citations_state_papers", "citations_state_ranges"]
+start_year = 1950
+
+
+def query_paper_citations(only_affected=False):
+    """Query for the citation history, with parameters `query_params`.
+    If `only_affected`, only for the papers in temp.affected_papers.
+    """
+    restriction = "WHERE a.PaperReferenceId IN (SELECT PaperId FROM temp.affected_papers)" if only_affected else ""
+    return f"""SELECT  a.PaperReferenceId,
+                    b.Year,
+                    b.DocType AS ReferencingDocType,
+                    COUNT(DISTINCT a.PaperId) AS CitationCount
+            FROM PaperReferences a
+            -- ## Restrictions on referencing papers
+            INNER JOIN (
+              SELECT PaperId, Year, DocType
+              FROM Papers
+              INNER JOIN (
+                  SELECT PaperId
+                  FROM PaperMainFieldsOfStudy
+              ) USING (PaperId)
+              WHERE
+                DocType IN ({insert_questionmark_doctypes_citations})
+                AND
+                DocType IS NOT NULL
+            ) b on a.PaperId = b.PaperId
+            -- ## Restrictions on PaperReferenceId
+            INNER JOIN (
+              SELECT PaperId, Year, DocType
+              FROM Papers
+              INNER JOIN ( -- ## this keeps only the citation history of papers in PaperMainFieldsOfStudy
+                  SELECT PaperId
+                  FROM PaperMainFieldsOfStudy
+              ) USING (PaperId)
+              WHERE
+                DocType IN ({insert_questionmark_doctypes_citations})
+                AND
+                DocType IS NOT NULL
+                AND
+                Year >= (?)
+            ) c on a.PaperReferenceId = c.PaperId
+            {restriction}
+            GROUP BY a.PaperReferenceId, b.Year, ReferencingDocType
+          """
+
+
+query_params = keep_doctypes_citations + keep_doctypes_citations + (start_year,)
+
+
+def has_state(con):
+    n = con.execute(f"""SELECT COUNT(*) FROM sqlite_master
+                    WHERE type = 'table' AND name IN ({", ".join(["?"] * len(state_tables))})""",
+                    state_tables).fetchone()[0]
+    return n == len(state_tables)
+
+
+def drop_state(con):
+    "Drop the state and the list of changes, for instance after a full build."
+    for tbl in state_tables + ["citations_changed"]:
+        con.execute(f"DROP TABLE IF EXISTS {tbl}")
+
+
+def changed_ranges(con, checksums, range_size):
+    """Ranges of PaperId that changed since the last build, as dict with the ranges of
+    PaperReferences ("refs") and of Papers or PaperMainFieldsOfStudy ("papers").
+    None if the ranges cannot be compared with the last build.
+    """
+    stored = {tbl: {} for tbl in input_tables}
+    for tbl, size, key_range, n_rows, checksum in con.execute("SELECT * FROM citations_state_ranges"):
+        if size != range_size:
+            return None
+        stored[tbl][key_range] = [n_rows, checksum]
+    changed = {tbl: compare(stored[tbl], checksums[tbl]) for tbl in input_tables}
+    if any(-1 in ranges for ranges in changed.values()): # ids that are not integers
+        return None
+    return {
+        "refs": changed["PaperReferences"],
+        "papers": sorted(set(changed["Papers"]) | set(changed["PaperMainFieldsOfStudy"]))
+    }
+
+
+def in_ranges(column, ranges, range_size):
+    "SQL condition for `column` in one of the `ranges` of size `range_size`; all rows if `ranges` is None."
+    if ranges is None:
+        return "1"
+    if len(ranges) == 0:
+        return "0"
+    return " OR ".join(f"({column} >= {int(r) * range_size} AND {column} < {(int(r) + 1) * range_size})"
+                       for r in ranges)
+
+
+def compute_state(con, range_size, ranges=None):
+    """Current state of the inputs in temp.new_citations_state_refs and temp.new_citations_state_papers,
+    for the ranges from `changed_ranges`, or for all papers if `ranges` is None.
+    """
+    con.execute("DROP TABLE IF EXISTS temp.new_citations_state_refs")
+    con.execute(f"""CREATE TEMPORARY TABLE new_citations_state_refs AS
+                SELECT PaperId / {int(range_size)} AS key_range
+                    , PaperReferenceId
+                    , COUNT(*) AS n_citing
+                    , SUM(PaperId) AS sum_citing
+                FROM PaperReferences
+                WHERE {in_ranges("PaperId", None if ranges is None else ranges["refs"], range_size)}
+                GROUP BY key_range, PaperReferenceId
+                """)
+    con.execute("DROP TABLE IF EXISTS temp.new_citations_state_papers")
+    con.execute(f"""CREATE TEMPORARY TABLE new_citations_state_papers AS
+                SELECT PaperId
+                    , Year
+                    , DocType
+                    , PaperId IN (SELECT PaperId FROM PaperMainFieldsOfStudy) AS in_main_fos
+                FROM Papers
+                WHERE {in_ranges("PaperId", None if ranges is None else ranges["papers"], range_size)}
+                """)
+
+
+def save_state(con, checksums, range_size, ranges=None):
+    """Save the state from `compute_state` and the `checksums` of the inputs.
+    If `ranges` is None, the stored state is replaced, otherwise only the `ranges`.
+    """
+    if ranges is None:
+        for tbl in state_tables:
+            con.execute(f"DROP TABLE IF EXISTS {tbl}")
+        con.execute("CREATE TABLE citations_state_refs AS SELECT * FROM temp.new_citations_state_refs")
+        con.execute("CREATE INDEX idx_csr_key_range ON citations_state_refs (key_range)")
+        con.execute("CREATE TABLE citations_state_papers AS SELECT * FROM temp.new_citations_state_papers")
+        con.execute("CREATE UNIQUE INDEX idx_csp_PaperId ON citations_state_papers (PaperId)")
+    else:
+        con.execute(f"DELETE FROM citations_state_refs WHERE key_range IN ({', '.join(str(int(r)) for r in ranges['refs'])})")
+        con.execute("INSERT INTO citations_state_refs SELECT * FROM temp.new_citations_state_refs")
+        con.execute(f"DELETE FROM citations_state_papers WHERE {in_ranges('PaperId', ranges['papers'], range_size)}")
+        con.execute("INSERT INTO citations_state_papers SELECT * FROM temp.new_citations_state_papers")
+    con.execute("DROP TABLE IF EXISTS citations_state_ranges")
+    con.execute("""CREATE TABLE citations_state_ranges (
+                tbl TEXT, range_size INT, key_range INT, n_rows INT, checksum INT)""")
+    con.executemany("INSERT INTO citations_state_ranges VALUES (?, ?, ?, ?, ?)",
+                    [(tbl, range_size, r, n, c) for tbl, values in checksums.items() for r, (n, c) in values.items()])
+
+
+def find_affected(con, range_size, ranges):
+    """Compare the stored state in the `ranges` from `changed_ranges` with the state
+    from `compute_state` and save the PaperReferenceIds of affected papers in temp.affected_papers.
+    Return the number of affected papers.
+    """
+    stored_refs = f"""SELECT * FROM citations_state_refs
+                    WHERE key_range IN ({', '.join(str(int(r)) for r in ranges['refs'])})"""
+    stored_papers = f"""SELECT * FROM citations_state_papers
+                    WHERE {in_ranges('PaperId', ranges['papers'], range_size)}"""
+    con.execute("DROP TABLE IF EXISTS temp.changed_papers")
+    con.execute(f"""CREATE TEMPORARY TABLE changed_papers AS
+                SELECT PaperId FROM (
+                    SELECT * FROM temp.new_citations_state_papers
+                    EXCEPT
+                    {stored_papers}
+                )
+                UNION
+                SELECT PaperId FROM (
+                    {stored_papers}
+                    EXCEPT
+                    SELECT * FROM temp.new_citations_state_papers
+                )
+                """)
+    con.execute("DROP TABLE IF EXISTS temp.affected_papers")
+    con.execute("CREATE TEMPORARY TABLE affected_papers (PaperId INTEGER PRIMARY KEY)")
+    con.execute(f"""INSERT OR IGNORE INTO temp.affected_papers
+                SELECT PaperReferenceId FROM (
+                    SELECT * FROM temp.new_citations_state_refs
+                    EXCEPT
+                    {stored_refs}
+                )
+                UNION
+                SELECT PaperReferenceId FROM (
+                    {stored_refs}
+                    EXCEPT
+                    SELECT * FROM temp.new_citations_state_refs
+                )
+                -- ## changes of the paper itself
+                UNION
+                SELECT PaperId FROM temp.changed_papers
+                -- ## changes of papers citing it
+                UNION
+                SELECT PaperReferenceId
+                FROM PaperReferences
+                WHERE PaperId IN (SELECT PaperId FROM temp.changed_papers)
+                """)
+    return con.execute("SELECT COUNT(*) FROM temp.affected_papers").fetchone()[0]
+
+
+def log_changes(con):
+    "Add the affected papers to citations_changed."
+    con.execute("CREATE TABLE IF NOT EXISTS citations_changed (PaperId INTEGER PRIMARY KEY)")
+    con.execute("INSERT OR IGNORE INTO citations_changed SELECT PaperId FROM temp.affected_papers")
+
+
+def build_paper_citations(con, db_file, incremental=False, range_size=default_range_size, n_jobs=1):
+    """Create paper_citations on `con`, a connection to `db_file` in autocommit mode.
+
+    With `incremental`, update only the papers affected by changes since the last
+    incremental build. The first incremental build is a full build. Checksums of
+    the inputs are computed in `n_jobs` processes.
+    Return the number of affected papers of an incremental update; None for full builds.
+    """
+    checksums = None
+    if incremental:
+        print("Summarising the inputs... \n")
+        checksums = table_checksums(con, db_file, input_tables, range_size, n_jobs)
+    ranges = None
+    if checksums is not None and has_state(con):
+        ranges = changed_ranges(con, checksums, range_size)
+
+    if ranges is not None:
+        print('Updating citations per Paper-Year... \n')
+        compute_state(con, range_size, ranges)
+        con.execute("BEGIN")
+        n_affected = find_affected(con, range_size, ranges)
+        print(f"{n_affected} papers are affected by changes since the last build. \n")
+        con.execute("DELETE FROM paper_citations WHERE PaperReferenceId IN (SELECT PaperId FROM temp.affected_papers)")
+        con.execute(f"INSERT INTO paper_citations {query_paper_citations(only_affected=True)}", query_params)
+        log_changes(con)
+        save_state(con, checksums, range_size, ranges)
+        con.execute("COMMIT")
+        return n_affected
+
+    print('Citations per Paper-Year... \n')
+    con.execute('DROP TABLE IF EXISTS paper_citations')
+    con.execute(f"CREATE TABLE paper_citations AS {query_paper_citations()}", query_params)
+    con.execute('CREATE INDEX idx_pc_PaperReferenceIdYear on paper_citations (PaperReferenceId ASC, Year)')
+    # ## paper_outcomes.py needs a full build as well
+    drop_state(con)
+    if checksums is not None:
+        compute_state(con, range_size)
+        save_state(con, checksums, range_size)
+    return None
@@ -0,0 +1,165 @@
+"""
+Save author_collab as a graph in compressed sparse row (CSR) format,
+and read it with `CollabGraph` for queries on coauthors without sqlite joins.
+
+The graph is stored in `graph_dir` as numpy files:
+- nodes.npy: sorted AuthorIds of all authors in author_collab; the position of
+  an author in `nodes` is its node index
+- indptr.npy: the edges of node i are at positions indptr[i]:indptr[i+1]
+- neighbors.npy: node index of the coauthor of each edge
+- years.npy: year of each edge
+Each edge is one row (AuthorId, CoAuthorId, Year) of author_collab. The edges
+of a node are sorted by coauthor and year. Rows without year (NULL, or empty
+strings from the csv import in read_collab.py) are not edges.
+
+The graph is built by main/prep_mag/collab_graph.py.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+
+# rows of author_collab with a year
+edge_filter = "typeof(Year) = 'integer'"
+
+
+def build_collab_graph(con, graph_dir, batch_size=10_000_000):
+    """Read author_collab in the order of its unique index and save the graph to `graph_dir`.
+    Only `batch_size` rows of author_collab are in memory at once.
+    """
+    os.makedirs(graph_dir, exist_ok=True)
+    n_edges = con.execute(f"SELECT COUNT(*) FROM author_collab WHERE {edge_filter}").fetchone()[0]
+    path_coauthors = os.path.join(graph_dir, "coauthor_ids.npy")
+    coauthor_ids = np.lib.format.open_memmap(path_coauthors, mode="w+", dtype=np.int64, shape=(n_edges, ))
+    years = np.lib.format.open_memmap(os.path.join(graph_dir, "years.npy"), mode="w+", dtype=np.int16, shape=(n_edges, ))
+
+    # ## 1. edges, and number of edges by author
+    author_ids, author_counts = [], []
+    cur = con.execute(f"""SELECT AuthorId, CoAuthorId, Year
+                      FROM author_collab
+                      WHERE {edge_filter}
+                      ORDER BY AuthorId, CoAuthorId, Year""")
+    position = 0
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+        rows = np.array(rows, dtype=np.int64)
+        coauthor_ids[position:position + rows.shape[0]] = rows[:, 1]
+        years[position:position + rows.shape[0]] = rows[:, 2]
+        position += rows.shape[0]
+        ids, counts = np.unique(rows[:, 0], return_counts=True)
+        # an author can be split across two batches; counts are added up below
+        author_ids.append(ids)
+        author_counts.append(counts)
+    author_ids = np.concatenate(author_ids) if len(author_ids) > 0 else np.array([], dtype=np.int64)
+    author_counts = np.concatenate(author_counts) if len(author_counts) > 0 else np.array([], dtype=np.int64)
+
+    # ## 2. nodes: all authors and coauthors
+    nodes = np.unique(author_ids)
+    for start in range(0, n_edges, batch_size):
+        nodes = np.union1d(nodes, coauthor_ids[start:start + batch_size])
+
+    # ## 3. pointers to the edges of each node
+    counts = np.zeros(len(nodes), dtype=np.int64)
+    np.add.at(counts, np.searchsorted(nodes, author_ids), author_counts)
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+
+    # ## 4. coauthors as node indexes
+    neighbors = np.lib.format.open_memmap(os.path.join(graph_dir, "neighbors.npy"), mode="w+",
+                                          dtype=np.int32 if len(nodes) < 2 ** 31 else np.int64,
+                                          shape=(n_edges, ))
+    for start in range(0, n_edges, batch_size):
+        neighbors[start:start + batch_size] = np.searchsorted(nodes, coauthor_ids[start:start + batch_size])
+
+    np.save(os.path.join(graph_dir, "nodes.npy"), nodes)
+    np.save(os.path.join(graph_dir, "indptr.npy"), indptr)
+    for arr in [neighbors, years]:
+        arr.flush()
+    del coauthor_ids, neighbors, years
+    os.remove(path_coauthors)
+    return len(nodes), n_edges
+
+
+class CollabGraph():
+    """Memory-mapped view of the graph saved with `build_collab_graph`.
+
+    Args:
+        graph_dir: directory with the graph.
+
+    `first_year` and `last_year` in the methods below restrict the edges to
+    the years between them, including both; None means no restriction.
+    """
+    def __init__(self, graph_dir):
+        load = lambda name: np.load(os.path.join(graph_dir, f"{name}.npy"), mmap_mode="r")
+        self.nodes = load("nodes")
+        self.indptr = load("indptr")
+        self.neighbors = load("neighbors")
+        self.years = load("years")
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def node_index(self, author_ids):
+        "Node indexes of `author_ids`; -1 for authors not in the graph."
+        author_ids = np.atleast_1d(np.asarray(author_ids, dtype=np.int64))
+        if len(self.nodes) == 0:
+            return np.full(len(author_ids), -1)
+        idx = np.searchsorted(self.nodes, author_ids)
+        idx = np.minimum(idx, len(self.nodes) - 1)
+        return np.where(self.nodes[idx] == author_ids, idx, -1)
+
+    def _edges(self, nodes, first_year=None, last_year=None):
+        "Node indexes of the coauthors and years of the edges of `nodes`, and the node of each edge."
+        nodes = nodes[nodes >= 0]
+        starts, ends = self.indptr[nodes], self.indptr[nodes + 1]
+        lengths = ends - starts
+        if lengths.sum() == 0:
+            empty = np.array([], dtype=np.int64)
+            return empty, empty, empty
+        # positions of all edges of `nodes`
+        offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        positions = np.arange(lengths.sum()) + offsets
+        source = np.repeat(nodes, lengths)
+        neighbors, years = self.neighbors[positions], self.years[positions]
+        keep = np.ones(len(positions), dtype=bool)
+        if first_year is not None:
+            keep &= years >= first_year
+        if last_year is not None:
+            keep &= years <= last_year
+        return source[keep], neighbors[keep].astype(np.int64), years[keep]
+
+    def edges(self, author_id, first_year=None, last_year=None):
+        "DataFrame with CoAuthorId and Year of the collaborations of `author_id`."
+        _, neighbors, years = self._edges(self.node_index(author_id), first_year, last_year)
+        return pd.DataFrame({"CoAuthorId": self.nodes[neighbors], "Year": years})
+
+    def coauthors(self, author_id, first_year=None, last_year=None):
+        "Sorted AuthorIds of the coauthors of `author_id`."
+        _, neighbors, _ = self._edges(self.node_index(author_id), first_year, last_year)
+        return self.nodes[np.unique(neighbors)]
+
+    def two_hop(self, author_id, first_year=None, last_year=None, exclude_coauthors=True):
+        """Sorted AuthorIds of the coauthors of the coauthors of `author_id`, without `author_id`.
+        Both collaborations need to be in the year window.
+        If `exclude_coauthors`, the direct coauthors are excluded.
+        """
+        node = self.node_index(author_id)
+        _, first_hop, _ = self._edges(node, first_year, last_year)
+        first_hop = np.unique(first_hop)
+        _, second_hop, _ = self._edges(first_hop, first_year, last_year)
+        second_hop = np.setdiff1d(np.unique(second_hop), node)
+        if exclude_coauthors:
+            second_hop = np.setdiff1d(second_hop, first_hop)
+        return self.nodes[second_hop]
+
+    def collaborator_counts(self, author_ids, first_year=None, last_year=None):
+        "DataFrame with the number of coauthors by AuthorId and Year, for authors with at least one coauthor."
+        source, _, years = self._edges(self.node_index(author_ids), first_year, last_year)
+        # the edges are unique by (author, coauthor, year)
+        out = (pd.DataFrame({"AuthorId": self.nodes[source], "Year": years})
+                .groupby(["AuthorId", "Year"])
+                .size()
+                .reset_index(name="n_coauthors"))
+        return out
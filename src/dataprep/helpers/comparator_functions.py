@@ -3,12 +3,14 @@
 from math import nan
 import re
 from operator import mul 
-from functools import reduce, wraps 
+from functools import reduce, wraps, lru_cache 
+from collections import namedtuple
 
 from nltk.metrics.distance import jaro_winkler_similarity
 from nltk.stem import SnowballStemmer
 from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
 import numpy 
+from scipy import sparse
 
 from .functions import is_numeric, list_from_tuples
 from .decorators import decorator_with_args
@@ -16,16 +18,33 @@ from .tfidf_settings import stop_words, ngram_range
 
 # 1. Basic comparators
 
+# The same institution names are compared many times across record pairs. 
+    # Cache the normalized strings and the distances between them.
+cache_size_strings = 2**16
+cache_size_string_pairs = 2**20
+
+
+@lru_cache(maxsize=cache_size_strings)
+def normalize_substr(string, ignore_substr):
+    "Delete `ignore_substr` from `string`."
+    return re.sub(ignore_substr, "", string).strip()
+
+
+@lru_cache(maxsize=cache_size_string_pairs)
+def cached_jaro_winkler_similarity(string1, string2):
+    return jaro_winkler_similarity(string1, string2)
+
+
 def string_comparator(string1, string2, ignore_substr=None):
     """
     Compare string1 and string2; if required first delete 
     `ignore_substr` from both.
     """
     if ignore_substr is not None:
-        string1 = re.sub(ignore_substr, "", string1).strip()
-        string2 = re.sub(ignore_substr, "", string2).strip()
+        string1 = normalize_substr(string1, ignore_substr)
+        string2 = normalize_substr(string2, ignore_substr)
     try:
-        jw = jaro_winkler_similarity(string1, string2)
+        jw = cached_jaro_winkler_similarity(string1, string2)
         return 1 - jw
     except:
         return None
@@ -62,8 +81,9 @@ def compare_two_single_tuples(fnc):
         for i in tuple1:
             for j in tuple2:
                 #print(f"Comparing {i} and {j} yields {fnc(i, j)}")
-                if fnc(i, j) < out:
-                    out = fnc(i, j)
+                dist = fnc(i, j)
+                if dist < out:
+                    out = dist
         return out
     return compare
 
@@ -269,6 +289,74 @@ def compare_endrange_from_tuple(a, b):
     else:
         return 0
 
+# 3.3. Batch versions of the comparators above, for arrays of candidate pairs
+    # The range comparators take `TupleBounds` of the tuples in the pairs, `number_comparator_batch`
+    # takes sequences of numbers; the output is an array with the distance for each pair.
+    # Build the bounds once per set of records with `tuple_bounds` and select the records 
+    # in a batch of pairs with `take_bounds`; converting the tuples is slower than the comparison.
+
+TupleBounds = namedtuple("TupleBounds", ["low", "high", "length"])
+
+
+def tuple_bounds(tuples):
+    "Return `TupleBounds` with arrays of the minimum, maximum and length of each tuple in `tuples`."
+    lengths = numpy.fromiter((len(t) for t in tuples), dtype=numpy.int64, count=len(tuples))
+    if (lengths == 0).any():
+        raise ValueError("Tuples need to be non-empty.")
+    flat = numpy.fromiter((x for t in tuples for x in t), dtype=numpy.float64, count=lengths.sum())
+    starts = numpy.concatenate([[0], numpy.cumsum(lengths)[:-1]]).astype(numpy.int64)
+    return TupleBounds(numpy.minimum.reduceat(flat, starts), numpy.maximum.reduceat(flat, starts), lengths)
+
+
+def take_bounds(bounds, index):
+    "`TupleBounds` of the tuples at the positions `index` of `bounds`."
+    return TupleBounds(bounds.low[index], bounds.high[index], bounds.length[index])
+
+
+def number_comparator_batch(x, y):
+    "Batch version of `number_comparator`."
+    return numpy.abs(numpy.log10(numpy.asarray(x, dtype=numpy.float64)) 
+                     - numpy.log10(numpy.asarray(y, dtype=numpy.float64)))
+
+
+def compare_range_from_tuple_batch(a, b):
+    "Batch version of `compare_range_from_tuple`."
+    margin = 4 
+    min_a, max_a, len_a = a
+    min_b, max_b, len_b = b
+    if ((len_a != 1) & (len_b != 1)).any():
+        raise ValueError("Tuples are of wrong length.")
+    a_is_value = len_a == 1
+    value = numpy.where(a_is_value, min_a, min_b)
+    lower = numpy.where(a_is_value, min_b, min_a) - margin
+    upper = numpy.where(a_is_value, max_b, max_a) + margin
+    return ((value >= lower) & (value <= upper)).astype(numpy.int64)
+
+
+def compare_startrange_from_tuple_batch(a, b):
+    "Batch version of `compare_startrange_from_tuple`."
+    min_a, min_b = a.low, b.low
+    return numpy.where(min_a <= min_b, min_a - min_b, 0)
+
+
+def compare_endrange_from_tuple_batch(a, b):
+    "Batch version of `compare_endrange_from_tuple`."
+    max_a, max_b = a.high, b.high
+    return numpy.where(max_a >= max_b, max_a - max_b, 0)
+
+
+def pairwise_from_batch(fnc, bounds=False):
+    """
+    Make a comparator for one pair, as called by dedupe, from the batch comparator `fnc`.
+    With `bounds`, `fnc` is a range comparator that takes `TupleBounds`.
+    """
+    prepare = tuple_bounds if bounds else (lambda x: x)
+    @wraps(fnc)
+    def compare(a, b):
+        return fnc(prepare([a]), prepare([b]))[0].item()
+    return compare
+
+
 # 4. Compare paper titles
 
 def year_title_comparator(x, y):
@@ -317,13 +405,83 @@ def text_comparator(a, b):
     return numpy.max(similarity)
 
 
+# built once; constructing them is more expensive than stemming a title
+_stemmer = SnowballStemmer("english")
+_analyzer = CountVectorizer(
+    stop_words=stop_words,
+    ngram_range=ngram_range
+).build_analyzer()
+
+
 def stemmed_words(doc):
     "Stem words with same settings as Tfidf vectorizer."
-    stemmer = SnowballStemmer("english")
-    Vectorizer = CountVectorizer(
-        stop_words=stop_words,
-        ngram_range=ngram_range
-    )
-    analyzer = Vectorizer.build_analyzer() 
-    return (stemmer.stem(w) for w in analyzer(doc))
+    return (_stemmer.stem(w) for w in _analyzer(doc))
+
+
+class FittedTextComparator():
+    """
+    Text comparator with a tf-idf model fitted once on a corpus of texts.
+
+    `text_comparator` and `year_title_comparator` take the same inputs and return the same 
+    kind of output as the module-level functions, but the idf weights come from the whole 
+    corpus instead of the texts being compared. The normalized tf-idf vectors of the 
+    texts are kept in a cache with at most `cache_size` texts.
+
+    Parameters
+    ----------
+    corpus: iterable of texts, for instance all titles in the field
+    cache_size: int
+    """
+    def __init__(self, corpus, cache_size=100_000):
+        self.cache_size = cache_size
+        self.Vectorizer = TfidfVectorizer(
+            analyzer=stemmed_words,
+            stop_words=stop_words,
+            ngram_range=ngram_range
+        )
+        self.Vectorizer.fit(corpus)
+        self._make_cache()
+
+    def _make_cache(self):
+        self.vectorize = lru_cache(maxsize=self.cache_size)(self._vectorize)
+
+    def _vectorize(self, text):
+        return self.Vectorizer.transform([text])
+
+    # the cache is not pickled, for instance when dedupe writes the settings file
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["vectorize"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._make_cache()
+
+    def text_comparator(self, a, b):
+        """
+        Compare similarity of two tuples of text.
+
+        Parameters
+        ----------
+        a: list of texts
+        b: list of texts
+        """
+        tfidf_a = sparse.vstack([self.vectorize(text) for text in a])
+        tfidf_b = sparse.vstack([self.vectorize(text) for text in b])
+        similarity = (tfidf_a * tfidf_b.T).toarray()
+        return numpy.max(similarity)
+
+    def year_title_comparator(self, x, y):
+        """
+        Compare tuples of year-title combinations in x and y.
+
+        Parameters
+        ----------
+        x: A tuple of (year, title) combination
+        y: A tuple of one or mor tuples of (year, title) combinations
+        """
+        x = list_from_tuples(x)
+        y = list_from_tuples(y)
+        return self.text_comparator(x, y)
 
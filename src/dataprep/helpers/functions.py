@@ -1,6 +1,11 @@
 import time 
 import warnings 
 import itertools
+import re
+import uuid
+import multiprocessing as mp
+import pandas as pd
+import numpy as np
 
 def print_elapsed_time(start_time):
     print(f"Time elapsed: {(time.time()-start_time)/60} minutes \n", flush = True)
@@ -18,22 +23,24 @@ def analyze_db(con):
 
 
 
+letters_to_replace = {
+    "ä": "a",
+    "ü": "u",
+    "ö": "o",
+    "í": "i",
+    "ì": "i",
+    "ñ": "n",
+    "à": "a",
+    "á": "a",
+    "é": "e",
+    "è": "e"
+}
+
+
 def normalize_string(s, replace_hyphen = ""): 
     """
     Normalize the character strings in a pd.Series
     """
-    letters_to_replace = {
-        "ä": "a",
-        "ü": "u",
-        "ö": "o",
-        "í": "i",
-        "ì": "i",
-        "ñ": "n",
-        "à": "a",
-        "á": "a",
-        "é": "e",
-        "è": "e"
-    }
     s = s.str.lower() 
     s = s.replace("\\. ", " ", regex = True)
     s = s.replace("-", replace_hyphen, regex = True)
@@ -47,6 +54,46 @@ def normalize_string(s, replace_hyphen = ""):
 
 
 
+# one-pass version of `normalize_string`:
+    # - "\. " -> " " and "\." -> "" together remove all dots
+    # - every whitespace character is also matched by [^\w\d], so the last two 
+    #   regexes are the same as replacing runs of [^\w\d] with a single space
+non_word_pattern = re.compile(r"[^\w\d]+")
+
+
+def make_translation_table(replace_hyphen=""):
+    "Translation table for `normalize_one_string`."
+    table = {".": None, "-": replace_hyphen}
+    table.update(letters_to_replace)
+    return str.maketrans(table)
+
+
+def normalize_one_string(x, table):
+    "Normalize the string `x` in one pass; `table` is from `make_translation_table`."
+    return non_word_pattern.sub(" ", x.lower().translate(table)).strip()
+
+
+def _normalize_strings(s, replace_hyphen):
+    table = make_translation_table(replace_hyphen)
+    return s.map(lambda x: normalize_one_string(x, table) if isinstance(x, str) else x)
+
+
+def normalize_string_fast(s, replace_hyphen="", n_jobs=1):
+    """
+    Normalize the character strings in a pd.Series. Same output as `normalize_string`,
+    but each string is transformed in one pass.
+    With `n_jobs` > 1, chunks of `s` are processed in parallel.
+    """
+    s = s.str.lower() # as in `normalize_string`: values that are not strings become NaN
+    if n_jobs <= 1 or s.shape[0] < 2 * n_jobs:
+        return _normalize_strings(s, replace_hyphen)
+    chunk_size = -(-s.shape[0] // n_jobs)
+    chunks = [s.iloc[i:i + chunk_size] for i in range(0, s.shape[0], chunk_size)]
+    with mp.Pool(n_jobs) as pool:
+        out = pool.starmap(_normalize_strings, [(chunk, replace_hyphen) for chunk in chunks])
+    return pd.concat(out)
+
+
 def drop_firstword(s, x):
     """
     Drop first word in string `s` if it is `x` 
@@ -58,6 +105,19 @@ def drop_firstword(s, x):
     return out
 
 
+def apply_to_unique(df, columns, fnc):
+    """
+    Same as `df.apply(lambda row: fnc(*row[columns]), axis="columns")`, 
+    but `fnc` is called only once for each unique combination of `columns`.
+    """
+    unique_rows = df[columns].drop_duplicates()
+    results = [fnc(*values) for values in unique_rows.itertuples(index=False, name=None)]
+    mapping = unique_rows.assign(_result=results)
+    out = df[columns].merge(mapping, on=columns, how="left")["_result"]
+    out.index = df.index
+    return out.rename(None)
+
+
 def tupelize_links(links, iteration_id):
     """
     Return a tuple from the list `links`; add `iteration_id` as the last element of the tuple.
@@ -67,6 +127,24 @@ def tupelize_links(links, iteration_id):
         yield id0, id1, score, iteration_id
 
 
+def insert_batched(con, sql, rows, batch_size=100_000):
+    """
+    Insert `rows` from an iterable with `con.executemany(sql, ...)`, committing every `batch_size` rows.
+    `con` needs to be in autocommit mode (`isolation_level=None`). Return the number of inserted rows.
+    """
+    rows = iter(rows)
+    n_rows = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if len(batch) == 0:
+            break
+        con.execute("BEGIN")
+        con.executemany(sql, batch)
+        con.execute("COMMIT")
+        n_rows += len(batch)
+    return n_rows
+
+
 def is_numeric(a):
     "Check if a is numeric."
     return isinstance(a, int) | isinstance(a, float)
@@ -121,10 +199,71 @@ def yield_gazetteer(results, iteration_id):
                 yield (messy_id, canon_id, score, iteration_id)            
 
 
+def quantiles_from_histogram(values, counts, quantiles):
+    """
+    Quantiles of the data with distinct `values` that occur `counts` times,
+    with linear interpolation as in `np.quantile` and `pd.Series.quantile`.
+    `values` need to be sorted.
+    """
+    values, counts = np.asarray(values, dtype=np.float64), np.asarray(counts)
+    cum_counts = np.cumsum(counts)
+    quantiles = np.asarray(quantiles, dtype=np.float64)
+    position = (cum_counts[-1] - 1) * quantiles
+    lower = np.floor(position)
+    value_at = lambda rank: values[np.searchsorted(cum_counts, rank, side="right")]
+    lower_value = value_at(lower)
+    upper_value = value_at(np.minimum(lower + 1, cum_counts[-1] - 1))
+    weight = position - lower
+    difference = upper_value - lower_value
+    # interpolate from the closer end, as numpy does
+    return np.where(weight >= 0.5, upper_value - difference * (1 - weight), lower_value + difference * weight)
+
+
 def enumerated_arguments(*args, limit=None):
     """From a generator *args, yield a tuple (i, *args[i]) for i in range(len(args)). 
     limit: int or None
         If not None, only return the first `limit` tuples.    
     """
     for i, k in enumerate(itertools.islice(*args, limit)):
-        yield ((i,) + tuple([j for j in k]))
\ No newline at end of file
+        yield ((i,) + tuple([j for j in k]))
+
+def write_build_marker(con, table):
+    """
+    Record a new build id for `table` in the table build_markers. 
+    Call this in the scripts that create `table`, so that caches built from 
+    `table` can tell that it was rebuilt (see `read_build_markers`).
+    """
+    con.execute("CREATE TABLE IF NOT EXISTS build_markers (TableName TEXT PRIMARY KEY, BuildId TEXT, BuildTime REAL)")
+    con.execute("INSERT OR REPLACE INTO build_markers VALUES (?, ?, ?)", (table, uuid.uuid4().hex, time.time()))
+
+
+def read_build_markers(con, tables):
+    """
+    Dict with the build id of each table in `tables`; None for tables without build id.
+    """
+    exists = con.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'build_markers'").fetchone()[0]
+    markers = {}
+    if exists:
+        markers = dict(con.execute(
+            f"SELECT TableName, BuildId FROM build_markers WHERE TableName IN ({', '.join(['?'] * len(tables))})",
+            list(tables)
+        ).fetchall())
+    return {tbl: markers.get(tbl) for tbl in tables}
+
+
+def table_fingerprint(con, tables):
+    """Cheap fingerprint of sqlite tables: root page and largest rowid; None for missing tables.
+    A table that is created again with the same number of rows can have the same
+    fingerprint. Use it together with `read_build_markers`.
+    """
+    out = {}
+    for tbl in tables:
+        rootpage = con.execute(
+            "SELECT rootpage FROM sqlite_master WHERE type = 'table' AND name = ?", (tbl,)
+        ).fetchone()
+        if rootpage is None:
+            out[tbl] = None
+        else:
+            max_rowid = con.execute(f"SELECT MAX(rowid) FROM {tbl}").fetchone()[0]
+            out[tbl] = [rootpage[0], max_rowid]
+    return out
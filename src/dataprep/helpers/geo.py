@@ -0,0 +1,87 @@
+"""
+Vectorized geodesic distances between points given as latitude and longitude in degrees.
+
+`geodesic_km` solves Vincenty's inverse problem on the WGS-84 ellipsoid for
+arrays of points at once. The result agrees with `geopy.distance.distance`
+to well below a meter; the few nearly antipodal pairs for which the iteration
+does not converge are computed with geopy.
+"""
+
+import numpy as np
+from geopy import distance
+
+
+# WGS-84, as in geopy
+a_km = 6378.137
+f = 1 / 298.257223563
+b_km = (1 - f) * a_km
+
+
+def geodesic_km(lat1, lon1, lat2, lon2, tol=1e-12, max_iter=200):
+    """
+    Distance in km between (lat1, lon1) and (lat2, lon2).
+    The inputs are broadcast against each other; NaN coordinates give NaN.
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*[np.asarray(x, dtype=np.float64) for x in [lat1, lon1, lat2, lon2]])
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cosU2 * sin_lam, cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)
+            cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cosU1 * cosU2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # cos2_alpha is 0 for points on the equator
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha)
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * f * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+            )
+            converged = np.abs(lam - lam_prev) < tol
+            if np.all(converged | np.isnan(lam)):
+                break
+
+        u2 = cos2_alpha * (a_km ** 2 - b_km ** 2) / b_km ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (
+            cos_2sigma_m + B / 4 * (
+                cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+                - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+            )
+        )
+        out = np.array(b_km * A * (sigma - delta_sigma))
+
+    not_converged = ~converged & ~np.isnan(out)
+    for i in map(tuple, np.argwhere(not_converged)):
+        out[i] = distance.distance((lat1[i], lon1[i]), (lat2[i], lon2[i])).km
+    return out
+
+
+def distance_blocks(ids, lat, lon, block_size=1000, max_km=None):
+    """
+    Distances between all pairs of points, computed in blocks of `block_size` points
+    against all points, so that at most `block_size * len(ids)` distances are in memory.
+
+    Yields tuples (id, id2, distance_km) of arrays for each block. The pairs include
+    each point with itself and both orders of each pair. If `max_km` is given,
+    only the pairs with distance_km <= `max_km` are kept.
+    """
+    ids, lat, lon = np.asarray(ids), np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    for start in range(0, len(ids), block_size):
+        end = min(start + block_size, len(ids))
+        d = geodesic_km(lat[start:end, None], lon[start:end, None], lat[None, :], lon[None, :])
+        if max_km is not None:
+            rows, cols = np.nonzero(d <= max_km)
+        else:
+            rows, cols = np.divmod(np.arange(d.size), len(ids))
+        yield ids[start + rows], ids[cols], d[rows, cols]
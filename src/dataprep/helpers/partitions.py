@@ -0,0 +1,135 @@
+"""
+Run CREATE TABLE ... AS SELECT queries in partitions of an integer key, in parallel.
+
+The query is split into partitions of a key, for instance AuthorId or PaperId.
+Each worker process reads the database through a read-only connection and
+writes its partition into its own scratch database. The partitions are then
+merged into the target table with INSERT INTO ... SELECT, in the order of the key.
+
+This gives the same table as the unpartitioned query only if every output row
+depends on the input rows with the same key, for instance if the query groups or
+partitions by the key. The queries can only read tables in the database file,
+not temporary tables of the connection that creates the table.
+
+The query marks where to filter on the key with `partition_filter`, which
+is replaced by a condition, for instance
+    f"SELECT ... FROM PaperAuthorUnique AS a WHERE {partition_filter} GROUP BY a.AuthorId"
+Without partitions, the condition is always true. Rows with missing keys
+are only kept without partitions.
+"""
+
+import os
+import shutil
+import tempfile
+import multiprocessing as mp
+import sqlite3 as sqlite
+
+
+partition_filter = "{partition}"
+
+
+def key_ranges(con, table, column, n_partitions):
+    """
+    Split the values of `column` in `table` into `n_partitions` ranges with about
+    the same number of distinct values.
+
+    Returns a list of (low, high), where the range contains the keys with low < key <= high.
+    The first range has no lower bound and the last range has no upper bound (None),
+    so the ranges cover all keys, also the ones that are not in `table`.
+    Returns None if `n_partitions` <= 1.
+    `column` should be indexed in `table`.
+    """
+    if n_partitions <= 1:
+        return None
+    query = f"""
+        SELECT MAX({column})
+        FROM (
+            SELECT {column}, NTILE(?) OVER (ORDER BY {column}) AS part
+            FROM (
+                SELECT DISTINCT {column}
+                FROM {table}
+                WHERE {column} IS NOT NULL
+            )
+        )
+        GROUP BY part
+        ORDER BY part
+    """
+    bounds = [high for (high, ) in con.execute(query, (n_partitions, )).fetchall()][:-1]
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def range_condition(key, low, high):
+    "SQL condition for `key` in the range (`low`, `high`]."
+    conditions = []
+    if low is not None:
+        conditions.append(f"{key} > {int(low)}")
+    if high is not None:
+        conditions.append(f"{key} <= {int(high)}")
+    if len(conditions) == 0:
+        return f"{key} IS NOT NULL"
+    return " AND ".join(conditions)
+
+
+def _create_partition(db_file, table, query, params, part_file):
+    "Create `table` with `query` on `db_file` in the new database `part_file`."
+    con = sqlite.connect(database="file:" + part_file + "?mode=rwc", isolation_level=None, uri=True)
+    con.execute("PRAGMA journal_mode = OFF") # throwaway file
+    con.execute("PRAGMA synchronous = OFF")
+    # the main database of `con` is empty, so unqualified table names in `query` refer to `db_file`
+    con.execute("ATTACH DATABASE ? AS source", ("file:" + db_file + "?mode=ro", ))
+    con.execute(f"CREATE TABLE {table} AS {query}", params)
+    con.close()
+
+
+def create_table_partitioned(con, db_file, table, query, params=(), key=None, ranges=None,
+                             temporary=False, n_jobs=None, scratch_dir=None):
+    """
+    Create `table` from `query` on `con`, with the query run in partitions of `key` in parallel.
+
+    Parameters
+    ----------
+    con: sqlite connection to `db_file`, without open transaction. `table` must not exist yet.
+    db_file: str
+        Path of the database; read by the workers.
+    table: str
+        Name of the table to create.
+    query: str
+        SELECT statement with `partition_filter` in a WHERE clause.
+    params: tuple
+        Parameters of `query`.
+    key: str
+        Column in `query` to partition on, for instance "a.AuthorId".
+    ranges: list of (low, high) from `key_ranges`. If None, `query` is run once on `con`.
+    temporary: bool
+        Create `table` as temporary table of `con`.
+    n_jobs: int
+        Number of worker processes. Defaults to the smaller of the number of ranges and cpus.
+    scratch_dir: str
+        Directory for the scratch databases. Defaults to the directory of `db_file`.
+    """
+    create = f"CREATE {'TEMP ' if temporary else ''}TABLE {table} AS"
+    if ranges is None:
+        con.execute(f"{create} {query.replace(partition_filter, '1')}", params)
+        return
+
+    queries = [query.replace(partition_filter, range_condition(key, low, high)) for low, high in ranges]
+    scratch = tempfile.mkdtemp(prefix=f"{table}_", dir=scratch_dir or os.path.dirname(os.path.abspath(db_file)))
+    part_files = [os.path.join(scratch, f"part_{i}.sqlite") for i in range(len(ranges))]
+    if n_jobs is None:
+        n_jobs = min(len(ranges), mp.cpu_count())
+    try:
+        with mp.Pool(n_jobs) as pool:
+            pool.starmap(_create_partition,
+                         [(db_file, table, q, params, f) for q, f in zip(queries, part_files)])
+        for i, part_file in enumerate(part_files):
+            con.execute("ATTACH DATABASE ? AS part", (part_file, ))
+            con.execute("BEGIN")
+            if i == 0:
+                con.execute(f"{create} SELECT * FROM part.{table}")
+            else:
+                con.execute(f"INSERT INTO {table} SELECT * FROM part.{table}")
+            con.execute("COMMIT")
+            con.execute("DETACH DATABASE part")
+            os.remove(part_file)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
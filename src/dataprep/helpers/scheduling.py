@@ -0,0 +1,104 @@
+"""
+Run a function on chunks of data in worker processes, most expensive chunk first.
+"""
+
+import time
+import logging
+import collections
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+
+def timed_call(func, data):
+    "Call `func` on `data` and return the elapsed time in minutes."
+    start_time = time.time()
+    func(data)
+    return (time.time() - start_time) / 60
+
+
+def run_scheduled(func, inputs, n_cores, mp_context, max_retries=0, on_done=None):
+    """Run `func` on the data in `inputs` in parallel, most expensive first.
+
+    Each idle worker takes the next chunk from the queue, so that the few
+    expensive chunks start early and the cheap ones fill the gaps at the end.
+    Chunks that raise an error are resubmitted up to `max_retries` times.
+
+    If a worker dies (for instance, killed when out of memory), the pool breaks
+    and all chunks running in it are lost. The pool is replaced and the lost chunks
+    are run again, one at a time: the chunk that breaks the pool while running
+    alone counts as failed attempt; the others are not charged.
+
+    Parameters:
+    ----------
+    func: function to call on each data
+    inputs: list of (label, cost, data)
+    n_cores: int
+    mp_context: multiprocessing context
+    max_retries: int
+    on_done: function called in the parent process with the data of each chunk
+        that is finished, also when it failed after all retries.
+
+    Returns:
+    ----------
+    list of labels of chunks that failed after all retries.
+    """
+    # (label, cost, data, attempt, alone)
+    queue = collections.deque(
+        (label, cost, data, 0, False) for label, cost, data in sorted(inputs, key=lambda x: x[1], reverse=True)
+    )
+    failed = []
+
+    def finish(item):
+        if on_done is not None:
+            on_done(item[2])
+
+    def retry_or_fail(item, e):
+        label, cost, data, attempt, alone = item
+        if attempt < max_retries:
+            logging.warning(f"{label} failed with {e!r}, retrying.")
+            queue.appendleft((label, cost, data, attempt + 1, alone))
+        else:
+            logging.error(f"{label} failed with {e!r}, giving up.")
+            failed.append(label)
+            finish(item)
+
+    executor = ProcessPoolExecutor(max_workers=n_cores, mp_context=mp_context)
+    running = {}
+    try:
+        while queue or running:
+            # submit only as many chunks as there are workers, so that the chunks lost
+            # with a broken pool are known; chunks to run alone wait for an empty pool
+            while queue and len(running) < n_cores and not any(item[4] for item in running.values()):
+                if queue[0][4] and running:
+                    break
+                item = queue.popleft()
+                running[executor.submit(timed_call, func, item[2])] = item
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                # all other running chunks are lost as well
+                done, _ = wait(running)
+            lost = []
+            for future in done:
+                item = running.pop(future)
+                try:
+                    elapsed = future.result()
+                    logging.info(f"{item[0]} (cost={item[1]}) done in {elapsed:.2f} minutes.")
+                    finish(item)
+                except BrokenProcessPool as e:
+                    lost.append((item, e))
+                except Exception as e:
+                    retry_or_fail(item, e)
+            if not lost:
+                continue
+            executor.shutdown(wait=True)
+            executor = ProcessPoolExecutor(max_workers=n_cores, mp_context=mp_context)
+            if len(lost) == 1:
+                item, e = lost[0]
+                retry_or_fail(item, e)
+            else:
+                logging.warning(f"A worker died while running {', '.join(item[0] for item, _ in lost)}; running them one at a time.")
+                lost.sort(key=lambda x: x[0][1])
+                queue.extendleft(item[:4] + (True, ) for item, _ in lost)
+    finally:
+        executor.shutdown(wait=True)
+    return failed
@@ -0,0 +1,114 @@
+"""
+Spatial index over institutions with coordinates
+
+`SpatialIndex` keeps a BallTree with the haversine metric on the coordinates of
+institutions, for instance the cng institutions (`sq.query_cng`) or the MAG
+affiliations (`sq.query_mag`). It answers
+- k-nearest queries: the k closest institutions to some points,
+- radius queries: all institutions within some km of some points,
+- distances between two indexed institutions,
+without computing the distances between all pairs as in cng_distances.
+
+The tree measures distances on a sphere; radius queries search a slightly
+larger radius and all returned distances are the geodesic distances from
+`helpers.geo.geodesic_km`, the same as in cng_distances.
+"""
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+from .geo import geodesic_km
+
+
+earth_radius_km = 6371.0088
+# the spherical distance differs from the geodesic distance by less than 0.6%
+sphere_tolerance = 1.006
+
+
+class SpatialIndex():
+    """Index of institutions by latitude and longitude in degrees.
+    Institutions with missing coordinates are not indexed.
+
+    Args:
+        ids: ids of the institutions.
+        lat, lon: coordinates of the institutions.
+    """
+    def __init__(self, ids, lat, lon):
+        ids, lat, lon = np.asarray(ids), np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+        keep = ~(np.isnan(lat) | np.isnan(lon))
+        self.ids = ids[keep]
+        self.lat = lat[keep]
+        self.lon = lon[keep]
+        self.position = pd.Series(np.arange(len(self.ids)), index=self.ids)
+        self.tree = BallTree(np.radians(np.column_stack([self.lat, self.lon])), metric="haversine")
+
+    @classmethod
+    def from_db(cls, con, query, id_col):
+        "Index the institutions from `query` with columns `id_col`, lat and lon."
+        with con:
+            df = pd.read_sql(sql=query, con=con)
+        return cls(df[id_col], df["lat"], df["lon"])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _to_frame(self, query_ids, lat, lon, positions):
+        "Pairs of `query_ids` and the indexed institutions at `positions` with their distance."
+        n_matches = [len(p) for p in positions]
+        rows = np.repeat(np.arange(len(query_ids)), n_matches)
+        positions = np.concatenate(positions).astype(np.int64) if len(positions) > 0 else np.array([], dtype=np.int64)
+        return pd.DataFrame({
+            "query_id": np.asarray(query_ids)[rows],
+            "id": self.ids[positions],
+            "distance_km": geodesic_km(lat[rows], lon[rows], self.lat[positions], self.lon[positions])
+        })
+
+    def nearest(self, query_ids, lat, lon, k=1):
+        """The `k` nearest indexed institutions to each point (lat, lon).
+        Returns a DataFrame with columns query_id, id and distance_km.
+        The neighbors are found and ordered by the spherical distance of the tree, not
+        by the geodesic distance_km: when two institutions are at almost the same
+        distance (less than 0.6% apart), the order and the k-th neighbor can differ
+        from the geodesic ones. Sort by distance_km if the order matters.
+        """
+        lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+        # ordered by spherical distance, see above
+        _, positions = self.tree.query(np.radians(np.column_stack([lat, lon])), k=min(k, len(self)))
+        return self._to_frame(query_ids, lat, lon, list(positions))
+
+    def within(self, query_ids, lat, lon, radius_km):
+        """All indexed institutions within `radius_km` of each point (lat, lon).
+        Returns a DataFrame with columns query_id, id and distance_km.
+        """
+        lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+        positions = self.tree.query_radius(np.radians(np.column_stack([lat, lon])),
+                                           r=radius_km * sphere_tolerance / earth_radius_km)
+        out = self._to_frame(query_ids, lat, lon, list(positions))
+        return out.loc[out["distance_km"] <= radius_km].reset_index(drop=True)
+
+    def distance(self, id1, id2):
+        "Geodesic distance in km between the indexed institutions `id1` and `id2` (scalars or arrays)."
+        p1 = self.position.loc[np.atleast_1d(id1)].to_numpy()
+        p2 = self.position.loc[np.atleast_1d(id2)].to_numpy()
+        d = geodesic_km(self.lat[p1], self.lon[p1], self.lat[p2], self.lon[p2])
+        return d if np.ndim(id1) > 0 or np.ndim(id2) > 0 else d[0]
+
+
+def candidate_pairs(data_1, data_2, radius_km):
+    """Blocking for dedupe on the distance between records: yield the record pairs 
+    ((id_1, record_1), (id_2, record_2)) within `radius_km`, in the format of `linker.pairs()`.
+
+    `data_1` and `data_2` are dicts of records with a "location" (lat, lon), as in link_cng_mag.py.
+    """
+    coordinates = {}
+    for name, data in [("data_1", data_1), ("data_2", data_2)]:
+        ids = list(data.keys())
+        location = np.array([data[k]["location"] for k in ids], dtype=np.float64).reshape(-1, 2)
+        coordinates[name] = (ids, location[:, 0], location[:, 1])
+    index = SpatialIndex(*coordinates["data_2"])
+    ids, lat, lon = coordinates["data_1"]
+    keep = ~(np.isnan(lat) | np.isnan(lon))
+    pairs = index.within(np.asarray(ids)[keep], lat[keep], lon[keep], radius_km)
+    for id_1, id_2 in zip(pairs["query_id"].tolist(), pairs["id"].tolist()):
+        yield (id_1, data_1[id_1]), (id_2, data_2[id_2])
@@ -0,0 +1,164 @@
+"""
+Stream MAG raw files into sqlite
+
+The raw files are tab-separated, with one record per line, no quoting and
+"\\r" characters that need to be removed. `read_rows` streams the records of a
+file; `load_table` writes them to a table in large transactions, with the same
+result as `.import` of the sqlite3 shell in ascii mode:
+- all values are inserted as text and converted by the type affinity of the columns,
+- missing fields at the end of a line are NULL, additional fields are ignored.
+Unlike `.import`, lines that are not valid UTF-8 raise an error instead of
+being stored as they are.
+
+Progress is recorded in a separate checkpoint database (`Checkpoints`), so that
+a failed run can resume at the step that failed. The load itself runs without
+rollback journal (`fast_load`); a step is recorded only after the journal is
+turned on again and the database file is synced.
+"""
+
+import os
+import logging
+import contextlib
+import sqlite3 as sqlite
+
+from .functions import insert_batched
+
+
+def read_rows(filename, n_columns, nlines=None):
+    "Yield the records in `filename` as tuples of `n_columns` strings, removing all '\\r'."
+    with open(filename, "rb") as f:
+        for i, line in enumerate(f):
+            if nlines is not None and i >= nlines:
+                break
+            try:
+                values = line.replace(b"\r", b"").rstrip(b"\n").decode("utf-8").split("\t")
+            except UnicodeDecodeError as e:
+                raise ValueError(f"{filename}, line {i + 1}: not valid UTF-8: {line[:200]!r}") from e
+            if len(values) < n_columns:
+                values += [None] * (n_columns - len(values))
+            yield tuple(values[:n_columns])
+
+
+def table_columns(con, tbl):
+    return [row[1] for row in con.execute(f"PRAGMA table_info({tbl})")]
+
+
+def fast_load_pragmas(con):
+    """Turn off syncing and the rollback journal for loading.
+    The database may be corrupt if the process crashes; reload the tables in that case.
+    """
+    con.execute("PRAGMA synchronous = OFF")
+    con.execute("PRAGMA journal_mode = OFF")
+
+
+def default_pragmas(con):
+    con.execute("PRAGMA journal_mode = DELETE")
+    con.execute("PRAGMA synchronous = FULL")
+
+
+def sync_file(path):
+    "Flush the file at `path` to disk."
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def fast_load(con, db_path):
+    """Run the block with `fast_load_pragmas` on `con`, the connection to the database
+    at `db_path`. Afterwards, restore `default_pragmas` and sync the database file,
+    so that the changes of the block are on disk when it returns.
+    """
+    fast_load_pragmas(con)
+    try:
+        yield con
+    finally:
+        default_pragmas(con)
+    sync_file(db_path)
+
+
+def load_table(con, tbl, setup, rawdatapath, nlines=None, batch_size=1_000_000):
+    """Create table `tbl` in `con` as defined in `setup` (an entry of MAGtables_setup)
+    and load the raw file into it. Does not create the indexes. Return the number of rows.
+    """
+    con.execute(f"DROP TABLE IF EXISTS {tbl}")
+    con.execute(setup["sql_create_table"])
+    n_columns = len(table_columns(con, tbl))
+    sql = f"INSERT INTO {tbl} VALUES ({', '.join(['?'] * n_columns)})"
+    rows = read_rows(f"{rawdatapath}{setup['rawfile']}", n_columns, nlines)
+    return insert_batched(con, sql, rows, batch_size=batch_size)
+
+
+def load_table_to_file(tbl, setup, rawdatapath, db_path, nlines=None, batch_size=1_000_000):
+    "Load `tbl` into a separate database at `db_path`, for instance in a worker process."
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    con = sqlite.connect(database=db_path, isolation_level=None)
+    fast_load_pragmas(con)
+    n_rows = load_table(con, tbl, setup, rawdatapath, nlines, batch_size)
+    con.close()
+    return tbl, db_path, n_rows
+
+
+def merge_table(con, tbl, setup, db_path):
+    """Copy `tbl` from the database at `db_path` into `con` and delete the file.
+    `tbl` is created with the definition in `setup`, so that the columns keep their types.
+    """
+    con.execute(f"ATTACH DATABASE '{db_path}' AS part")
+    con.execute(f"DROP TABLE IF EXISTS main.{tbl}")
+    con.execute(setup["sql_create_table"])
+    con.execute("BEGIN")
+    con.execute(f"INSERT INTO main.{tbl} SELECT * FROM part.{tbl}")
+    con.execute("COMMIT")
+    con.execute("DETACH DATABASE part")
+    os.remove(db_path)
+
+
+class Checkpoints():
+    """Steps of the load that are done, stored in the table `load_checkpoints` of the
+    database `path`. This is not the database that is loaded, which runs without
+    journal and can be corrupt after a crash.
+
+    Args:
+        path: path of the checkpoint database.
+        restart: if True, forget the steps done in earlier runs.
+    """
+    def __init__(self, path, restart=False):
+        self.path = path
+        if restart and os.path.exists(path):
+            os.remove(path)
+        self.con = con = sqlite.connect(database=path, isolation_level=None)
+        default_pragmas(con)
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS load_checkpoints (
+                step TEXT PRIMARY KEY
+                , n_rows INT
+                , date TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+    def done(self, step):
+        return self.con.execute(
+            "SELECT 1 FROM load_checkpoints WHERE step = ?", (step,)
+        ).fetchone() is not None
+
+    def mark(self, step, n_rows=None):
+        logging.info(f"Done: {step}")
+        self.con.execute("INSERT OR REPLACE INTO load_checkpoints (step, n_rows) VALUES (?, ?)", (step, n_rows))
+
+    def run(self, step, func, *args):
+        """Run `func(*args)` unless `step` is done. 
+        If `func` returns an int, it is recorded as the number of rows.
+        """
+        if self.done(step):
+            logging.info(f"Skipping {step}: done in an earlier run")
+            return
+        n_rows = func(*args)
+        self.mark(step, n_rows if isinstance(n_rows, int) else None)
+
+    def clear(self):
+        "Delete the checkpoint database."
+        self.con.close()
+        os.remove(self.path)
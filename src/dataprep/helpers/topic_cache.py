@@ -0,0 +1,210 @@
+"""
+On-disk cache of yearly concept vectors for main/link/topic_similarity.py
+
+The topics of affiliations and of potential collaborators are stored by
+(AffiliationId or AuthorId, Field0, Year, FieldOfStudyId) for a given `max_level`,
+as numpy structured arrays in `.npy` files that are read memory-mapped.
+A chunk (degree year x field) then only selects the years in its window
+from the cache, instead of querying the database again. The yearly vectors
+are summed over the window in topic_similarity_functions.py, as for the
+queried data.
+
+- Affiliations: one file per (Field0, max_level), with all years.
+- Authors: filled lazily. Each chunk queries all years of the authors that
+    are not yet in the cache and writes them into a new part file.
+    Workers running in parallel may write the same author twice; duplicates
+    are dropped when reading. Each part is filtered memory-mapped, so only
+    the records of the queried authors are read into memory. When all chunks
+    of a field are done, `compact()` merges its parts into one.
+
+The cache is invalidated when the source tables change: `validate()` compares
+the build ids that the scripts creating the source tables write with
+`helpers.functions.write_build_marker`, and a fingerprint of the tables,
+with the ones stored in the cache directory.
+"""
+
+import os
+import json
+import uuid
+import glob
+import shutil
+import logging
+import numpy as np
+import numpy.lib.recfunctions as rfn
+import pandas as pd
+
+from .functions import read_build_markers, table_fingerprint
+
+
+source_tables = {
+    "affiliation": ["affiliation_fields", "affiliation_outcomes", "links_to_cng"],
+    "author": ["author_fields_detailed", "author_fields"]
+}
+
+cache_dtype = np.dtype([
+    ("unit", np.int64),
+    ("Field0", np.int64),
+    ("Year", np.int32),
+    ("FieldOfStudyId", np.int64),
+    ("Score", np.float64)
+])
+
+
+def clear_cache(cache_dir):
+    "Delete all cached concept vectors in `cache_dir`."
+    if os.path.isdir(cache_dir):
+        logging.info(f"Clearing concept vector cache in {cache_dir}")
+        shutil.rmtree(cache_dir)
+
+
+def df_to_records(df, unit):
+    "Convert a dataframe with topics to a structured array with `cache_dtype`."
+    out = np.empty(df.shape[0], dtype=cache_dtype)
+    out["unit"] = df[unit].to_numpy()
+    for col in ["Field0", "Year", "FieldOfStudyId", "Score"]:
+        out[col] = df[col].to_numpy()
+    return out
+
+
+def records_to_df(records, unit):
+    "Convert a structured array with `cache_dtype` to a dataframe."
+    return pd.DataFrame({
+        unit: records["unit"],
+        "Field0": records["Field0"],
+        "Year": records["Year"],
+        "FieldOfStudyId": records["FieldOfStudyId"],
+        "Score": records["Score"]
+    })
+
+
+def save_atomic(path, arr):
+    "Save `arr` to `path` such that readers never see a partially written file."
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp_path, path)
+
+
+class ConceptVectorCache():
+    """Cache of yearly concept vectors of affiliations and authors.
+
+    Args:
+        cache_dir: directory to store the cache.
+        max_level: maximum level for FieldsOfStudy in the concept vectors.
+    """
+    def __init__(self, cache_dir, max_level):
+        self.cache_dir = cache_dir
+        self.max_level = max_level
+        self.fingerprint_file = os.path.join(cache_dir, "fingerprint.json")
+
+    def validate(self, con):
+        """Clear the cache if the source tables changed since it was filled.
+        Call this once before starting the workers.
+        """
+        tables = [t for tables in source_tables.values() for t in tables]
+        fingerprints = table_fingerprint(con, tables)
+        build_ids = read_build_markers(con, tables)
+        current = {tbl: [fingerprints[tbl], build_ids[tbl]] for tbl in tables}
+        if os.path.isfile(self.fingerprint_file):
+            with open(self.fingerprint_file) as f:
+                stored = json.load(f)
+            if stored != current:
+                logging.info("Source tables changed.")
+                clear_cache(self.cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self.fingerprint_file, "w") as f:
+            json.dump(current, f)
+
+    def _path(self, kind, field, suffix=""):
+        return os.path.join(self.cache_dir, f"{kind}-field{field}-maxlevel{self.max_level}{suffix}.npy")
+
+    def affiliation_topics(self, con, queries):
+        """Same output as reading `queries.query_affiliation_topics()`:
+        topics of affiliations by year in the year window of `queries`.
+        """
+        path = self._path("affiliation", queries.field_to_query)
+        if not os.path.isfile(path):
+            logging.debug(f"Filling affiliation cache for field {queries.field_to_query}")
+            with con as c:
+                df = pd.read_sql(con=c, sql=queries.query_affiliation_topics(restrict_years=False))
+            save_atomic(path, df_to_records(df, "AffiliationId"))
+
+        records = np.load(path, mmap_mode="r")
+        records = records[self._in_window(records, queries)]
+        return records_to_df(records, "AffiliationId")
+
+    def collaborators_topics(self, con, queries, author_ids_to_query):
+        """Same output as reading `queries.query_collaborators_topics(author_ids_to_query)`,
+        without the column PaperCount.
+        """
+        author_ids_to_query = np.asarray(author_ids_to_query, dtype=np.int64)
+        field = queries.field_to_query
+        parts = self._read_author_parts(field)
+
+        cached_ids = np.concatenate([ids for ids, _, _ in parts] + [np.empty(0, dtype=np.int64)])
+        missing_ids = np.setdiff1d(author_ids_to_query, cached_ids)
+        if missing_ids.shape[0] > 0:
+            logging.debug(f"Adding {missing_ids.shape[0]} authors to the author cache for field {field}")
+            with con as c:
+                df = pd.read_sql(
+                    con=c,
+                    sql=queries.query_collaborators_topics(
+                        author_ids_to_query=missing_ids.tolist(),
+                        restrict_years=False
+                    )
+                )
+            part_id = uuid.uuid4().hex
+            save_atomic(self._path("author", field, f"-part-{part_id}"), df_to_records(df, "AuthorId"))
+            # the ids file marks the part as complete; it is written last
+            save_atomic(self._path("author", field, f"-ids-{part_id}"), missing_ids)
+            parts = self._read_author_parts(field)
+
+        # select from each memory-mapped part before concatenating
+        records = [
+            r[np.isin(r["unit"], author_ids_to_query) & self._in_window(r, queries)]
+            for ids, r, _ in parts if np.isin(ids, author_ids_to_query).any()
+        ]
+        records = np.concatenate(records + [np.empty(0, dtype=cache_dtype)])
+        df = records_to_df(records, "AuthorId")
+        return df.drop_duplicates(subset=["AuthorId", "Field0", "Year", "FieldOfStudyId"])
+
+    def compact(self, field):
+        """Merge all author parts of `field` into one part, without duplicates.
+        Call this when no worker uses the cache of `field` any more.
+        """
+        parts = self._read_author_parts(field)
+        if len(parts) > 1:
+            logging.debug(f"Compacting {len(parts)} parts of the author cache for field {field}")
+            ids = np.unique(np.concatenate([ids for ids, _, _ in parts]))
+            records = np.concatenate([r for _, r, _ in parts])
+            # drop duplicates by key as in `collaborators_topics`; the output is sorted by key
+            key = rfn.repack_fields(records[["unit", "Field0", "Year", "FieldOfStudyId"]])
+            _, first = np.unique(key, return_index=True)
+            records = records[first]
+            part_id = uuid.uuid4().hex
+            save_atomic(self._path("author", field, f"-part-{part_id}"), records)
+            save_atomic(self._path("author", field, f"-ids-{part_id}"), ids)
+            for _, _, ids_path in parts:
+                # remove the ids file first: a part without ids file is never read
+                os.remove(ids_path)
+                os.remove(ids_path.replace("-ids-", "-part-"))
+        # parts of chunks that failed before writing their ids file
+        complete = {p.replace("-ids-", "-part-") for p in glob.glob(self._path("author", field, "-ids-*"))}
+        for part_path in glob.glob(self._path("author", field, "-part-*")):
+            if part_path not in complete:
+                os.remove(part_path)
+
+    def _read_author_parts(self, field):
+        "Return list of (author ids, records, path of the ids file) for all complete part files of `field`."
+        parts = []
+        for ids_path in glob.glob(self._path("author", field, "-ids-*")):
+            part_path = ids_path.replace("-ids-", "-part-")
+            parts.append((np.load(ids_path), np.load(part_path, mmap_mode="r"), ids_path))
+        return parts
+
+    def _in_window(self, records, queries):
+        "Boolean mask for records in the year window of `queries`."
+        return (
+            (records["Year"] <= queries.degree_year_to_query + queries.window_size)
+            & (records["Year"] >= queries.degree_year_to_query - queries.window_size)
+        )
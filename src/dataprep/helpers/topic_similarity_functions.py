@@ -1,7 +1,8 @@
 import pandas as pd 
 import numpy as np 
+from scipy import sparse
 
-import main.link.similarity_helpers as sim_helpers
+from . import similarity_helpers as sim_helpers
 import logging 
 
 
@@ -31,6 +32,15 @@ class QueryBuilder():
             AND Year >= {degree_year_to_query} - {window_size}
         """
         self.max_level = max_level
+
+    def _year_restriction(self, restrict_years=True, year_column="Year"):
+        if restrict_years:
+            return f"""
+            WHERE {year_column} <= {self.degree_year_to_query} + {self.window_size}
+            AND {year_column} >= {self.degree_year_to_query} - {self.window_size}
+        """
+        else:
+            return "WHERE 1 = 1"
    
     def query_affiliations(self):
         q = """
@@ -65,14 +75,20 @@ class QueryBuilder():
         """
         return q 
             
-    def query_graduates(self):
+    def query_graduates(self, restrict_year_field=True):
+        if restrict_year_field:
+            year_restriction = f"WHERE degree_year = {self.degree_year_to_query}"
+            field_restriction = f"AND field0 = {self.field_to_query}"
+        else:
+            year_restriction = "WHERE 1 = 1"
+            field_restriction = ""
         q = f"""
             SELECT goid, AuthorId, degree_year, Field0
             FROM current_links
             INNER JOIN (
                 SELECT goid, degree_year
                 FROM pq_authors
-                WHERE degree_year = {self.degree_year_to_query}
+                {year_restriction}
             ) USING(goid)
             INNER JOIN (
                 SELECT goid, Field0
@@ -84,7 +100,7 @@ class QueryBuilder():
                     FROM pq_fields_mag
                 )
                 WHERE position = min_position
-                    AND field0 = {self.field_to_query}
+                    {field_restriction}
             ) USING(goid)
         """
         return q 
@@ -134,7 +150,7 @@ class QueryBuilder():
             """
         return q
 
-    def query_collaborators(self, affiliation_ids_to_query=None):
+    def query_collaborators(self, affiliation_ids_to_query=None, restrict_years=True):
         q = f"""
             SELECT *
             FROM AuthorAffiliation 
@@ -148,7 +164,7 @@ class QueryBuilder():
                     AND FieldOfStudyId = {self.field_to_query}
             ) c
             USING(AuthorId)
-            {self.year_restriction}
+            {self._year_restriction(restrict_years)}
         """
         if affiliation_ids_to_query is not None:
             assert isinstance(affiliation_ids_to_query, list)
@@ -179,8 +195,34 @@ class QueryBuilder():
                 )
         """
         return q 
+
+    def query_author_papercount(self):
+        "Number of papers of relevant authors by year, for all years."
+        keep_authors = f"""
+            SELECT AuthorId 
+            FROM (
+                {self.query_collaborators(restrict_years=False)}
+            )
+        """
+        q = f"""
+            SELECT AuthorId, Year, COUNT(DISTINCT PaperId) AS PaperCount
+            FROM PaperAuthorUnique 
+            INNER JOIN (
+                SELECT PaperId, Year 
+                FROM Papers 
+                WHERE DocType IN ({self.qmarks_doctypes})
+            ) USING(PaperId)
+            WHERE AuthorId IN (
+                {keep_authors}
+            )
+            GROUP BY AuthorId, Year
+        """
+        return q 
     
-    def query_collaborators_topics(self, author_ids_to_query):
+    def query_collaborators_topics(self, author_ids_to_query, restrict_years=True):
+        """Topics of authors by year. If `restrict_years` is False, 
+        query all years instead of the window around `degree_year_to_query`.
+        """
         author_ids_to_query = ", ".join(str(i) for i in author_ids_to_query)
         q = f"""
             SELECT AuthorId
@@ -199,13 +241,15 @@ class QueryBuilder():
         INNER JOIN (
             {self.query_fields_up_to_max_level()}
         ) USING(FieldOfStudyId)
-        {self.year_restriction}
+        {self._year_restriction(restrict_years)}
         AND AuthorId IN ({author_ids_to_query})
         """
         return q 
     
-    def query_affiliation_topics(self):
-
+    def query_affiliation_topics(self, restrict_years=True):
+        """Topics of affiliations by year. If `restrict_years` is False, 
+        query all years instead of the window around `degree_year_to_query`.
+        """
         q = f"""
             SELECT a.AffiliationId
                 , a.Field0
@@ -226,7 +270,7 @@ class QueryBuilder():
             ON a.AffiliationId = c.AffiliationId
                 AND a.Year = c.Year
                 AND a.Field0 = c.Field0
-                {self.year_restriction}
+                {self._year_restriction(restrict_years, year_column="a.Year")}
                 AND a.Field0 = {self.field_to_query}
         """
         return q 
@@ -234,11 +278,25 @@ class QueryBuilder():
 
 ## Support functions 
 
-def compute_similarity(df_A, df_B, unit_A, unit_B, groupvars, fill_A_units = False, debug=False):
+def compute_similarity(df_A, df_B, unit_A, unit_B, groupvars, fill_A_units = False, debug=False, engine="pandas"):
     """Compute similarity between records in df_A and in df_B.
     unit_A and unit_B refer to column names defining the units of observation.
     groupvars define other grouping variables common in df_A and df_B.
+    engine: "pandas" joins and aggregates the long dataframes; "sparse" uses
+        `compute_similarity_sparse`. Both return the same similarities.
     """
+    if engine == "sparse":
+        return compute_similarity_sparse(
+            df_A=df_A, 
+            df_B=df_B, 
+            unit_A=unit_A, 
+            unit_B=unit_B, 
+            groupvars=groupvars, 
+            fill_A_units=fill_A_units
+        )
+    elif engine != "pandas":
+        raise ValueError(f"Unknown engine {engine}. Use 'pandas' or 'sparse'.")
+
     df_A = df_A.rename(columns={"Score": "A"})
     df_B = df_B.rename(columns={"Score": "B"})
 
@@ -291,6 +349,173 @@ def compute_similarity(df_A, df_B, unit_A, unit_B, groupvars, fill_A_units = Fal
     return d_AB.loc[:, sim_helpers.unique(outvars)]
 
 
+def compute_similarity_sparse(df_A, df_B, unit_A, unit_B, groupvars, fill_A_units=False):
+    """Compute similarity between records in df_A and in df_B with sparse matrices.
+
+    Rows of the matrices are the units (unit_A + groupvars, unit_B + groupvars), 
+    columns are the FieldOfStudyIds within groupvars. Because the columns are 
+    specific to the groupvars, one sparse matrix product gives the dot products 
+    of all pairs within each groupvar block. 
+    Arguments and output are the same as in `compute_similarity`; the output 
+    is sorted by unit_A + unit_B + groupvars.
+    """
+    keys_A = sim_helpers.unique(unit_A + groupvars)
+    keys_B = sim_helpers.unique(unit_B + groupvars)
+    cols = sim_helpers.unique(groupvars + ["FieldOfStudyId"])
+    outvars = sim_helpers.unique(unit_A + unit_B + groupvars + ["sim"])
+
+    required_ids = df_A.loc[:, unit_A].drop_duplicates()
+
+    df_A = df_A.loc[~df_A["FieldOfStudyId"].isna()]
+    df_B = df_B.loc[~df_B["FieldOfStudyId"].isna()]
+
+    if df_A.shape[0] == 0 or df_B.shape[0] == 0:
+        d_AB = pd.DataFrame(columns=outvars)
+    else:
+        m = SparseTopics(df_A, df_B, keys_A, keys_B, cols)
+        overlap, product = m.products()
+        d_AB = pd.concat(
+            [m.units_A.iloc[overlap.row].reset_index(drop=True),
+             m.units_B.iloc[overlap.col].reset_index(drop=True)],
+            axis=1
+        )
+        d_AB["AB"] = np.asarray(product[overlap.row, overlap.col]).ravel()
+        d_AB["AA"] = m.norm_A[overlap.row]
+        d_AB["BB"] = m.norm_B[overlap.col]
+        d_AB = sim_helpers.cosine_similarity_on_df(d_AB)
+        d_AB = (d_AB
+            .sort_values(sim_helpers.unique(unit_A + unit_B + groupvars))
+            .reset_index(drop=True)
+        )
+
+    if fill_A_units:
+        # fill all units in df_A with similarity of 0
+        d_AB = (required_ids
+            .sort_values(unit_A)
+            .merge(d_AB, on=unit_A, how="left")
+        )
+        d_AB = sim_helpers.fill_nas(d_AB, ["sim"])
+
+    return d_AB.loc[:, outvars]
+
+
+class SparseTopics():
+    """Topics of df_A and df_B as sparse matrices, for `compute_similarity_sparse` 
+    and `most_similar_sparse`.
+
+    Rows of the matrices are the units (keys_A, keys_B), columns are the combinations 
+    in `cols`. `units_A` and `units_B` hold the keys of each row; `units_B` only 
+    the keys that are not in keys_A. `norm_A` and `norm_B` are the sums of squared scores by row.
+    """
+    def __init__(self, df_A, df_B, keys_A, keys_B, cols):
+        row_A = df_A.groupby(keys_A, sort=False).ngroup().to_numpy()
+        row_B = df_B.groupby(keys_B, sort=False).ngroup().to_numpy()
+        col_AB = (pd.concat([df_A.loc[:, cols], df_B.loc[:, cols]], ignore_index=True)
+            .groupby(cols, sort=False)
+            .ngroup()
+            .to_numpy()
+        )
+        col_A = col_AB[:df_A.shape[0]]
+        col_B = col_AB[df_A.shape[0]:]
+
+        n_A, n_B, n_cols = row_A.max() + 1, row_B.max() + 1, col_AB.max() + 1
+        score_A = df_A["Score"].fillna(0).to_numpy(dtype=float)
+        score_B = df_B["Score"].fillna(0).to_numpy(dtype=float)
+
+        self.mat_A = sparse.csr_matrix((score_A, (row_A, col_A)), shape=(n_A, n_cols))
+        self.mat_B = sparse.csr_matrix((score_B, (row_B, col_B)), shape=(n_B, n_cols))
+        # indicator matrices: pairs with at least one common FieldOfStudyId, 
+            # also when the dot product is 0 (as in the inner join of the pandas engine)
+        self.ind_A = sparse.csr_matrix((np.ones(row_A.shape[0]), (row_A, col_A)), shape=(n_A, n_cols))
+        self.ind_B = sparse.csr_matrix((np.ones(row_B.shape[0]), (row_B, col_B)), shape=(n_B, n_cols))
+        self.norm_A = np.bincount(row_A, weights=score_A**2, minlength=n_A)
+        self.norm_B = np.bincount(row_B, weights=score_B**2, minlength=n_B)
+
+        self.units_A = (df_A.loc[:, keys_A]
+            .assign(row=row_A)
+            .drop_duplicates("row")
+            .set_index("row")
+            .sort_index()
+        )
+        self.units_B = (df_B.loc[:, [c for c in keys_B if c not in keys_A]]
+            .assign(row=row_B)
+            .drop_duplicates("row")
+            .set_index("row")
+            .sort_index()
+        )
+
+    def products(self, start=0, end=None):
+        """Overlap (coo) and dot products (csr) of the rows `start` to `end` of A with all rows of B.
+        Row indexes in the output are relative to `start`.
+        """
+        rows = slice(start, end)
+        overlap = (self.ind_A[rows] @ self.ind_B.T).tocoo()
+        product = (self.mat_A[rows] @ self.mat_B.T).tocsr()
+        return overlap, product
+
+
+def most_similar_sparse(df_A, df_B, unit_A, unit_B, groupvars, group_B, block_size=10_000):
+    """For each unit of df_A and groupvars, the units of df_B with the highest similarity 
+    within each `group_B`. 
+
+    Gives the same rows as 
+        keep_most_similar(compute_similarity(df_A, df_B, unit_A, unit_B, groupvars), unit_A + groupvars + group_B)
+    but the similarities are calculated for `block_size` units of df_A at a time, and 
+    reduced to the highest similarity right away. The similarities between all units 
+    are never held in memory. Ties are all kept. The output is sorted by unit_A + unit_B + groupvars.
+    `group_B` must be in `unit_B`.
+    """
+    keys_A = sim_helpers.unique(unit_A + groupvars)
+    keys_B = sim_helpers.unique(unit_B + groupvars)
+    cols = sim_helpers.unique(groupvars + ["FieldOfStudyId"])
+    outvars = sim_helpers.unique(unit_A + unit_B + groupvars + ["sim"])
+
+    df_A = df_A.loc[~df_A["FieldOfStudyId"].isna()]
+    df_B = df_B.loc[~df_B["FieldOfStudyId"].isna()]
+    if df_A.shape[0] == 0 or df_B.shape[0] == 0:
+        return pd.DataFrame(columns=outvars)
+
+    m = SparseTopics(df_A, df_B, keys_A, keys_B, cols)
+    group_of_B = m.units_B.groupby(group_B, sort=False).ngroup().to_numpy()
+    n_A = m.mat_A.shape[0]
+
+    keep_A, keep_B, keep_sim = [], [], []
+    for start in range(0, n_A, block_size):
+        overlap, product = m.products(start, start + block_size)
+        if overlap.nnz == 0:
+            continue
+        row, col = overlap.row, overlap.col
+        AB = np.asarray(product[row, col]).ravel()
+        # same calculation as sim_helpers.cosine_similarity_on_df
+        sim = AB / (np.sqrt(m.norm_A[row + start] + 1e-7) * np.sqrt(m.norm_B[col] + 1e-7))
+        # highest similarity by unit of A and group of B
+        order = np.lexsort((group_of_B[col], row))
+        row, col, sim = row[order], col[order], sim[order]
+        group = group_of_B[col]
+        new_segment = np.concatenate([[True], (row[1:] != row[:-1]) | (group[1:] != group[:-1])])
+        segment_starts = np.flatnonzero(new_segment)
+        max_sim = np.maximum.reduceat(sim, segment_starts)[np.cumsum(new_segment) - 1]
+        keep = sim == max_sim
+        keep_A.append(row[keep] + start)
+        keep_B.append(col[keep])
+        keep_sim.append(sim[keep])
+
+    if len(keep_A) == 0:
+        return pd.DataFrame(columns=outvars)
+    keep_A, keep_B = np.concatenate(keep_A), np.concatenate(keep_B)
+    out = pd.concat(
+        [m.units_A.iloc[keep_A].reset_index(drop=True),
+         m.units_B.iloc[keep_B].reset_index(drop=True)],
+        axis=1
+    )
+    out["sim"] = np.concatenate(keep_sim)
+    out = (out
+        .sort_values(sim_helpers.unique(unit_A + unit_B + groupvars))
+        .reset_index(drop=True)
+    )
+    return out.loc[:, outvars]
+
+
 def complete_to_reference(
     df_in, 
     df_ref, 
@@ -337,15 +562,100 @@ def complete_to_reference(
     return pd.concat(ls_out)
 
 
+class RollingWindowSums():
+    """Sums of yearly values over the pre and post period of a degree year.
+
+    The pre period covers the years [degree_year - window_size, degree_year], 
+    the post period the years (degree_year, degree_year + window_size], as 
+    in `QueryBuilder.year_restriction` and `split_year_pre_post`. 
+    When moving to the next degree year, only the years at the edges of 
+    the windows are added and subtracted. Units that have no data in any year of 
+    a window are dropped, as if the window had been queried directly. 
+    The sums are equal to summing over the window up to floating point rounding.
+
+    Args:
+        df: dataframe with the column Year, the columns in `keys` and `value`
+        keys: columns that identify the units
+        value: column to sum over years
+        window_size: number of years before and after the degree year
+    """
+    def __init__(self, df, keys, value, window_size):
+        self.keys = keys
+        self.value = value
+        self.window_size = window_size
+        self.by_year = {
+            year: g.groupby(keys)[value].sum() for year, g in df.groupby("Year")
+        }
+        self.degree_year = None
+        self.sums = {}
+        self.counts = {}
+
+    def _window(self, period, degree_year):
+        if period == "pre_phd":
+            return range(degree_year - self.window_size, degree_year + 1)
+        else:
+            return range(degree_year + 1, degree_year + self.window_size + 1)
+
+    def _reset(self, degree_year):
+        for period in ["pre_phd", "post_phd"]:
+            years = [self.by_year[y] for y in self._window(period, degree_year) if y in self.by_year]
+            if len(years) > 0:
+                stacked = pd.concat(years)
+                self.sums[period] = stacked.groupby(level=self.keys).sum()
+                self.counts[period] = stacked.groupby(level=self.keys).size()
+            else:
+                self.sums[period] = pd.Series(dtype=float)
+                self.counts[period] = pd.Series(dtype=int)
+
+    def _update(self, period, add_year, subtract_year):
+        sums, counts = self.sums[period], self.counts[period]
+        if add_year in self.by_year:
+            values = self.by_year[add_year]
+            sums = values if sums.shape[0] == 0 else sums.add(values, fill_value=0)
+            ones = pd.Series(1, index=values.index)
+            counts = ones if counts.shape[0] == 0 else counts.add(ones, fill_value=0)
+        if subtract_year in self.by_year:
+            values = self.by_year[subtract_year]
+            sums = sums.sub(values, fill_value=0)
+            counts = counts.sub(pd.Series(1, index=values.index), fill_value=0)
+            keep = counts > 0
+            sums, counts = sums[keep], counts[keep]
+        self.sums[period], self.counts[period] = sums, counts
+
+    def move_to(self, degree_year):
+        "Update the sums to the windows of `degree_year`."
+        step = None if self.degree_year is None else degree_year - self.degree_year
+        if step is None or step < 0 or step > 2 * self.window_size:
+            self._reset(degree_year)
+        else:
+            for y in range(self.degree_year + 1, degree_year + 1):
+                self._update("pre_phd", add_year=y, subtract_year=y - self.window_size - 1)
+                self._update("post_phd", add_year=y + self.window_size, subtract_year=y)
+        self.degree_year = degree_year
+
+    def get(self):
+        "Return a dataframe with the sums by `keys` and period."
+        out = []
+        for period in ["pre_phd", "post_phd"]:
+            sums = self.sums[period]
+            if sums.shape[0] > 0:
+                out.append(sums.rename(self.value).reset_index().assign(period=period))
+        if len(out) == 0:
+            return pd.DataFrame(columns=self.keys + [self.value, "period"])
+        return pd.concat(out, ignore_index=True)
+
+
 ## Main functions here 
 
-def get_student_data(con, queries):
+def get_student_data(con, queries, d_graduates=None):
     """Prepare main data at student level
     
     Parameters:
     ----------
     con: sqlite connection
     queries: QueryBuilder instance
+    d_graduates: dataframe with goid, AuthorId, degree year and Field0, or None.
+        If given, the graduates are not queried.
     
     """
     with con as c:
@@ -359,10 +669,11 @@ def get_student_data(con, queries):
             params=queries.keep_doctypes
         )
         # general tables for later reference
-        d_graduates = pd.read_sql(
-            con=c, 
-            sql=queries.query_graduates()
-        )
+        if d_graduates is None:
+            d_graduates = pd.read_sql(
+                con=c, 
+                sql=queries.query_graduates()
+            )
 
     n_papers_postphd = (topics_postphd
                         .groupby(["AuthorId"])
@@ -440,7 +751,10 @@ def similarity_to_faculty(
         d_graduates,
         student_topics,
         queries,
-        con
+        con,
+        engine="pandas",
+        topic_cache=None,
+        affiliation_topics=None
     ):
     """Calculate similarity between student topics and overall faculty topics.
 
@@ -451,19 +765,28 @@ def similarity_to_faculty(
     student_topics: dataframe with scores by AuthorId, FieldOfStudyId, period and Field0
     queries: QueryBuilder instance
     con: sqlite connection
+    engine: passed to `compute_similarity`
+    topic_cache: ConceptVectorCache instance or None. If given, the topics 
+        of affiliations are read from the cache.
+    affiliation_topics: dataframe with scores by AffiliationId, Field0, FieldOfStudyId
+        and period, or None. If given, the topics of affiliations are not queried.
     """
 
     # Get affiliation topics 
-    with con as c:
-        df_fields = pd.read_sql(con=c, sql=queries.query_affiliation_topics())
-    
-    df_fields = sim_helpers.split_year_pre_post(df=df_fields, ref_year=queries.degree_year_to_query)
+    if affiliation_topics is None:
+        if topic_cache is not None:
+            df_fields = topic_cache.affiliation_topics(con=con, queries=queries)
+        else:
+            with con as c:
+                df_fields = pd.read_sql(con=c, sql=queries.query_affiliation_topics())
+        
+        df_fields = sim_helpers.split_year_pre_post(df=df_fields, ref_year=queries.degree_year_to_query)
 
-    affiliation_topics = (df_fields
-        .groupby(["AffiliationId", "Field0", "FieldOfStudyId", "period"])
-        .agg({"Score": np.sum})
-        .reset_index()
-        )
+        affiliation_topics = (df_fields
+            .groupby(["AffiliationId", "Field0", "FieldOfStudyId", "period"])
+            .agg({"Score": np.sum})
+            .reset_index()
+            )
 
     # calculate similarity 
     d_sim = compute_similarity(
@@ -471,7 +794,8 @@ def similarity_to_faculty(
         df_B=affiliation_topics,
         unit_A=["AuthorId"],
         unit_B=["AffiliationId"], 
-        groupvars=["period", "Field0"])
+        groupvars=["period", "Field0"],
+        engine=engine)
 
     # "reference" table 
     d_graduates_affiliations = make_student_affiliation_table(
@@ -497,7 +821,10 @@ def similarity_to_closest_collaborator(
         d_affiliations,
         d_graduates,
         top_n_authors=200,
-        max_nrow_input_similarity=10_000_000
+        max_nrow_input_similarity=10_000_000,
+        engine="pandas",
+        stream_top_match=False,
+        topic_cache=None
     ):
     """Calcuate highest similarity between students among potential coauthors, for all potential
     destination institutions.
@@ -513,6 +840,14 @@ def similarity_to_closest_collaborator(
     max_nrow_input_similarity: Maximum number of rows to be processed by compute_similarity.
         Chunks of affiliation ids are processed sequentially to reduce
         memory of each operation.
+    engine: passed to `compute_similarity`
+    stream_top_match: If True, the most similar collaborator(s) are found with 
+        `most_similar_sparse`, which computes the similarities for blocks of graduates 
+        and keeps only the highest ones. The similarities to all collaborators 
+        are never held in memory. The output is the same as with engine="sparse"; 
+        `engine` is not used.
+    topic_cache: ConceptVectorCache instance or None. If given, the topics 
+        of collaborators are read from the cache.
     """
 
     # 1. Get data 
@@ -536,9 +871,80 @@ def similarity_to_closest_collaborator(
         ref_year=queries.degree_year_to_query
     )
 
+    # 2. Find top n authors by papercount for each affiliation
+    collaborators_papercount = (
+        collaborators_papers
+            .groupby(["AuthorId", "period"])
+            .agg({"PaperId": pd.Series.nunique})
+            .rename(columns={"PaperId": "PaperCount"})
+    )
+    d_top_collaborators = find_top_collaborators(
+        collaborators_affiliations=collaborators_affiliations,
+        collaborators_papercount=collaborators_papercount,
+        degree_year=queries.degree_year_to_query,
+        top_n_authors=top_n_authors
+    )
+
+    collaborators_to_query = list(d_top_collaborators["CoAuthorId"].unique())
+
+    # 3. query the topics of these authors. 
+        # NOTE: already conditional on field_to_query b/c of restriction to AuthorIds
+    # logging.debug("querying db for topics of collaborators")
+    if topic_cache is not None:
+        topics_collaborators = topic_cache.collaborators_topics(
+            con=con,
+            queries=queries,
+            author_ids_to_query=collaborators_to_query
+        )
+    else:
+        with con as c:
+            topics_collaborators = pd.read_sql(
+                con=c, 
+                sql=queries.query_collaborators_topics(author_ids_to_query=collaborators_to_query)
+            )
+
+    # 4. aggregate pre/post, by field 
+    topics_collaborators = sim_helpers.split_year_pre_post(
+        df=topics_collaborators, 
+        ref_year=queries.degree_year_to_query
+    )
+    topics_collaborators = (topics_collaborators
+        .groupby(["AuthorId", "Field0", "period", "FieldOfStudyId"])
+        .agg({"Score": np.sum})
+        .reset_index()
+        .rename(columns={"AuthorId": "CoAuthorId"})
+        )
+
+    return closest_collaborator_similarity(
+        student_topics=student_topics,
+        topics_collaborators=topics_collaborators,
+        d_top_collaborators=d_top_collaborators,
+        d_affiliations=d_affiliations,
+        d_graduates=d_graduates,
+        max_nrow_input_similarity=max_nrow_input_similarity,
+        engine=engine,
+        stream_top_match=stream_top_match
+    )
+
+
+def find_top_collaborators(
+        collaborators_affiliations,
+        collaborators_papercount,
+        degree_year,
+        top_n_authors
+    ):
+    """Find the top potential collaborators by number of papers at each affiliation.
+
+    Parameters:
+    -----------
+    collaborators_affiliations: dataframe with AuthorId, AffiliationId, Year and period
+    collaborators_papercount: dataframe with PaperCount, indexed by AuthorId and period
+    degree_year: degree year of the graduates
+    top_n_authors: number of authors to keep for each affiliation and period
+    """
     # 2. a. Find first and last affiliation relative to the PhD year of the graduates
     collaborators_affiliations["diff"] = np.abs(
-        collaborators_affiliations["Year"] - queries.degree_year_to_query
+        collaborators_affiliations["Year"] - degree_year
     )
     collaborators_affiliations["min_diff"] = (collaborators_affiliations
         .groupby(["AuthorId", "period"])["diff"]
@@ -553,51 +959,48 @@ def similarity_to_closest_collaborator(
         )
 
     # 2.b. Find top n authors by papercount for each affiliation
-    collaborators_papercount = (
-        collaborators_papers
-            .groupby(["AuthorId", "period"])
-            .agg({"PaperId": pd.Series.nunique})
-            .rename(columns={"PaperId": "PaperCount"})
-    )
-
+        # ties in PaperCount are broken by AuthorId, so that the result does not depend on the order of the rows
     logging.debug(f"top_n_authors is {top_n_authors}")
     d_top_collaborators = (
         collaborators_affiliations
             .set_index(list(collaborators_papercount.index.names))
             .join(collaborators_papercount)
             .reset_index()
-            .set_index(["AuthorId"])
+            .dropna(subset=["PaperCount"])
+            .sort_values(["period", "AffiliationId", "PaperCount", "AuthorId"], 
+                         ascending=[True, True, False, True])
             .groupby(["period", "AffiliationId"])
-            ["PaperCount"]
-            .nlargest(top_n_authors)
-            .reset_index()
+            .head(top_n_authors)
+            .loc[:, ["period", "AffiliationId", "AuthorId"]]
+            .reset_index(drop=True)
             .rename(columns={"AuthorId": "CoAuthorId"})
-            .drop(columns=["PaperCount"])
     )
 
-    collaborators_to_query = list(d_top_collaborators["CoAuthorId"].unique())
+    return d_top_collaborators
 
-    # 3. query the topics of these authors. 
-        # NOTE: already conditional on field_to_query b/c of restriction to AuthorIds
-    # logging.debug("querying db for topics of collaborators")
-    with con as c:
-        topics_collaborators = pd.read_sql(
-            con=c, 
-            sql=queries.query_collaborators_topics(author_ids_to_query=collaborators_to_query)
-        )
 
-    # 4. aggregate pre/post, by field 
-    topics_collaborators = sim_helpers.split_year_pre_post(
-        df=topics_collaborators, 
-        ref_year=queries.degree_year_to_query
-    )
-    topics_collaborators = (topics_collaborators
-        .groupby(["AuthorId", "Field0", "period", "FieldOfStudyId"])
-        .agg({"Score": np.sum})
-        .reset_index()
-        .rename(columns={"AuthorId": "CoAuthorId"})
-        )
+def closest_collaborator_similarity(
+        student_topics,
+        topics_collaborators,
+        d_top_collaborators,
+        d_affiliations,
+        d_graduates,
+        max_nrow_input_similarity=10_000_000,
+        engine="pandas",
+        stream_top_match=False
+    ):
+    """Calculate the similarity between students and their most similar collaborator 
+    at each affiliation.
 
+    Parameters:
+    -----------
+    student_topics: dataframe with scores by AuthorId, FieldOfStudyId, period, Field0
+    topics_collaborators: dataframe with scores by CoAuthorId, Field0, period, FieldOfStudyId
+    d_top_collaborators: dataframe with CoAuthorId, AffiliationId and period, 
+        from `find_top_collaborators`
+    d_affiliations, d_graduates: dataframes with affiliations and graduates
+    max_nrow_input_similarity, engine, stream_top_match: see `similarity_to_closest_collaborator`
+    """
     topics_collaborators_affiliations = (d_top_collaborators
         .set_index(["CoAuthorId", "period"])
         .join(topics_collaborators
@@ -623,12 +1026,23 @@ def similarity_to_closest_collaborator(
     logging.debug(f"computing similarity between graduates and collaborators")
     d_sim = []
     for n, g in topics_collaborators_affiliations.groupby("itergroup"):
-        dtemp = compute_similarity(
+        if stream_top_match:
+            dtemp = most_similar_sparse(
                 df_A=student_topics,
                 df_B=g,
                 unit_A=["AuthorId"],
                 unit_B=["CoAuthorId", "AffiliationId"],
-                groupvars=["Field0", "period"]
+                groupvars=["Field0", "period"],
+                group_B=["AffiliationId"]
+                )
+        else:
+            dtemp = compute_similarity(
+                df_A=student_topics,
+                df_B=g,
+                unit_A=["AuthorId"],
+                unit_B=["CoAuthorId", "AffiliationId"],
+                groupvars=["Field0", "period"],
+                engine=engine
                 )
         d_sim.append(dtemp)
     
@@ -637,17 +1051,9 @@ def similarity_to_closest_collaborator(
     
     # 5. calculate individual similarity, keep most similar 
     # logging.debug("max similarity between graduates and institutions")
-    d_sim["max_sim"] = (
-        d_sim
-            .groupby(["AuthorId", "Field0", "period", "AffiliationId"])["sim"]
-            .transform("max")
-    )
-
     d_most_similar_collaborator = (
-        d_sim.loc[
-            d_sim["sim"] == d_sim["max_sim"], 
-            ["AuthorId", "AffiliationId", "CoAuthorId", "period", "Field0", "sim"]
-        ]
+        keep_most_similar(d_sim, ["AuthorId", "Field0", "period", "AffiliationId"])
+            .loc[:, ["AuthorId", "AffiliationId", "CoAuthorId", "period", "Field0", "sim"]]
     ) # can have multiple at same institution if the similarity is the same 
 
     # 6. Separate most similar collaborator IDs from max distance 
@@ -672,6 +1078,12 @@ def similarity_to_closest_collaborator(
     return d_most_similar_collaborator, sim_most_similar_collaborator_by_affiliation
 
 
+def keep_most_similar(d_sim, groupvars):
+    "Keep the rows in `d_sim` with the highest `sim` within `groupvars`. Ties are all kept."
+    max_sim = d_sim.groupby(groupvars)["sim"].transform("max")
+    return d_sim.loc[d_sim["sim"] == max_sim]
+
+
 def make_itergroups(df, groupcol, max_size, new_colname):
     """From a df, make a new column to iterate over, where all rows from a group
     are contained in the same itergroup. 
@@ -3,6 +3,8 @@ rawdatapath = "/mnt/hdd/mag/2021-05-24/"
 datapath = "/mnt/ssd/"
 databasepath = datapath + "AcademicGraph/"
 db_file = f"{databasepath}AcademicGraph.sqlite" 
+topic_cache_path = f"{datapath}topic_similarity_cache/"
+collab_graph_path = f"{datapath}collab_graph/"
 
 # DocTypes to keep
 keep_doctypes = ("Journal", "Book", "BookChapter", "Conference")
@@ -9,7 +9,7 @@ import pandas as pd
 import pdb
 
 from helpers.variables import db_file
-from helpers.functions import analyze_db
+from helpers.functions import analyze_db, write_build_marker
 
 
 parser = argparse.ArgumentParser()
@@ -58,6 +58,7 @@ with con:
 
     con.execute("CREATE INDEX idx_ltc_fromidunitid ON links_to_cng(from_id ASC, unitid ASC)")
     con.execute("CREATE INDEX idx_ltc_unitid ON links_to_cng(unitid ASC)")
+    write_build_marker(con, "links_to_cng")
 
     analyze_db(con)
 
@@ -14,7 +14,7 @@ import re
 import argparse 
 
 
-from helpers.functions import normalize_string, analyze_db
+from helpers.functions import normalize_string_fast, analyze_db
 from helpers.variables import db_file
 from helpers.us_states import us_states 
 
@@ -95,7 +95,7 @@ cng = pd.read_excel(args.rawdata + "/" + args.cng,
 
 print("Cleaning...", flush=True)
 
-cng["normalizedname"] = normalize_string(cng["name"], replace_hyphen = " ")
+cng["normalizedname"] = normalize_string_fast(cng["name"], replace_hyphen = " ")
 mask = (cng["iclevel"] == 1) \
         & (~cng["stabbr"].isin(drop_states)) \
         & (~cng["normalizedname"].str.contains(drop_online)) \
@@ -120,7 +120,7 @@ for k, v in replace_city_names.items():
     cng["city"] = np.where(cng['city_state'] == k, v, cng["city"])
 
 cng = cng.drop(columns="city_state")
-cng["city"] = normalize_string(cng["city"], replace_hyphen= " ")
+cng["city"] = normalize_string_fast(cng["city"], replace_hyphen= " ")
 
 cng["normalizedname"] = cng["normalizedname"].str.removeprefix("the ")
 #cng["normalizedname"] = cng["normalizedname"].str.removesuffix(" main campus")
@@ -175,7 +175,7 @@ mcdc_expl["altername"] = mcdc_expl["altername"].str.split(",")
 mcdc_expl = mcdc_expl.explode("altername")
 
 
-mcdc_expl["altername"] = normalize_string(mcdc_expl["altername"], replace_hyphen= " ")
+mcdc_expl["altername"] = normalize_string_fast(mcdc_expl["altername"], replace_hyphen= " ")
 mcdc_expl["max_pop"] = mcdc_expl.groupby(["statefips", "altername"])["pop"].transform("max")
 mcdc_expl = mcdc_expl.loc[mcdc_expl["max_pop"] == mcdc_expl["pop"], :]
 
@@ -183,7 +183,7 @@ mcdc_expl = mcdc_expl.loc[mcdc_expl["max_pop"] == mcdc_expl["pop"], :]
 # %%
 # ### Keep unique city names within state
 mcdc["city"] = mcdc.apply(lambda row: re.sub(row['abbr'], "", row["name"]).strip(), axis="columns")
-mcdc["city"] = normalize_string(mcdc["city"], replace_hyphen= " ")
+mcdc["city"] = normalize_string_fast(mcdc["city"], replace_hyphen= " ")
 mcdc["max_pop"] = mcdc.groupby(["statefips", "city"])["pop"].transform("max")
 mcdc = mcdc.loc[mcdc["max_pop"] == mcdc["pop"], :]
 
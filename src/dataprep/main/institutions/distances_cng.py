@@ -1,50 +1,62 @@
 # Calculate distance between cng institutions
+    # the distances are computed in blocks with helpers.geo and written to the db block by block,
+    # so that neither all pairs nor all distances need to be in memory
 
 import sqlite3 as sqlite
+import argparse
 import pandas as pd
-import numpy as np 
-from geopy import distance
+import numpy as np
 import os
 
 print(os.getcwd())
 
 from helpers.variables import db_file
 import main.institutions.sql_queries as sq
-from helpers.functions import analyze_db
+from helpers.functions import analyze_db, insert_batched
+from helpers.geo import distance_blocks
 
 
-con = sqlite.connect(db_file)
+parser = argparse.ArgumentParser()
+parser.add_argument("--block_size",
+                    type=int,
+                    default=1000,
+                    help="number of institutions whose distances to all others are computed at once")
+parser.add_argument("--max_km",
+                    type=float,
+                    default=None,
+                    help="only store pairs within this distance in km. Default: store all pairs")
+args = parser.parse_args()
+
+
+con = sqlite.connect(db_file, isolation_level=None)
 
 with con:
     cng = pd.read_sql(sql=sq.query_cng, con=con)
 
-con.close()
-
 cng = cng[["unitid", "lat", "lon"]]
-cng_rhs = cng.copy(deep=True)
-cng_rhs.rename(columns={"unitid":"unitid2", "lat":"lat2", "lon":"lon2"}, inplace=True)
-cng = cng.merge(cng_rhs, how="cross")
-
 print(cng.head())
 
-# calculate distance
-cng['distance_km'] = cng.apply(lambda row: distance.distance((row['lat'], row['lon']), (row['lat2'], row['lon2'])).km, axis=1)
-print(cng.head())
-
-cng_out = cng[['unitid','unitid2','distance_km']]
-
-
-con = sqlite.connect(db_file)
-with con: 
-    cng_out.to_sql("cng_distances", 
-                    con=con, 
-                    if_exists="replace", 
-                    index=False, 
-                    chunksize=cng_out.shape[0]
-                )
-
-    con.execute("CREATE UNIQUE INDEX idx_cngd_unitid ON cng_distances (unitid ASC, unitid2 ASC)")
-
-    analyze_db(con)
+con.execute("DROP TABLE IF EXISTS cng_distances")
+con.execute("""CREATE TABLE cng_distances (
+                unitid INTEGER
+                , unitid2 INTEGER
+                , distance_km REAL
+            )""")
+
+# calculate distance and write
+n_rows = 0
+for unitid, unitid2, distance_km in distance_blocks(ids=cng["unitid"].to_numpy(),
+                                                    lat=cng["lat"].to_numpy(),
+                                                    lon=cng["lon"].to_numpy(),
+                                                    block_size=args.block_size,
+                                                    max_km=args.max_km):
+    n_rows += insert_batched(con,
+                            "INSERT INTO cng_distances VALUES (?, ?, ?)",
+                            zip(unitid.tolist(), unitid2.tolist(), distance_km.tolist()))
+print(f"Wrote {n_rows} pairs to cng_distances")
+
+con.execute("CREATE UNIQUE INDEX idx_cngd_unitid ON cng_distances (unitid ASC, unitid2 ASC)")
+
+analyze_db(con)
 
 con.close()
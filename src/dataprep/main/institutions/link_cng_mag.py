@@ -14,6 +14,7 @@ from helpers.variables import db_file
 from main.institutions.utils import dedupe_datapath, links_to_row
 import main.institutions.sql_queries as sq
 from main.institutions.dedupe_setup import fields_mag
+from helpers.spatial_index import candidate_pairs
 
 dedupe_sample_size = 100_000 
 dedupe_share_blockedpairs = 0.7
@@ -26,6 +27,10 @@ parser.add_argument("--tofile",
                     type=str,
                     default="../../data/link_institutions/links_mag.csv",
                     help="file path and name to temporarily save the links.") 
+parser.add_argument("--max_km", 
+                    type=float,
+                    default=None,
+                    help="if given, only compare institutions within this distance instead of using dedupe's blocking.") 
 args = parser.parse_args()
 
 n_cores = int(mp.cpu_count() / 2)
@@ -138,7 +143,13 @@ def main():
 
     print("Clustering")
 
-    linked_records = linker.join(data1, data2, threshold=0.0, constraint="one-to-one")
+    if args.max_km is not None:
+        # the pairs are within max_km by geodesic distance, as in distances_cng.py
+        pairs = candidate_pairs(data1, data2, radius_km=args.max_km)
+        scores = linker.score(pairs)
+        linked_records = linker.one_to_one(scores, threshold=0.0)
+    else:
+        linked_records = linker.join(data1, data2, threshold=0.0, constraint="one-to-one")
 
     linked_records = [links_to_row(i) for i in linked_records]
     colnames_link.append("link_score")
@@ -0,0 +1,110 @@
+"""
+Persisted blocking index for create_link_mag_proquest.py
+
+Blocking with `linker.pairs()` evaluates the predicates of the settings file
+over all records, which is the most expensive step when linking a field.
+The ids of the blocked pairs are stored in a sqlite database, keyed by a
+hash of the settings file and of the records to link. Later runs on the
+same settings and data (for instance with another threshold or --mergemode)
+read the pairs back and go straight to scoring.
+
+The pairs are written while `linker.score()` consumes them; an entry in
+`blocked_pairs_info` marks the pairs of a key as complete.
+"""
+
+import hashlib
+import logging
+import sqlite3 as sqlite
+
+
+def stable_repr(value):
+    "repr of `value` that does not depend on the hash seed: frozensets are sorted."
+    if isinstance(value, frozenset):
+        return f"frozenset({sorted(value)!r})"
+    if isinstance(value, tuple):
+        return "(" + ", ".join(stable_repr(v) for v in value) + ")"
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{k!r}: {stable_repr(v)}" for k, v in value.items()) + "}"
+    return repr(value)
+
+
+def pairs_key(settings_file, data_1, data_2):
+    """Hash of the settings file and the records in `data_1` and `data_2`.
+    Changes when the settings, the records or their order change.
+    """
+    h = hashlib.sha1()
+    with open(settings_file, "rb") as sf:
+        h.update(sf.read())
+    for data in [data_1, data_2]:
+        h.update(b"--data--")
+        for key, record in data.items():
+            h.update(stable_repr((key, record)).encode())
+    return h.hexdigest()
+
+
+class BlockedPairsCache():
+    """Store of blocked pairs by key.
+
+    Args:
+        cache_db: path to the sqlite database with the pairs.
+        batch_size: number of pairs to insert at once.
+    """
+    def __init__(self, cache_db, batch_size=100_000):
+        self.batch_size = batch_size
+        self.con = sqlite.connect(database=cache_db, isolation_level=None)
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS blocked_pairs (
+                key TEXT
+                , id_1
+                , id_2
+            )
+        """)
+        self.con.execute("CREATE INDEX IF NOT EXISTS idx_bp_key ON blocked_pairs (key)")
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS blocked_pairs_info (
+                key TEXT PRIMARY KEY
+                , n_pairs INT
+                , date TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+    def has_pairs(self, key):
+        return self.con.execute(
+            "SELECT 1 FROM blocked_pairs_info WHERE key = ?", (key,)
+        ).fetchone() is not None
+
+    def pairs(self, linker, data_1, data_2, key):
+        """Yield the record pairs in the format of `linker.pairs(data_1, data_2)`.
+
+        If the pairs for `key` are stored, they are read from the cache;
+        otherwise they are blocked with `linker` and stored.
+        """
+        if self.has_pairs(key):
+            logging.info(f"Reading blocked pairs for {key=}")
+            cur = self.con.execute("SELECT id_1, id_2 FROM blocked_pairs WHERE key = ?", (key,))
+            for id_1, id_2 in cur:
+                yield (id_1, data_1[id_1]), (id_2, data_2[id_2])
+        else:
+            logging.info(f"Blocking and storing pairs for {key=}")
+            self.con.execute("DELETE FROM blocked_pairs WHERE key = ?", (key,)) # leftovers from an incomplete run
+            n_pairs = 0
+            batch = []
+            for pair in linker.pairs(data_1=data_1, data_2=data_2):
+                batch.append((key, pair[0][0], pair[1][0]))
+                if len(batch) >= self.batch_size:
+                    n_pairs += self._insert(batch)
+                    batch = []
+                yield pair
+            n_pairs += self._insert(batch)
+            self.con.execute(
+                "INSERT INTO blocked_pairs_info (key, n_pairs) VALUES (?, ?)", (key, n_pairs)
+            )
+
+    def _insert(self, batch):
+        self.con.execute("BEGIN")
+        self.con.executemany("INSERT INTO blocked_pairs VALUES (?, ?, ?)", batch)
+        self.con.execute("COMMIT")
+        return len(batch)
+
+    def close(self):
+        self.con.close()
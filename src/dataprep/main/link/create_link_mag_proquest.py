@@ -8,6 +8,7 @@ Step 2 to Link MAG authors to ProQuest graduates (or other dataset):
 # TODO: correctly assign the ids from the theses
 
 from main.link.setup_linking import *
+from main.link.blocked_pairs import BlockedPairsCache, pairs_key
 
 if __name__ == "__main__":
     settings_file = "settings"
@@ -49,49 +50,17 @@ if __name__ == "__main__":
         # see the examples -- it seems that they DO load all the data for the training? double check what Chris understands here. then do it by 10-year intervals
 
  
-    with read_dict_con as con:
-        cur = con.cursor()
-        cur.execute(query_mag, tuple(id_field + id_field))
-        magdata = {i: row for i, row in custom_enumerate(cur.fetchall(), "AuthorId")}
-        cur = con.cursor()
-        if args.linking_type == "grants":
-            cur.execute(query_other)
-            otherdata = {i: row for i, row in custom_enumerate(cur.fetchall(), nsf_entity_id)}
-        else:
-            cur.execute(query_other, tuple(id_field))
-            otherdata = {i: row for i, row in custom_enumerate(cur.fetchall(), pq_entity_id)} # TODO: rename proquestdata to otherdata
-    
-    # transform the strings to hashable sequences
-    for data in [magdata, otherdata]:
-        for key in data.keys():
-            if data[key]["keywords"] is not None:
-                data[key]["keywords"] = frozenset(data[key]["keywords"].split(";"))
-
-            features = ["institution", "coauthors", "year_range",
-                        "main_us_institutions_year", "all_us_institutions_year",
-                        "year_papertitle"]
-            ft_in_data = list(data[list(data.keys())[0]].keys()) # extract all features of the first record in the dict data
-            features = [f for f in features if f in ft_in_data]
-            for feature in features:
-                if data[key][feature] is not None:
-                    if feature in ["main_us_institutions_year", "all_us_institutions_year",
-                                    "year_papertitle"]:
-                        # split, make first entry numeric, convert to tuple
-                        ft = [x.split("//") for x in data[key][feature].split(";")]
-                        ft = [tuple([int(x[0]), x[1]]) for x in ft] 
-                        data[key][feature] = tuple(ft)
-                    elif feature == "year_range":
-                        ft = data[key][feature]
-                        if isinstance(ft, str):
-                            ft = ft.split(";")
-                            ft = tuple([int(f) for f in ft])
-                        else:
-                            assert isinstance(ft, int) 
-                            ft = (ft, )
-                        data[key][feature] = ft
-                    else:
-                        data[key][feature] = tuple(data[key][feature].split(";"))
+    magdata, otherdata = load_data(query_mag, query_other)
+
+    if args.linking_type == "graduates":
+        data_1, data_2 = magdata, otherdata
+    else: # advisors, grants: we link many records in otherdata to one record on mag 
+        data_1, data_2 = otherdata, magdata
+
+    if args.cache_pairs:
+        key_blocked_pairs = pairs_key(settings_file, data_1, data_2)
 
+    # the strings are transformed to hashable sequences: see `main.link.record_store.transform_records`
     # NOTE
         # need `frozenset` for the set feature; while the documentation says tuples also work, there is a bug 
         # in dedupe for reading tuples from training data
@@ -106,28 +75,29 @@ if __name__ == "__main__":
         linker = dedupe.StaticRecordLink(sf, num_cores = n_cores)
 
     print("Link now ... ", flush=True)
-    if args.linking_type == "graduates":
-        pairs = linker.pairs(data_1 = magdata, data_2 = otherdata)
-    elif args.linking_type == "advisors": # this is important: we link many theses in proquest to one record on mag 
-        pairs = linker.pairs(data_1 = otherdata, data_2 = magdata)
-    elif args.linking_type == "grants":
-        pairs = linker.pairs(data_1 = otherdata, data_2 = magdata)
+    if args.cache_pairs:
+        pairs_cache = BlockedPairsCache(f"{path_dedupe_files}blocked_pairs.sqlite")
+        pairs = pairs_cache.pairs(linker, data_1=data_1, data_2=data_2, key=key_blocked_pairs)
+    else:
+        pairs = linker.pairs(data_1 = data_1, data_2 = data_2)
     
     print("made pairs", flush=True)
     scores = linker.score(pairs)
     print("calculated scores", flush=True)
+    if args.cache_pairs:
+        pairs_cache.close()
     if args.mergemode=="m:1":
-        links = linker.many_to_one(scores, threshold = 0.5)
+        links = linker.many_to_one(scores, threshold = args.threshold)
         print("made m:1 links", flush=True)
     else:
-        links = linker.one_to_one(scores, threshold = 0.5)
+        links = linker.one_to_one(scores, threshold = args.threshold)
         print("made 1:1 links", flush=True)
 
     
     del otherdata 
     del magdata
-    del linker 
-    del scores 
+    del data_1
+    del data_2
 
     # ## Write everything into two tables
         # if writing to csv, create a new write_con and write to this temporary db. then read it out into pandas and write to csv
@@ -177,44 +147,14 @@ if __name__ == "__main__":
     # ### Write links 
     print("Filling links into db...", flush=True)
     
-    if args.write_to == "csv":
-        # TODO: DELETE THIS FIRST PART OR ADAPT TO CSV WRITER
-        #   links = [(i[0][0], i[0][1], i[1]) for i in links]
-        #print(links[1:5])
-        # filename = path_temp_files + "links" + file_suffix + ".csv"
-        # with open(filename, "w") as csv_file:
-        #     print("opened csv file...", flush=True)
-        #     writer = csv.writer(csv_file, delimiter=',')
-        #     writer.writerow(["grantid_authorposition","AuthorId","link_score"]) 
-        #     print("wrote header to csv file...", flush=True)
-        #     #writer.writerows(links) 
-        #     for link in links:
-        #         writer.writerow((link[0][0], link[0][1], link[1]))
-        
-        # print("Filled links into csv...", flush=True)
-
-        counter = 1 
-        for link in links:
-            counter = counter + 1
-            write_con.execute(
-                f"INSERT INTO {tbl_linked_ids} VALUES (?, ?, ?, ?)",
-            # tupelize_links(links, iteration_id)
-            (link[0][0], link[0][1], link[1], iteration_id)
-            )
-            if counter % 10000 == 0:
-                write_con.commit()
-
-        write_con.commit()       
-        print("Filled links into db iteratively...", flush=True)
-    else:
-        links = [(i[0][0], i[0][1], i[1], iteration_id) for i in links] # XXX this will fail for large fields, need to iterate the insert into the db
-        write_con.executemany(
-            f"INSERT INTO {tbl_linked_ids} VALUES (?, ?, ?, ?)",
-        # tupelize_links(links, iteration_id)
-        links
-        )
-        write_con.commit()
-        print("Filled links into db...", flush=True)
+    # `links` is a generator; stream it into the table in batches, for both write targets
+    n_links_written = insert_batched(
+        write_con,
+        f"INSERT INTO {tbl_linked_ids} VALUES (?, ?, ?, ?)",
+        tupelize_links(links, iteration_id),
+        batch_size=args.write_batch_size
+    )
+    print(f"Filled {n_links_written} links into db...", flush=True)
 
     # ### Write iteration info
     current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -228,6 +168,9 @@ if __name__ == "__main__":
     )
     write_con.commit()
 
+    del linker 
+    del scores 
+
     print("Wrote linking info into db...", flush=True)
 
     # ## Check fraction matched. Currently only for graduates.
@@ -8,6 +8,8 @@ Read the files, outputted in topic_similarity.py, into the database with the fol
     - using subprocess, collect files into one
     - using subprocess and sqlite command line, read into db
     - put indexes on table
+With `--input_format parquet`, the parquet files are instead streamed in record batches
+into the tables with `executemany`, in one transaction per table.
 """
 
 
@@ -19,6 +21,7 @@ import time
 import os 
 import shutil
 import logging 
+import glob
 from tqdm import tqdm
 
 from helpers.functions import analyze_db
@@ -28,10 +31,34 @@ logging.basicConfig(level=logging.INFO)
 
 parser = argparse.ArgumentParser(description = 'Inputs for read_topic_similarity')
 parser.add_argument("--read_dir", dest="read_dir", default = "similarities_temp/")
+parser.add_argument("--input_format", 
+                    default="csv", 
+                    choices=["csv", "parquet"],
+                    help="File format of the outputs from topic_similarity.py.")
+parser.add_argument("--batch_size", 
+                    type=int,
+                    default=100_000,
+                    help="Number of rows per insert when reading parquet files.")
 
 args = parser.parse_args()
 
 
+
+def load_parquet(con, files, tbl, batch_size):
+    """Insert the rows of the parquet `files` into `tbl` in one transaction.
+    As with the csv import, columns are matched by position.
+    """
+    import pyarrow.parquet as pq # only needed for --input_format parquet
+    con.execute("BEGIN")
+    for f in files:
+        parquet_file = pq.ParquetFile(f)
+        qmarks = ", ".join(["?"] * len(parquet_file.schema_arrow))
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            rows = zip(*[col.to_pylist() for col in batch.columns])
+            con.executemany(f"INSERT INTO {tbl} VALUES ({qmarks})", rows)
+    con.execute("COMMIT")
+
+
 start_time = time.time()
 
 con = sqlite.connect(database = db_file, isolation_level= None)
@@ -81,16 +108,24 @@ file_map = {
 
 
 for name, params in tqdm(file_map.items()):
-    subprocess.run(f"tail -n +2 -q {args.read_dir}/maxlevel-*/{name}-part-*.csv >> {params['fn_full']}", shell=True)
     with con as c:
          c.execute(f"DROP TABLE IF EXISTS {params['tbl']}")
          c.execute(f"CREATE TABLE {params['tbl']} {params['schema']}")
-    subprocess.run(
-        ["sqlite3", db_file,
-        ".mode csv",
-        f".import {params['fn_full']} {params['tbl']}"]
-    )
-    os.remove(params['fn_full'])
+    if args.input_format == "parquet":
+        load_parquet(
+            con=con, 
+            files=sorted(glob.glob(f"{args.read_dir}/maxlevel-*/{name}-part-*.parquet")),
+            tbl=params['tbl'],
+            batch_size=args.batch_size
+        )
+    else:
+        subprocess.run(f"tail -n +2 -q {args.read_dir}/maxlevel-*/{name}-part-*.csv >> {params['fn_full']}", shell=True)
+        subprocess.run(
+            ["sqlite3", db_file,
+            ".mode csv",
+            f".import {params['fn_full']} {params['tbl']}"]
+        )
+        os.remove(params['fn_full'])
     with con as c:
         for idx in params["idx"]:
             c.execute(idx)
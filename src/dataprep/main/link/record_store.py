@@ -0,0 +1,133 @@
+"""
+Preprocessed records for linking
+
+train_link_mag_proquest.py and create_link_mag_proquest.py read the records
+to link with the queries from setup_linking.py and transform the strings of
+some features into tuples and frozensets for dedupe (`transform_records`).
+`RecordStore` does both once per query and stores the transformed records
+as pickle files. Later runs load the pickle directly.
+
+A store file is rebuilt when the query or its parameters change, or when
+one of the `source_tables` changes: the scripts that create the tables write
+a new build id with `helpers.functions.write_build_marker`, which is part of
+the key of the stored records, together with a fingerprint of the tables.
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import logging
+
+from helpers.functions import custom_enumerate, read_build_markers, table_fingerprint
+from helpers.comparator_functions import tuple_bounds
+
+
+source_tables = ["author_info_linking", "pq_info_linking", "author_sample",
+                 "pq_authors", "pq_advisors", "NSF_Investigator"]
+
+# features stored as ";"-separated strings; see `transform_records`
+features_to_split = ["institution", "coauthors", "year_range",
+                     "main_us_institutions_year", "all_us_institutions_year",
+                     "year_papertitle"]
+
+
+def transform_records(data):
+    "Transform the strings in the records of `data` to hashable sequences, in place."
+    if len(data) == 0:
+        return data
+    ft_in_data = list(data[list(data.keys())[0]].keys()) # extract all features of the first record in the dict data
+    features = [f for f in features_to_split if f in ft_in_data]
+    for key in data.keys():
+        if data[key]["keywords"] is not None:
+            data[key]["keywords"] = frozenset([x for x in data[key]["keywords"].split(";") if x != ""])
+            # the list comp above deals with cases "word1;word2;" (the last ; gives an empty last element in the output of split())
+
+        for feature in features:
+            if data[key][feature] is not None:
+                if feature in ["main_us_institutions_year", "all_us_institutions_year",
+                                "year_papertitle"]:
+                    # split, make first entry numeric, convert to tuple
+                    ft = [x.split("//") for x in data[key][feature].split(";")]
+                    ft = [tuple([int(x[0]), x[1]]) for x in ft]
+                    data[key][feature] = tuple(ft)
+                elif feature == "year_range":
+                    ft = data[key][feature]
+                    if isinstance(ft, str):
+                        ft = ft.split(";")
+                        ft = tuple([int(f) for f in ft])
+                    else:
+                        assert isinstance(ft, int)
+                        ft = (ft, )
+                    data[key][feature] = ft
+                else:
+                    data[key][feature] = tuple(data[key][feature].split(";"))
+    return data
+
+
+def range_bounds(data, feature="year_range"):
+    """Bounds of the tuples in `feature` of the records in `data` from `transform_records`,
+    for the batch range comparators. Build them once per set of records and select the 
+    records of a batch of pairs with `helpers.comparator_functions.take_bounds`.
+
+    Returns
+    ----------
+    positions: dict {record id: position in the bounds}
+    bounds: `TupleBounds`
+    """
+    positions = {key: i for i, key in enumerate(data.keys())}
+    return positions, tuple_bounds([record[feature] for record in data.values()])
+
+
+def query_records(dict_con, query, params, id_col):
+    """Query records with `dict_con` (with `dict_factory` as row factory)
+    and return them as dict keyed by `id_col`, transformed with `transform_records`.
+    """
+    with dict_con as con:
+        cur = con.cursor()
+        cur.execute(query, params)
+        data = {i: row for i, row in custom_enumerate(cur.fetchall(), id_col)}
+    return transform_records(data)
+
+
+class RecordStore():
+    """Store of transformed records for linking.
+
+    Args:
+        store_dir: directory for the pickle files.
+        read_con: sqlite connection to check if the source tables changed.
+    """
+    def __init__(self, store_dir, read_con):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self.fingerprint = {
+            "tables": table_fingerprint(read_con, source_tables),
+            "builds": read_build_markers(read_con, source_tables)
+        }
+
+    def _key(self, query, params):
+        h = hashlib.sha1()
+        h.update(query.encode())
+        h.update(repr(tuple(params)).encode())
+        h.update(json.dumps(self.fingerprint).encode())
+        return h.hexdigest()
+
+    def get(self, name, dict_con, query, params, id_col):
+        """Same output as `query_records(dict_con, query, params, id_col)`.
+        `name` identifies the file in the store, for instance dataset, field and years.
+        """
+        path = os.path.join(self.store_dir, f"{name}.pickle")
+        key = self._key(query, params)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                stored = pickle.load(f)
+            if stored["key"] == key:
+                logging.info(f"Reading records from {path}")
+                return stored["records"]
+            logging.info(f"Query or source tables changed; rebuilding {path}")
+        data = query_records(dict_con, query, params, id_col)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"key": key, "records": data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return data
@@ -19,8 +19,9 @@ import dedupe.backport
 from collections import OrderedDict
 
 from helpers.variables import db_file, datapath
-from helpers.functions import analyze_db, tupelize_links, dict_factory, custom_enumerate, print_elapsed_time, yield_gazetteer
+from helpers.functions import analyze_db, tupelize_links, dict_factory, custom_enumerate, print_elapsed_time, yield_gazetteer, insert_batched
 import helpers.comparator_functions as cf
+from main.link.record_store import RecordStore, query_records
 
 start_time = time.time()
 
@@ -84,6 +85,16 @@ parser.add_argument("--linking_type", type = str, default = "graduates",
                     help = "Are we linking graduates or advisors or grants?", choices = {"graduates", "advisors", "grants"}) 
 parser.add_argument("--ntrain", type=int, default=100000, dest="samplesize",
                     help="Sample size argument for dedupe.prepare_training()")
+parser.add_argument("--threshold", type=float, default=0.5, choices=[Range(0.0, 1.0)],
+                    help="Minimum score for links in create_link_mag_proquest.py")
+parser.add_argument("--cache_pairs", action=argparse.BooleanOptionalAction, default=False,
+                    help="Store blocked pairs and reuse them in later runs with the same settings and data.")
+parser.add_argument("--write_batch_size", type=int, default=100_000,
+                    help="Number of links to insert per transaction in create_link_mag_proquest.py")
+parser.add_argument("--record_store", action=argparse.BooleanOptionalAction, default=False,
+                    help="Read the preprocessed records from the record store; (re)build it when necessary.")
+parser.add_argument("--fitted_tfidf", action=argparse.BooleanOptionalAction, default=False,
+                    help="Compare titles with a tf-idf model fitted once on all titles (training only).")
 parser.add_argument("--to", type=str, default="database", dest="write_to", 
                     choices={"database", "csv"},
                     help="Write to database or csv?")
@@ -558,4 +569,24 @@ elif args.linking_type == "advisors" or args.linking_type == "grants":
         """
 
 # deleted in 542 to use all fields for linking: AND a.Organization_Directorate_ShortName IN {directorates}
-# adjust endyear for grants?
\ No newline at end of file
+# adjust endyear for grants?
+
+def load_data(query_mag, query_other):
+    """Read the records from mag and the other dataset, with strings transformed for dedupe.
+    With --record_store, the transformed records are read from the store if they are up to date.
+    """
+    if args.linking_type == "grants":
+        id_other, params_other = nsf_entity_id, ()
+    else:
+        id_other, params_other = pq_entity_id, tuple(id_field)
+    params_mag = tuple(id_field + id_field) # this is necessary because we query fieldofstudytable 2x
+
+    if not args.record_store:
+        magdata = query_records(read_dict_con, query_mag, params_mag, "AuthorId")
+        otherdata = query_records(read_dict_con, query_other, params_other, id_other)
+    else:
+        store = RecordStore(path_dedupe_files + "records/", read_con)
+        store_name = f"{field_to_store.replace(' ', '_')}_{args.loadstartyear}_{args.loadendyear}_test{args.testing}"
+        magdata = store.get(f"mag_{store_name}", read_dict_con, query_mag, params_mag, "AuthorId")
+        otherdata = store.get(f"other_{store_name}", read_dict_con, query_other, params_other, id_other)
+    return magdata, otherdata
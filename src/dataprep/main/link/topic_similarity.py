@@ -18,23 +18,30 @@ import sqlite3 as sqlite
 import time 
 from pathlib import Path
 import pandas as pd
-from helpers.variables import db_file, insert_questionmark_doctypes, keep_doctypes
+from helpers.variables import db_file, insert_questionmark_doctypes, keep_doctypes, topic_cache_path
 from helpers.functions import enumerated_arguments
+from helpers.scheduling import run_scheduled
 import pdb 
 import argparse
 import logging 
 import os 
 import sys 
+import shutil
 import multiprocessing as mp 
 import itertools 
-from concurrent.futures import ProcessPoolExecutor
+import collections
 import warnings
 
-import main.link.topic_similarity_functions as tsf
+import helpers.topic_similarity_functions as tsf
+import helpers.similarity_helpers as sim_helpers
+from helpers.topic_cache import ConceptVectorCache
+from main.link.shared_lookups import save_lookups, SharedLookups
 
 
 logging.basicConfig(level=logging.INFO)
 
+output_names = ["own", "inst", "closest_collaborator_ids"]
+
 # ## Arguments
 
 
@@ -64,8 +71,48 @@ def parse_args():
                         type=int,
                         default=5,
                         help="Use fields of study up to this level (included) for computing the conept vectors")
+    parser.add_argument("--similarity_engine",
+                        type=str,
+                        default="pandas",
+                        choices=["pandas", "sparse"],
+                        help="How to compute cosine similarities: with pandas joins or with sparse matrix products.")
+    parser.add_argument("--stream_top_match",
+                        action=argparse.BooleanOptionalAction,
+                        default=False,
+                        help="Compute the similarities to collaborators in blocks of graduates and keep only the closest collaborator. Lowers peak memory.")
+    parser.add_argument("--topic_cache",
+                        action=argparse.BooleanOptionalAction,
+                        default=False,
+                        help="Read topics of affiliations and collaborators from an on-disk cache, filled on first use.")
+    parser.add_argument("--cache_dir",
+                        type=str,
+                        default=topic_cache_path,
+                        help="Directory of the topic cache.")
+    parser.add_argument("--shared_lookups",
+                        action=argparse.BooleanOptionalAction,
+                        default=False,
+                        help="Query lookup tables once and read them from files in each worker (faster than querying per chunk).")
+    parser.add_argument("--sweep",
+                        action=argparse.BooleanOptionalAction,
+                        default=False,
+                        help="Process all degree years of a field in one go, updating the topic windows incrementally.")
+    parser.add_argument("--output_format",
+                        type=str,
+                        default="csv",
+                        choices=["csv", "parquet"],
+                        help="File format of the outputs. Read them with the same --input_format in read_topic_similarity.py.")
+    parser.add_argument("--max_retries",
+                        type=int,
+                        default=1,
+                        help="Retry chunks that fail as many times.")
+    parser.add_argument("--resume",
+                        action=argparse.BooleanOptionalAction,
+                        default=False,
+                        help="Continue in an existing write_dir and skip chunks with complete outputs.")
     parser.add_argument('--parallel', action=argparse.BooleanOptionalAction, dest="parallel")
     args = parser.parse_args()
+    if args.sweep and args.topic_cache:
+        parser.error("--sweep reads the topics of all years once per field and does not use the topic cache. Drop --topic_cache.")
     return args
 
 
@@ -94,8 +141,23 @@ def get_similarities(data):
     max_level: int. Use fields of study up to this level for creating
         the concept vector.
     window_size: int
+    similarity_engine: str
+        "pandas" or "sparse", passed to the similarity functions.
+    stream_top_match: bool
+        passed to `similarity_to_closest_collaborator`.
+    cache_dir: str or None
+        directory of the topic cache. If None, the cache is not used.
+    lookup_dir: str or None
+        directory of the lookup tables shared between workers. If None, 
+        the lookup tables are queried.
+    output_format: str
+        "csv" or "parquet"
     """
-    chunk_id, dbfile, write_dir, degree_year, field, keep_top_n_authors, max_level, window_size = data 
+    (chunk_id, dbfile, write_dir, degree_year, field, keep_top_n_authors, max_level, window_size, 
+     similarity_engine, stream_top_match, cache_dir, lookup_dir, output_format) = data 
+    topic_cache = None
+    if cache_dir is not None:
+        topic_cache = ConceptVectorCache(cache_dir=cache_dir, max_level=max_level)
     con = sqlite.connect(database = "file:" + dbfile + "?mode=ro", 
                          isolation_level=None, 
                          uri=True) # read-only connection 
@@ -110,33 +172,27 @@ def get_similarities(data):
         max_level=max_level
     )
 
-    with con as c:
-        d_affiliations = pd.read_sql(
-            con=c, 
-            sql=sql_queries.query_affiliations()
-        )
+    d_graduates = None
+    if lookup_dir is not None:
+        lookups = SharedLookups(lookup_dir)
+        d_affiliations = lookups.affiliations()
+        d_graduates = lookups.graduates(degree_year=degree_year, field=field)
+    else:
+        with con as c:
+            d_affiliations = pd.read_sql(
+                con=c, 
+                sql=sql_queries.query_affiliations()
+            )
 
     ## stuff for main function 
     logging.info("getting student data")
     student_topics, d_graduates = tsf.get_student_data(
         con=con, 
-        queries=sql_queries
+        queries=sql_queries,
+        d_graduates=d_graduates
         )
 
-    d_similarity_prepost = tsf.compute_similarity(
-        df_A=student_topics.loc[
-            student_topics["period"] == "pre_phd", 
-            ["AuthorId", "FieldOfStudyId", "Score"]
-            ],
-        df_B=student_topics.loc[
-            student_topics["period"] == "post_phd",
-            ["AuthorId", "FieldOfStudyId", "Score"]
-        ],
-        unit_A=["AuthorId"],
-        unit_B=["AuthorId"],
-        groupvars=["AuthorId"],
-        fill_A_units=True
-    )
+    d_similarity_prepost = similarity_prepost(student_topics, engine=similarity_engine)
 
     # ### Topic similarity between graduate and average faculty 
     logging.info("similarity to faculty")
@@ -146,7 +202,9 @@ def get_similarities(data):
         d_graduates=d_graduates,
         student_topics=student_topics,
         queries=sql_queries,
-        con=con
+        con=con,
+        engine=similarity_engine,
+        topic_cache=topic_cache
     )
 
 
@@ -158,9 +216,59 @@ def get_similarities(data):
         student_topics=student_topics,
         d_affiliations=d_affiliations,
         d_graduates=d_graduates,
-        top_n_authors=keep_top_n_authors
+        top_n_authors=keep_top_n_authors,
+        engine=similarity_engine,
+        stream_top_match=stream_top_match,
+        topic_cache=topic_cache
+    )
+
+    write_similarities(
+        write_dir=write_dir,
+        chunk_id=chunk_id,
+        max_level=max_level,
+        d_similarity_prepost=d_similarity_prepost,
+        d_similarity_to_faculty=d_similarity_to_faculty,
+        d_most_similar_collaborator=d_most_similar_collaborator,
+        highest_similarity_by_institution=highest_similarity_by_institution,
+        output_format=output_format
     )
 
+    logging.debug("Done with one chunk.")
+
+    con.close()
+
+
+def similarity_prepost(student_topics, engine):
+    "Similarity of graduates' topics before and after graduation."
+    d_similarity_prepost = tsf.compute_similarity(
+        df_A=student_topics.loc[
+            student_topics["period"] == "pre_phd", 
+            ["AuthorId", "FieldOfStudyId", "Score"]
+            ],
+        df_B=student_topics.loc[
+            student_topics["period"] == "post_phd",
+            ["AuthorId", "FieldOfStudyId", "Score"]
+        ],
+        unit_A=["AuthorId"],
+        unit_B=["AuthorId"],
+        groupvars=["AuthorId"],
+        fill_A_units=True,
+        engine=engine
+    )
+    return d_similarity_prepost
+
+
+def write_similarities(
+        write_dir,
+        chunk_id,
+        max_level,
+        d_similarity_prepost,
+        d_similarity_to_faculty,
+        d_most_similar_collaborator,
+        highest_similarity_by_institution,
+        output_format="csv"
+    ):
+    "Combine the similarities to institutions and write the outputs of one chunk to csv or parquet."
     # ## Make one df for similarity to institutions
     logging.info("making d_similarity_institutions")
 
@@ -176,7 +284,7 @@ def get_similarities(data):
             .drop(columns=["Field0"])
     )
 
-    write_dict = {
+    write_dict = { # keys as in `output_names`
         "own": d_similarity_prepost,
         "inst": d_similarity_to_institutions,
         "closest_collaborator_ids": d_most_similar_collaborator.drop(columns=['Field0'])
@@ -184,14 +292,214 @@ def get_similarities(data):
 
     for name, df in write_dict.items():
         df["max_level"] = max_level
-        df.to_csv(f"{write_dir}/{name}-part-{chunk_id}.csv", index=False)
+        # write to a temporary file first so that --resume never sees partial outputs
+        filename = f"{write_dir}/{name}-part-{chunk_id}.{output_format}"
+        if output_format == "parquet":
+            df.to_parquet(f"{filename}.tmp", index=False)
+        else:
+            df.to_csv(f"{filename}.tmp", index=False)
+        os.replace(f"{filename}.tmp", filename)
+
+
+def chunk_done(write_dir, chunk_id, output_format="csv"):
+    "Check if all outputs of chunk `chunk_id` exist in `write_dir`."
+    return all(
+        os.path.isfile(f"{write_dir}/{name}-part-{chunk_id}.{output_format}") for name in output_names
+    )
 
-    logging.debug("Done with one chunk.")
+
+def get_similarities_sweep(chunks):
+    """Calculate similarities for all degree years of one field in one go.
+
+    The output is the same as from running `get_similarities` on each chunk. 
+    The data on affiliations and potential collaborators is queried once for 
+    all years. Walking through the degree years in order, the topics in the 
+    windows around each degree year are updated with `RollingWindowSums`, 
+    which only adds and subtracts the years at the edges of the windows.
+
+    Parameters:
+    ----------
+    chunks: list of inputs to `get_similarities` for the same field and with 
+        the same settings.
+    """
+    chunks = sorted(chunks, key=lambda chunk: chunk[3])
+    (_, dbfile, write_dir, _, field, keep_top_n_authors, max_level, window_size, 
+     similarity_engine, stream_top_match, cache_dir, lookup_dir, output_format) = chunks[0]
+    if cache_dir is not None:
+        raise ValueError("The sweep does not use the topic cache.")
+    lookups = None
+    if lookup_dir is not None:
+        lookups = SharedLookups(lookup_dir)
+    con = sqlite.connect(database = "file:" + dbfile + "?mode=ro", 
+                         isolation_level=None, 
+                         uri=True) # read-only connection 
+
+    def make_queries(degree_year):
+        return tsf.QueryBuilder(
+            degree_year_to_query=degree_year,
+            window_size=window_size,
+            field_to_query=field,
+            qmarks_doctypes=insert_questionmark_doctypes,
+            keep_doctypes=keep_doctypes,
+            max_level=max_level
+        )
+
+    logging.info(f"sweeping {len(chunks)} degree years for {field=}")
+    sql_queries = make_queries(chunks[0][3])
+    with con as c:
+        if lookups is not None:
+            d_affiliations = lookups.affiliations()
+        else:
+            d_affiliations = pd.read_sql(con=c, sql=sql_queries.query_affiliations())
+        affiliation_topics = pd.read_sql(
+            con=c, 
+            sql=sql_queries.query_affiliation_topics(restrict_years=False)
+        )
+        collaborators_affiliations = pd.read_sql(
+            con=c, 
+            sql=sql_queries.query_collaborators(restrict_years=False)
+        )
+        collaborators_papercount = pd.read_sql(
+            con=c,
+            sql=sql_queries.query_author_papercount(),
+            params=keep_doctypes
+        )
+
+    affiliation_topics = tsf.RollingWindowSums(
+        df=affiliation_topics,
+        keys=["AffiliationId", "Field0", "FieldOfStudyId"],
+        value="Score",
+        window_size=window_size
+    )
+    collaborators_papercount = tsf.RollingWindowSums(
+        df=collaborators_papercount,
+        keys=["AuthorId"],
+        value="PaperCount",
+        window_size=window_size
+    )
+
+    # ## Top collaborators by degree year; query the topics of all of them at once
+    top_collaborators = {}
+    for chunk in chunks:
+        degree_year = chunk[3]
+        collaborators_papercount.move_to(degree_year)
+        in_window = (collaborators_affiliations["Year"] - degree_year).abs() <= window_size
+        top_collaborators[degree_year] = tsf.find_top_collaborators(
+            collaborators_affiliations=sim_helpers.split_year_pre_post(
+                df=collaborators_affiliations.loc[in_window].copy(),
+                ref_year=degree_year
+            ),
+            collaborators_papercount=collaborators_papercount.get().set_index(["AuthorId", "period"]),
+            degree_year=degree_year,
+            top_n_authors=keep_top_n_authors
+        )
+
+    collaborators_to_query = pd.concat(
+        [d["CoAuthorId"] for d in top_collaborators.values()]
+    ).unique().tolist()
+    with con as c:
+        collaborators_topics = pd.read_sql(
+            con=c, 
+            sql=sql_queries.query_collaborators_topics(
+                author_ids_to_query=collaborators_to_query,
+                restrict_years=False
+            )
+        )
+    collaborators_topics = tsf.RollingWindowSums(
+        df=collaborators_topics,
+        keys=["AuthorId", "Field0", "FieldOfStudyId"],
+        value="Score",
+        window_size=window_size
+    )
+
+    # ## Similarities by degree year
+    for chunk in chunks:
+        chunk_id, degree_year = chunk[0], chunk[3]
+        logging.debug(f"{chunk_id=}, {degree_year=}, {field=}")
+        sql_queries = make_queries(degree_year)
+        student_topics, d_graduates = tsf.get_student_data(
+            con=con, 
+            queries=sql_queries,
+            d_graduates=None if lookups is None else lookups.graduates(degree_year=degree_year, field=field)
+        )
+        d_similarity_prepost = similarity_prepost(student_topics, engine=similarity_engine)
+
+        affiliation_topics.move_to(degree_year)
+        d_similarity_to_faculty = tsf.similarity_to_faculty(
+            d_affiliations=d_affiliations,
+            d_graduates=d_graduates,
+            student_topics=student_topics,
+            queries=sql_queries,
+            con=con,
+            engine=similarity_engine,
+            affiliation_topics=affiliation_topics.get()
+        )
+
+        collaborators_topics.move_to(degree_year)
+        d_most_similar_collaborator, highest_similarity_by_institution = tsf.closest_collaborator_similarity(
+            student_topics=student_topics,
+            topics_collaborators=collaborators_topics.get().rename(columns={"AuthorId": "CoAuthorId"}),
+            d_top_collaborators=top_collaborators[degree_year],
+            d_affiliations=d_affiliations,
+            d_graduates=d_graduates,
+            engine=similarity_engine,
+            stream_top_match=stream_top_match
+        )
+
+        write_similarities(
+            write_dir=write_dir,
+            chunk_id=chunk_id,
+            max_level=max_level,
+            d_similarity_prepost=d_similarity_prepost,
+            d_similarity_to_faculty=d_similarity_to_faculty,
+            d_most_similar_collaborator=d_most_similar_collaborator,
+            highest_similarity_by_institution=highest_similarity_by_institution,
+            output_format=output_format
+        )
+
+    logging.debug(f"Done with {field=}.")
 
     con.close()
 
 
 
+def estimate_costs(con, queries):
+    """Estimate the relative cost of each chunk as 
+    number of graduates x (1 + number of authors in affiliations) in the field and degree year.
+
+    Parameters:
+    ----------
+    con: sqlite connection
+    queries: QueryBuilder instance. Only queries that do not depend on
+        the degree year and field are used.
+
+    Returns: 
+    ----------
+    dict with (degree_year, field) as keys.
+    """
+    q_graduates = f"""
+        SELECT degree_year, Field0, COUNT(*) AS n_graduates
+        FROM (
+            {queries.query_graduates(restrict_year_field=False)}
+        )
+        GROUP BY degree_year, Field0
+    """
+    q_faculty = """
+        SELECT Year AS degree_year, Field0, SUM(AuthorCount) AS n_faculty
+        FROM affiliation_outcomes
+        GROUP BY Year, Field0
+    """
+    with con as c:
+        d_graduates = pd.read_sql(con=c, sql=q_graduates)
+        d_faculty = pd.read_sql(con=c, sql=q_faculty)
+    d_cost = d_graduates.merge(d_faculty, on=["degree_year", "Field0"], how="left")
+    d_cost["cost"] = d_cost["n_graduates"] * (1 + d_cost["n_faculty"].fillna(0))
+    return {
+        (year, field): cost 
+        for year, field, cost in zip(d_cost["degree_year"], d_cost["Field0"], d_cost["cost"])
+    }
+
+
 def main():
     args = parse_args()
     write_url = Path(args.write_dir, f"maxlevel-{args.max_level}") 
@@ -202,13 +510,13 @@ def main():
         print(f"Using max available, which is {mp.cpu_count()}.")
         args.n_cores = mp.cpu_count()
 
-    if os.path.isdir(args.write_dir):
-        sys.exit("You specified an existing directory: " + args.write_dir)
+    if os.path.isdir(args.write_dir) and not args.resume:
+        sys.exit("You specified an existing directory: " + args.write_dir + ". Use --resume to continue a previous run.")
 
     # ## Setup
     start_time = time.time()    
    
-    write_url.mkdir(parents=True)
+    write_url.mkdir(parents=True, exist_ok=args.resume)
 
     # ## Prepare inputs for mp 
     con = sqlite.connect(database = "file:" + db_file + "?mode=ro", 
@@ -216,10 +524,12 @@ def main():
                         uri=True) # read-only connection 
 
     # we need all years, all fields level 0 
+    # ordered so that chunk ids are the same across runs, for --resume
     q_fields = """
         SELECT FieldOfStudyId
         FROM FieldsOfStudy
         WHERE Level = 0
+        ORDER BY FieldOfStudyId
     """
 
     q_years = """
@@ -229,31 +539,109 @@ def main():
             SELECT goid
             FROM current_links
         ) USING(goid)
+        ORDER BY degree_year
     """
 
     fields = con.execute(q_fields).fetchall()
     fields = [f[0] for f in fields]
     years = con.execute(q_years).fetchall()
     years = [y[0] for y in years]
+
+    cache_dir = None
+    if args.topic_cache:
+        cache_dir = args.cache_dir
+        ConceptVectorCache(cache_dir=cache_dir, max_level=args.max_level).validate(con)
+
+    queries_all = tsf.QueryBuilder(
+        degree_year_to_query=None,
+        window_size=args.window_size,
+        field_to_query=None,
+        qmarks_doctypes=insert_questionmark_doctypes,
+        keep_doctypes=keep_doctypes,
+        max_level=args.max_level
+    )
+
+    lookup_dir = None
+    if args.shared_lookups:
+        lookup_dir = f"{str(write_url)}/lookups/"
+        logging.info("Saving shared lookup tables")
+        save_lookups(con=con, lookup_dir=lookup_dir, queries=queries_all)
+
+    costs = {}
+    if args.parallel:
+        logging.info("Estimating costs of chunks")
+        costs = estimate_costs(con=con, queries=queries_all)
     con.close()
     
 
     inputs = itertools.product(
-        [db_file], [f"{str(write_url)}/"], years, fields, [args.top_n_authors], [args.max_level], [args.window_size]
+        [db_file], [f"{str(write_url)}/"], years, fields, [args.top_n_authors], [args.max_level], [args.window_size],
+        [args.similarity_engine], [args.stream_top_match], [cache_dir], [lookup_dir], [args.output_format]
         )
 
-    enumerated_inputs = enumerated_arguments(inputs, limit=args.limit)
+    enumerated_inputs = list(enumerated_arguments(inputs, limit=args.limit))
+    if args.resume:
+        n_chunks = len(enumerated_inputs)
+        enumerated_inputs = [
+            chunk for chunk in enumerated_inputs if not chunk_done(write_url, chunk[0], args.output_format)
+        ]
+        logging.info(f"Resuming: {n_chunks - len(enumerated_inputs)} of {n_chunks} chunks are done.")
     #logging.debug(f"{list(enumerated_inputs)=}")
+
+    # merge the parts of the author cache of a field when all its chunks are done
+    compact_when_done = None
+    if cache_dir is not None:
+        topic_cache = ConceptVectorCache(cache_dir=cache_dir, max_level=args.max_level)
+        chunks_left = collections.Counter(chunk[4] for chunk in enumerated_inputs)
+        def compact_when_done(chunk):
+            chunks_left[chunk[4]] -= 1
+            if chunks_left[chunk[4]] == 0:
+                topic_cache.compact(chunk[4])
     ctx = mp.get_context("forkserver")
     logging.info("Running queries")
-    if not args.parallel:
-        inputs = (0, db_file, write_url, 2005, 162324750, args.top_n_authors, args.max_level, args.window_size)
-        get_similarities(inputs)
+    if args.sweep:
+        # one input per field, with the chunks of all degree years
+        chunks_by_field = {}
+        for chunk in enumerated_inputs:
+            chunks_by_field.setdefault(chunk[4], []).append(chunk)
+        if not args.parallel:
+            for chunks in chunks_by_field.values():
+                get_similarities_sweep(chunks)
+        else:
+            failed = run_scheduled(
+                func=get_similarities_sweep, 
+                inputs=[
+                    (f"field {field}", sum(costs.get((c[3], field), 0) for c in chunks), chunks) 
+                    for field, chunks in chunks_by_field.items()
+                ],
+                n_cores=args.n_cores,
+                mp_context=ctx,
+                max_retries=args.max_retries
+            )
+    elif not args.parallel:
+        for chunk in enumerated_inputs:
+            get_similarities(chunk)
+            if compact_when_done is not None:
+                compact_when_done(chunk)
     else:
-        with ProcessPoolExecutor(max_workers=args.n_cores, mp_context=ctx) as executor:
-            result = executor.map(get_similarities, enumerated_inputs, chunksize=1)
+        failed = run_scheduled(
+            func=get_similarities,
+            inputs=[
+                (f"chunk {c[0]} (degree_year={c[3]}, field={c[4]})", costs.get((c[3], c[4]), 0), c) 
+                for c in enumerated_inputs
+            ],
+            n_cores=args.n_cores,
+            mp_context=ctx,
+            max_retries=args.max_retries,
+            on_done=compact_when_done
+        )
 
     print("--queries finished.")
+    if args.parallel and failed:
+        warnings.warn(f"Failed: {', '.join(failed)}. Rerun with --resume to process them.")
+
+    if lookup_dir is not None:
+        shutil.rmtree(lookup_dir)
 
     # check number of created files is as expected
     n_expected = len(years) * len(fields)
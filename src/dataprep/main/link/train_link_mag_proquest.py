@@ -41,55 +41,14 @@ if __name__ == "__main__":
     # https://stackoverflow.com/questions/3300464/how-can-i-get-dict-from-sqlite-query
     # https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.row_factory
 
-    with read_dict_con as con:
-        cur = con.cursor()
-        if args.linking_type == "graduates": # TODO: fix this when all queries are fixed 
-            cur.execute(query_mag, tuple(id_field + id_field)) # this is necessary because we query fieldofstudytable 2x
-        else: 
-            cur.execute(query_mag, tuple(id_field + id_field))
-        magdata = {i: row for i, row in custom_enumerate(cur.fetchall(), "AuthorId")}
-        cur = con.cursor()
-        if args.linking_type == "grants":
-            cur.execute(query_other)
-            otherdata = {i: row for i, row in custom_enumerate(cur.fetchall(), nsf_entity_id)}
-        else:
-            cur.execute(query_other, tuple(id_field))
-            otherdata = {i: row for i, row in custom_enumerate(cur.fetchall(), pq_entity_id)} # TODO: rename proquestdata to otherdata
-
+    magdata, otherdata = load_data(query_mag, query_other)
 
-    # transform the strings to hashable sequences
+    # transform the strings to hashable sequences: see `main.link.record_store.transform_records`
     keyword_corpus = set()
     for data in [magdata, otherdata]:
-        for key in data.keys():
-            if data[key]["keywords"] is not None:
-                data[key]["keywords"] = frozenset([x for x in data[key]["keywords"].split(";") if x != ""]) 
-                keyword_corpus.add(data[key]["keywords"])
-                # the list comp above deals with cases "word1;word2;" (the last ; gives an empty last element in the output of split())
-
-            features = ["institution", "coauthors", "year_range",
-                        "main_us_institutions_year", "all_us_institutions_year",
-                        "year_papertitle"]
-            ft_in_data = list(data[list(data.keys())[0]].keys()) # extract all features of the first record in the dict data
-            features = [f for f in features if f in ft_in_data]
-            for feature in features:
-                if data[key][feature] is not None:
-                    if feature in ["main_us_institutions_year", "all_us_institutions_year",
-                                    "year_papertitle"]:
-                        # split, make first entry numeric, convert to tuple
-                        ft = [x.split("//") for x in data[key][feature].split(";")]
-                        ft = [tuple([int(x[0]), x[1]]) for x in ft] 
-                        data[key][feature] = tuple(ft)
-                    elif feature == "year_range":
-                        ft = data[key][feature]
-                        if isinstance(ft, str):
-                            ft = ft.split(";")
-                            ft = tuple([int(f) for f in ft])
-                        else:
-                            assert isinstance(ft, int) 
-                            ft = (ft, )
-                        data[key][feature] = ft
-                    else:
-                        data[key][feature] = tuple(data[key][feature].split(";"))
+        for record in data.values():
+            if record["keywords"] is not None:
+                keyword_corpus.add(record["keywords"])
     
     # NOTE
         # need `frozenset` for the set feature; while the documentation says tuples also work, there is a bug 
@@ -115,6 +74,15 @@ if __name__ == "__main__":
         #     areas = mag_areas + proquest_areas
 
         if args.linking_type == "graduates":
+            title_comparator = cf.year_title_comparator
+            if args.fitted_tfidf:
+                # fit the tf-idf model once on all titles instead of on each compared pair
+                title_corpus = [
+                    title for data in [magdata, otherdata] for record in data.values() 
+                    if record["year_papertitle"] is not None
+                    for title in cf.list_from_tuples(record["year_papertitle"])
+                ]
+                title_comparator = cf.FittedTextComparator(title_corpus).year_title_comparator
             # TODO: these definitions here should be eventually standardized across cases
             fields = [
                 {"field": "firstname", "variable name": "firstname", "type": "String", "has missing": False},
@@ -130,7 +98,7 @@ if __name__ == "__main__":
                 {"type": "Interaction", "interaction variables": ["year", "firstname"]},
                 {"type": "Interaction", "interaction variables": ["year", "lastname"]},
                 {"type": "Interaction", "interaction variables": ["year", "yeardiff_larger_than_0"]},
-                {"field": "year_papertitle", "variable name": "title_similarity", "type": "Custom", "comparator" : cf.year_title_comparator, "has missing": True},
+                {"field": "year_papertitle", "variable name": "title_similarity", "type": "Custom", "comparator" : title_comparator, "has missing": True},
                 {"type": "Interaction", "interaction variables": ["title_similarity", "firstname"]},
                 {"type": "Interaction", "interaction variables": ["title_similarity", "lastname"]},
                 {"type": "Interaction", "interaction variables": ["title_similarity", "year"]}
@@ -3,11 +3,16 @@
 """
 Check that tables in database are the same as the original csv files.
 
+With --validate, compare row counts and checksums by range of the id of each table 
+instead of the total number of rows; see helpers/checksums.py. 
+The results are stored in the database and only files and tables that changed
+since the last run are scanned again.
 """
 
 import os
 import warnings
 import sys
+import argparse
 
 import sqlite3 as sqlite
 import subprocess
@@ -15,30 +20,64 @@ import pdb
 import re
 
 from helpers.variables import rawdatapath, db_file, mag_file_locations as file_locations
-
-conn = sqlite.connect(database = db_file)
+from helpers.checksums import scan_tables, compare, default_range_size
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--validate", action=argparse.BooleanOptionalAction,
+                    help="Compare checksums by range of ids instead of the number of rows.")
+parser.add_argument("--range_size", type=int, default=default_range_size,
+                    help="Size of the ranges of ids for the checksums.")
+parser.add_argument("--n_jobs", type=int, default=4,
+                    help="Number of files and tables to scan in parallel.")
+parser.add_argument("--rescan", action=argparse.BooleanOptionalAction,
+                    help="Scan all files and tables, also if they did not change since the last run.")
+parser.set_defaults(validate=False, rescan=False)
+args = parser.parse_args()
+
+
+def validate(conn, tables):
+    "Compare checksums of the files and `tables` in the database; scan only what changed."
+    files = {tbl: f"{rawdatapath}{file_locations[tbl]}{tbl}.txt" for tbl in tables}
+    results, scanned = scan_tables(conn, db_file, files, args.range_size, n_jobs=args.n_jobs, rescan=args.rescan)
+
+    for tbl in tables:
+        for source in ["file", "db"]:
+            if (tbl, source) not in scanned:
+                print(f"{tbl}: {source} did not change since the last run")
+        nrow_file = sum(n for n, _ in results[tbl]["file"].values())
+        nrow_db = sum(n for n, _ in results[tbl]["db"].values())
+        differences = compare(results[tbl]["file"], results[tbl]["db"])
+        print(tbl)
+        print(f"Number of records: {nrow_db} in db, {nrow_file} in file")
+        if len(differences) == 0:
+            print("Checksums match \n")
+        else:
+            ranges = [f"[{r * args.range_size}, {(r + 1) * args.range_size})" if r >= 0 else "non-integer ids" 
+                      for r in differences]
+            print(f"Checksums differ for ids in {', '.join(ranges)} \n")
+
+
+conn = sqlite.connect(database = db_file, isolation_level = None)
 
 db_tables = conn.execute("SELECT NAME FROM SQLITE_MASTER WHERE TYPE = 'table' ").fetchall()
 
-print('Comparing number of records in each table with number of lines in original files... \n')
+if args.validate:
+  print('Comparing checksums of each table with the original files... \n')
+  validate(conn, [table for (table, ) in db_tables if table in file_locations.keys()])
+else:
+  print('Comparing number of records in each table with number of lines in original files... \n')
 
-for table_tuple in db_tables:
-  table = table_tuple[0]
-  if table in file_locations.keys():
-    original_file = "%s%s%s.txt" % (rawdatapath, file_locations[table], table)
-    
-    nrow_db = conn.execute('SELECT COUNT(*) FROM %s LIMIT 10' % (table)).fetchone()[0]
-    nrow_file = int(subprocess.check_output('wc -l %s' % (original_file), shell = True).split()[0])
-    
-    print(table)
-    print('Number of records and lines match: %s \n' % (nrow_db == nrow_file))
+  for table_tuple in db_tables:
+    table = table_tuple[0]
+    if table in file_locations.keys():
+      original_file = "%s%s%s.txt" % (rawdatapath, file_locations[table], table)
+      
+      nrow_db = conn.execute('SELECT COUNT(*) FROM %s LIMIT 10' % (table)).fetchone()[0]
+      nrow_file = int(subprocess.check_output('wc -l %s' % (original_file), shell = True).split()[0])
+      
+      print(table)
+      print('Number of records and lines match: %s \n' % (nrow_db == nrow_file))
 
 
 conn.close()
-print('Done.')  
-
-
-
-
-
-
+print('Done.')
@@ -9,101 +9,129 @@ Create database from MAG raw files
 c = column name of the column used
 - this does not work for indices that are on two columns... not sure what is a better system 
 - need to remove "Microsoft Carriage Returns" '\r' at the end of files; 
-  otherwise they show up in the last column of tables where the last column is a string. do so by copying the original file
-  to the working directory as tempfile, removing '\r', loading into sqlite, and then deleting
+  otherwise they show up in the last column of tables where the last column is a string. 
+  `helpers.stream_load.read_rows` removes them while streaming the files into the database
+- the indexes are created after all tables are loaded
+- each step is recorded in the database `checkpoint_file`. If the script fails, running it again 
+  resumes at the step that failed. Use --restart to load everything again.
+- the steps run without rollback journal; a step is recorded only after the journal is 
+  turned on again and the database is synced (`helpers.stream_load.fast_load`). If the 
+  database is corrupt after a crash, use --restart.
+- with --n_jobs > 1, the files are parsed in parallel into separate databases in `databasepath`, 
+  which are then merged into the main database
 """
 
 # ## Packages 
 # ### general  
+import os
 import subprocess
 import argparse
+import logging
 import sqlite3 as sqlite
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # ### helpers 
 from helpers.MAGTableDefinitions import MAGtables_setup
 from helpers.variables import db_file, databasepath, rawdatapath
-from helpers.functions import analyze_db
+from helpers.functions import analyze_db, write_build_marker
+from helpers.stream_load import load_table, load_table_to_file, merge_table, fast_load, Checkpoints
+
+logging.basicConfig(level=logging.INFO)
 
 # ## Arguments
 parser = argparse.ArgumentParser(description = 'Inputs creating sqlite database')
 parser.add_argument("--nlines", type = int,
                     help="Number of lines to be read into database from each raw file.")
+parser.add_argument("--n_jobs", type = int, default = 1,
+                    help="Number of files to parse in parallel.")
+parser.add_argument("--batch_size", type = int, default = 1_000_000,
+                    help="Number of rows to insert per transaction.")
+parser.add_argument("--restart", action=argparse.BooleanOptionalAction,
+                    help="Ignore the checkpoints of an earlier run and load all tables again.")
+parser.set_defaults(restart=False)
 args = parser.parse_args()
 
 # ## connect to db
 con = sqlite.connect(database = db_file, isolation_level= None)
+checkpoint_file = f"{databasepath}load_checkpoints.sqlite"
+checkpoints = Checkpoints(checkpoint_file, restart=args.restart)
 
 
-# ## Helper functions
-def copy_trim(filename, nlines = args.nlines):
-    """
-    Copy `filename` from `rawdatapath` to `databasepath` and save as `tempfile.txt`. Can then be read into db.
-    """
-    if nlines:
-        cat_file = f"head -n {nlines} {rawdatapath}{filename}"
-    else:
-        cat_file = f"cat {rawdatapath}{filename}"
-    
-    trim_file = "tr -d $'\r'"
-    save_file = f"{databasepath}tempfile.txt"
-    cmd = f"{cat_file} | {trim_file} > {save_file}"
-    subprocess.run(cmd, shell = True)
-
-def remove_file(filename):
-    subprocess.run(f"rm -rf {databasepath}{filename}", shell = True)
-
-def file_to_table(filename, tablename):
+def load_and_mark(tbl):
+    """Load `tbl` and write a build marker for it. check_database.py and 
+    prep_citations.py --incremental compute checksums again for tables with a new marker.
     """
-    Read in `filename` into table `tablename`. 
-        - Defines separator for fields and lines.
-        - Uses the sqlite `.import` utility which is quite fast.
-    """
-    subprocess.run(
-        ["sqlite3", db_file,
-        ".mode ascii", 
-        ".separator \"\\t\" \"\\n\" ",
-        f".import {databasepath}{filename} {tablename}"
+    n_rows = load_table(con, tbl, MAGtables_setup[tbl], rawdatapath, args.nlines, args.batch_size)
+    write_build_marker(con, tbl)
+    return n_rows
+
+
+def run_step(step, func, *args):
+    "Run `func(*args)` with `fast_load` unless `step` is done; record `step` once the database is synced."
+    def run_fast(*args):
+        with fast_load(con, db_file):
+            return func(*args)
+    checkpoints.run(step, run_fast, *args)
+
+
+# ## Load the tables 
+tables_to_load = [tbl for tbl in MAGtables_setup.keys() if not checkpoints.done(f"load {tbl}")]
+print(f"Reading {len(tables_to_load)} tables: {tables_to_load} \n")
+
+if args.n_jobs > 1:
+    with ProcessPoolExecutor(max_workers=args.n_jobs) as executor:
+        futures = [
+            executor.submit(load_table_to_file, 
+                            tbl, MAGtables_setup[tbl], rawdatapath, f"{databasepath}load_{tbl}.sqlite",
+                            args.nlines, args.batch_size)
+            for tbl in tables_to_load
         ]
-    )
-
-
-# ## Loop over MAGtables_setup and read in 
+        for future in as_completed(futures):
+            tbl, db_path, n_rows = future.result()
+            print(f"Merging {tbl} \n")
+            with fast_load(con, db_file):
+                merge_table(con, tbl, MAGtables_setup[tbl], db_path)
+                write_build_marker(con, tbl)
+            checkpoints.mark(f"load {tbl}", n_rows)
+else:
+    for tbl in tables_to_load:
+        print(f"Reading {tbl} \n")
+        run_step(f"load {tbl}", load_and_mark, tbl)
+
+
+# ## Indexes of the MAG tables
 for tbl in MAGtables_setup.keys():
-    print(f"Reading {tbl} \n")
-    # prepare file
-    copy_trim(MAGtables_setup[tbl]['rawfile'])
-
-    # read table
-    con.execute(f'DROP TABLE IF EXISTS {tbl}')
-    con.execute(MAGtables_setup[tbl]['sql_create_table'])
-    file_to_table('tempfile.txt', tbl)
     if MAGtables_setup[tbl]['sql_create_index'] is not None:
-        con.execute(MAGtables_setup[tbl]['sql_create_index'])
-
-    # clean up 
-    remove_file('tempfile.txt')
+        print(f"Indexing {tbl} \n")
+        run_step(f"index {tbl}", con.execute, MAGtables_setup[tbl]['sql_create_index'])
 
 
 # ## Table with first names
+def create_firstnames(con):
+    con.execute("DROP TABLE IF EXISTS FirstNames")
+    con.execute("""CREATE TABLE FirstNames AS 
+                SELECT 
+                    SUBSTR(TRIM(NormalizedName),1,instr(trim(NormalizedName)||' ',' ')-1) AS FirstName,
+                    COUNT(DISTINCT AuthorId) AS AuthorCount 
+                FROM Authors
+                WHERE length(FirstName) > 1 
+                GROUP BY FirstName 
+                """)
+    con.execute("CREATE INDEX idx_fn_FirstName ON FirstNames (FirstName)")
+
 print("Unique first names \n")
-con.execute("DROP TABLE IF EXISTS FirstNames")
-con.execute("""CREATE TABLE FirstNames AS 
-            SELECT 
-                SUBSTR(TRIM(NormalizedName),1,instr(trim(NormalizedName)||' ',' ')-1) AS FirstName,
-                COUNT(DISTINCT AuthorId) AS AuthorCount 
-            FROM Authors
-            WHERE length(FirstName) > 1 
-            GROUP BY FirstName 
-            """)
-con.execute("CREATE INDEX idx_fn_FirstName ON FirstNames (FirstName)")
+run_step("FirstNames", create_firstnames, con)
 
 # ## Some additional indexes for faster queries (not in original MAG)
-con.execute("CREATE INDEX IF NOT EXISTS idx_p_Year ON Papers (Year ASC) ")
-con.execute("CREATE INDEX IF NOT EXISTS idx_p_DocType ON Papers (DocType) ") 
-con.execute("CREATE INDEX IF NOT EXISTS idx_pr_PaperReferenceId ON PaperReferences (PaperReferenceId ASC)")
-con.execute("CREATE INDEX idx_paa_AuthorIdAffiliationId ON PaperAuthorAffiliations (AuthorId ASC, AffiliationId ASC)")
-con.execute("CREATE INDEX idx_paa_AffiliationId ON PaperAuthorAffiliations (AffiliationId ASC)")
-con.execute("CREATE INDEX idx_pfos_FoS ON PaperFieldsOfStudy (FieldOfStudyId ASC)")
+def create_additional_indexes(con):
+    con.execute("CREATE INDEX IF NOT EXISTS idx_p_Year ON Papers (Year ASC) ")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_p_DocType ON Papers (DocType) ") 
+    con.execute("CREATE INDEX IF NOT EXISTS idx_pr_PaperReferenceId ON PaperReferences (PaperReferenceId ASC)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_paa_AuthorIdAffiliationId ON PaperAuthorAffiliations (AuthorId ASC, AffiliationId ASC)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_paa_AffiliationId ON PaperAuthorAffiliations (AffiliationId ASC)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_pfos_FoS ON PaperFieldsOfStudy (FieldOfStudyId ASC)")
+
+run_step("additional indexes", create_additional_indexes, con)
 
 
 # ## Run ANALYZE
@@ -111,6 +139,7 @@ analyze_db(con)
 
 
 # ## Show output, finish
+checkpoints.clear()
 con.close()
 
 print(f'Schema: \n')
@@ -13,7 +13,7 @@ import sqlite3 as sqlite
 import time 
 
 from helpers.variables import db_file
-from helpers.functions import analyze_db, print_elapsed_time
+from helpers.functions import analyze_db, print_elapsed_time, write_build_marker
 
 start_time = time.time()
 
@@ -113,6 +113,7 @@ with con:
     """)
 
     con.execute("CREATE UNIQUE INDEX idx_pil_goid ON pq_info_linking (goid ASC)")
+    write_build_marker(con, "pq_info_linking") # stored records for linking are outdated now
 
     analyze_db(con)
 
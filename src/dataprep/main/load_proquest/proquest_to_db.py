@@ -32,7 +32,7 @@ import numpy as np
 import re 
 
 from helpers.variables import db_file, datapath, databasepath
-from helpers.functions import analyze_db, normalize_string, drop_firstword
+from helpers.functions import analyze_db, normalize_string_fast, drop_firstword, apply_to_unique, write_build_marker
 from helpers.us_states import us_states 
 
 
@@ -46,7 +46,35 @@ def extract_state(s):
     else:
         return None
 
+# define PhD degrees
+phd_degrees = ["Ph.D.", "Dr.", "D.Phil"]
+phd_descriptions = "PhD|Ph.D.|Doctor|Docteur|Doktor"
+# Note: this will keep also "Doctor of Education"/"Doctor of Engineering" etc, but the distinction
+    # to PhD is not so clear (at least for these two, one can also go to research after graduation)
+
+def keep_phd(authors):
+    "Keep only PhD degrees"
+    return authors.loc[(authors["degree_level"].isin(phd_degrees)) | 
+                        (authors["degree_description"].str.contains(phd_descriptions, regex = True))
+                    ]
+
+
+def read_phd_authors(filename, chunksize):
+    """Read authors.csv in chunks and keep only PhD degrees, 
+    so that the full extract is never in memory at once.
+    """
+    text_columns = ["lastname", "firstname", "middlename", "degree_level", "university_location",
+                    "degree_description", "university", "numeric_date", "department", "doctitle"]
+    chunks = pd.read_csv(filename, 
+                        sep = "\t", 
+                        usecols = ["goid", "position", "degree_year"] + text_columns,
+                        dtype = {c: "str" for c in text_columns}, # the same types in all chunks
+                        chunksize = chunksize)
+    return pd.concat([keep_phd(chunk) for chunk in chunks])
+
+
 path_proquest = "extract_november122021/"
+chunksize_authors = 1_000_000
 con = sqlite.connect(database = db_file, isolation_level= None)
 
 
@@ -55,10 +83,7 @@ print("Reading files... \n")
 advisors = pd.read_csv(datapath + path_proquest + "advisors.csv", 
                         sep = "\t", 
                         usecols = ["goid", "position", "lastname", "firstname"])
-authors = pd.read_csv(datapath + path_proquest + "authors.csv", 
-                        sep = "\t", 
-                        usecols = ["goid", "position", "lastname", "firstname", "middlename", "degree_year", "degree_level", "university_location",
-                                    "degree_description", "university", "numeric_date", "department", "doctitle"])
+authors = read_phd_authors(datapath + path_proquest + "authors.csv", chunksize=chunksize_authors) # keeps only PhD degrees
 fields = pd.read_csv(datapath + path_proquest + "fields.csv", 
                         sep = "\t", 
                         usecols = ["goid", "position", "fieldcode", "fieldname"],
@@ -68,16 +93,7 @@ authors = authors.rename(columns = {"doctitle": "originaltitle"})
 # ## Clean 
 print("Cleaning... \n")
 
-# ### Keep only PhD degrees
-
-# define PhD degrees
-phd_degrees = ["Ph.D.", "Dr.", "D.Phil"]
-phd_descriptions = "PhD|Ph.D.|Doctor|Docteur|Doktor"
-# Note: this will keep also "Doctor of Education"/"Doctor of Engineering" etc, but the distinction
-    # to PhD is not so clear (at least for these two, one can also go to research after graduation)
-authors = authors.loc[(authors["degree_level"].isin(phd_degrees)) | 
-                        (authors["degree_description"].str.contains(phd_descriptions, regex = True))
-                    ]
+# ### Keep only PhD degrees: done in `read_phd_authors`
 n_authors = authors.shape[0]
 print(f"Starting with {n_authors} authors with PhD. \n")
 
@@ -88,19 +104,19 @@ n_authors = authors.shape[0]
 
 # ### Normalize names, fields and titles
 for name in ["lastname", "firstname", "middlename"]:
-    authors[name] = normalize_string(authors[name])
+    authors[name] = normalize_string_fast(authors[name])
     if name != "middlename":
-        advisors[name] = normalize_string(advisors[name])
+        advisors[name] = normalize_string_fast(advisors[name])
 
-fields["fieldname"] = normalize_string(fields["fieldname"], replace_hyphen = " ")
-authors["uni_normalized"] = normalize_string(authors["university"], replace_hyphen = " ")
+fields["fieldname"] = normalize_string_fast(fields["fieldname"], replace_hyphen = " ")
+authors["uni_normalized"] = normalize_string_fast(authors["university"], replace_hyphen = " ")
 authors["uni_normalized"] = authors["uni_normalized"].replace("the university", "university", regex = True)
 authors["uni_normalized"] = authors["uni_normalized"].str.removeprefix("the ")
 
 authors["uni_normalized"] = authors["uni_normalized"].str.strip()
 
 # ### Normalize titles
-authors["thesistitle"] = normalize_string(authors["originaltitle"], replace_hyphen = " ") # also seems analoguous to MAG
+authors["thesistitle"] = normalize_string_fast(authors["originaltitle"], replace_hyphen = " ") # also seems analoguous to MAG
 
 # ### Drop records with multiple authors, degree_year > 1900, missing university 
 authors["max_position"] = (authors["position"].
@@ -117,9 +133,9 @@ n_authors = authors.shape[0]
 
 # ### Further normalize uni locations
     # Remove country (in location) from uni_normalized; drop "the" when at start of name
-authors["location_normalized"] =  normalize_string(authors["university_location"], replace_hyphen="")
-authors["uni_normalized"] = authors.apply(lambda row: row.uni_normalized.replace(row.location_normalized, ""), axis = "columns")
-authors["uni_normalized"] = authors["uni_normalized"].apply(lambda s: drop_firstword(s, "the"))
+authors["location_normalized"] =  normalize_string_fast(authors["university_location"], replace_hyphen="")
+authors["uni_normalized"] = apply_to_unique(authors, ["uni_normalized", "location_normalized"], 
+                                            lambda uni, location: drop_firstword(uni.replace(location, ""), "the"))
 authors["uni_normalized"] = authors["uni_normalized"].str.replace("united kingdom", "") 
     # NOTE: some other universities are also wrong there (germany, poland, ...), but UK is the most important for our purpose at the moment
 authors["uni_normalized"] = authors["uni_normalized"].str.strip()
@@ -128,7 +144,7 @@ authors = authors.drop(columns = {"location_normalized"})
 # ### create extract last part of name for lastname, put rest into the middlename
 # make the middlename as follows: if "", then " ", otherwise " name ". then paste without empty spaces
 authors["middlename"] = np.where(authors["middlename"].isna(), "", authors["middlename"])
-authors["middlename"] = authors["middlename"].apply(lambda s: f" {s} " if s != "" else " ") 
+authors["middlename"] = np.where(authors["middlename"] != "", " " + authors["middlename"] + " ", " ")
 authors["fullname"] = authors["firstname"] + authors["middlename"] + authors["lastname"]
 
 
@@ -172,9 +188,8 @@ dict_replace_uninames = { # for better linking to cng
     "university of missouri rolla": "missouri university of science and technology"
 }
 
-for k, v in dict_replace_uninames.items():
-    mask = authors["uni_normalized"] == k
-    authors["uni_normalized"] = np.where(mask, v, authors["uni_normalized"])
+# exact matches only; no name in the values is also a key, so one pass is enough
+authors["uni_normalized"] = authors["uni_normalized"].replace(dict_replace_uninames)
 
 # assign remaining ones to "SUNY system" (there are the most pubs in mag from this entity)
 mask = (authors["uni_normalized"].str.contains("state university of new york")) \
@@ -243,7 +258,7 @@ unis = (authors.loc[:, ["university_id", "university", "uni_normalized", "univer
         )
 unis = unis.drop_duplicates(subset=["university_id"])
 
-unis["state"] = unis.apply(lambda row: extract_state(row["location"]), axis=1)
+unis["state"] = unis["location"].map(extract_state)
 unis["state"] = unis["state"].str.strip()
 
 unis = (unis
@@ -337,6 +352,7 @@ for k, v in db_inputs.items():
     )
     for command in v["create_idx"]:
         con.execute(command)
+    write_build_marker(con, tbl)
     os.remove(filename)
 
 
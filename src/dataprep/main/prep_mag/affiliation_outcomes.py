@@ -19,8 +19,9 @@ import argparse
 import sqlite3 as sqlite
 import logging 
 import time 
-from helpers.functions import analyze_db
+from helpers.functions import analyze_db, write_build_marker
 from helpers.variables import db_file
+from helpers.partitions import partition_filter, key_ranges, create_table_partitioned
 
 
 logging.basicConfig(level=logging.INFO)
@@ -29,6 +30,8 @@ logging.basicConfig(level=logging.INFO)
 parser = argparse.ArgumentParser()
 parser.add_argument("--fos_max_level", type=int, default=2,
                     help="Fields of study up to which level to include?")
+parser.add_argument("--partitions", type=int, default=1,
+                    help="Run the queries on the papers in this many partitions of PaperId in parallel.")
 args = parser.parse_args()
 
 # ## Variables; connect to db
@@ -64,26 +67,27 @@ INNER JOIN (
     SELECT PaperId
     FROM paper_outcomes
 ) USING(PaperId)
+WHERE {partition_filter}
 """
 
+paper_ranges = key_ranges(con, "paper_outcomes", "PaperId", args.partitions)
+
 with con as c:
-    c.execute(f"""
-        CREATE TEMP TABLE paper_affiliation_year AS 
+    create_table_partitioned(c, db_file, "paper_affiliation_year", f"""
         SELECT DISTINCT AffiliationId, Year, PaperId
         FROM (
             {base_query}
         )
-    """)
+    """, key="b.PaperId", ranges=paper_ranges, temporary=True)
 
     c.execute("CREATE INDEX idx_paper_temp ON paper_affiliation_year (PaperId)")
 
-    c.execute(f"""
-        CREATE TEMP TABLE author_affiliation_year AS 
+    create_table_partitioned(c, db_file, "author_affiliation_year", f"""
         SELECT DISTINCT AuthorId, AffiliationId, Year, PaperId
         FROM (
             {base_query}
         )
-    """)
+    """, key="b.PaperId", ranges=paper_ranges, temporary=True)
 
     c.execute("CREATE INDEX idx_paper_aay_temp ON author_affiliation_year (PaperId)")
     c.execute("CREATE INDEX idx_author_aay_temp ON author_affiliation_year (AuthorId)")
@@ -181,6 +185,10 @@ with con as c:
     c.execute("CREATE INDEX idx_afff_Year ON affiliation_fields (Year)")
     c.execute("CREATE INDEX idx_afff_FoS ON affiliation_fields (FieldOfStudyId)")
 
+# cached concept vectors for topic_similarity are outdated now
+for tbl in ["affiliation_outcomes", "affiliation_fields"]:
+    write_build_marker(con, tbl)
+
 # ## Run ANALYZE, finish
 with con as c:
     analyze_db(c)
@@ -27,14 +27,17 @@ import sqlite3 as sqlite
 import warnings
 import time 
 import argparse
-from helpers.functions import print_elapsed_time, analyze_db
+from helpers.functions import print_elapsed_time, analyze_db, write_build_marker
 from helpers.variables import db_file, insert_questionmark_doctypes_citations, keep_doctypes_citations
+from helpers.partitions import partition_filter, key_ranges, create_table_partitioned
 
 
 # ## Arguments
 parser = argparse.ArgumentParser()
 parser.add_argument("--years_first_field", type = int, default = 5,
                     help="How many years to consider when calculating the first field of the author?")
+parser.add_argument("--partitions", type = int, default = 1,
+                    help="Run the queries over the whole career in this many partitions of AuthorId in parallel.")
 args = parser.parse_args()
 
 interactive = False
@@ -50,11 +53,12 @@ if interactive:
     # shorten query limits for faster runs when trying out code. 
     query_limit = "LIMIT 10" # make sure all query have this somewhere!
 
+author_ranges = key_ranges(con, "author_sample", "AuthorId", args.partitions)
+
 # ## Temp table with papers in first x years 
 print(f"Making temp table with papers in first {args.years_first_field} years.", flush=True)
 print(f"--Considering papers with DocType {keep_doctypes_citations}.", flush=True)
-con.execute(f"""
-CREATE TEMP TABLE papers_start AS 
+create_table_partitioned(con, db_file, "papers_start", f"""
 SELECT AuthorId
     , PaperId
 FROM (
@@ -73,10 +77,12 @@ FROM (
         FROM author_sample
     ) AS c USING(AuthorId) 
     WHERE b.Year <= c.YearFirstPub + (?)
+        AND {partition_filter}
 )
 WHERE paper_number <= 10 -- selects the first 10 papers if there are more from a given author
 """,
-(keep_doctypes_citations + (args.years_first_field,) )
+(keep_doctypes_citations + (args.years_first_field,) ),
+key="a.AuthorId", ranges=author_ranges, temporary=True
 )
 
 con.execute("CREATE UNIQUE INDEX idx_ps_PaperAuthorId ON papers_start (PaperId ASC, AuthorId ASC)")
@@ -228,8 +234,7 @@ con.execute("CREATE UNIQUE INDEX idx_inst_AuthorId ON institutions (AuthorId ASC
     # main = where a paper is published
 print("Creating temp table for affiliation names over the whole career", flush=True)
 con.execute("DROP TABLE IF EXISTS institutions_career")
-con.execute(f"""
-CREATE TEMP TABLE institutions_career AS 
+create_table_partitioned(con, db_file, "institutions_career", f"""
 SELECT AuthorId
     , GROUP_CONCAT(main_institutions, ";") AS main_institutions
     , GROUP_CONCAT(main_us_institutions, ";") AS main_us_institutions
@@ -258,12 +263,14 @@ FROM (
             FROM Affiliations
             WHERE Iso3166Code = 'US'
         ) d USING(AffiliationId)
+        WHERE {partition_filter}
     )
     ORDER by main_us_institutions
 )
 GROUP BY AuthorId 
 """,
-keep_doctypes_citations
+keep_doctypes_citations,
+key="a.AuthorId", ranges=author_ranges, temporary=True
 )
 
 con.execute("CREATE UNIQUE INDEX idx_inst_career_AuthorId ON institutions_career (AuthorId ASC)")
@@ -309,8 +316,7 @@ con.execute("CREATE UNIQUE INDEX idx_inst_career_year_AuthorId ON institutions_y
     # uses *any* document ever published by the person
 print("Creating temp table for affiliation-year pairs over career", flush=True)
 con.execute("DROP TABLE IF EXISTS all_institutions_year_career")
-con.execute(f"""
-CREATE TEMP TABLE all_institutions_year_career AS 
+create_table_partitioned(con, db_file, "all_institutions_year_career", f"""
 SELECT AuthorId
     , GROUP_CONCAT(year || "//" || affiliation_name, ";") AS all_us_institutions_year
 FROM (
@@ -335,11 +341,13 @@ FROM (
             SELECT AuthorId
             FROM author_sample {query_limit} 
         ) USING (AuthorId)
+        WHERE {partition_filter}
     )
     ORDER BY Year, affiliation_name
 )
 GROUP BY AuthorId
-"""
+""",
+key="AuthorId", ranges=author_ranges, temporary=True
 )
 
 con.execute("CREATE UNIQUE INDEX idx_allinst_career_year_AuthorId ON all_institutions_year_career (AuthorId ASC)")
@@ -403,6 +411,7 @@ LEFT JOIN paper_titles_start h USING(AuthorId)
 """)
 
 con.execute("CREATE UNIQUE INDEX idx_ail_AuthorId ON author_info_linking (AuthorId ASC)")
+write_build_marker(con, "author_info_linking") # stored records for linking are outdated now
 
 
 # ## Run ANALYZE, finish
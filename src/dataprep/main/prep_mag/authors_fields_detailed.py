@@ -15,13 +15,16 @@ import warnings
 import time 
 import argparse
 import logging 
-from helpers.functions import print_elapsed_time, analyze_db
+from helpers.functions import print_elapsed_time, analyze_db, write_build_marker
 from helpers.variables import db_file, insert_questionmark_doctypes, keep_doctypes
+from helpers.partitions import partition_filter, key_ranges, create_table_partitioned
 
 logging.basicConfig(level=logging.INFO)
 
 # ## Arguments
 parser = argparse.ArgumentParser()
+parser.add_argument("--partitions", type = int, default = 1,
+                    help="Run the base query in this many partitions of AuthorId in parallel.")
 args = parser.parse_args()
 
 # ## Variables; connect to db
@@ -57,18 +60,16 @@ base_query = f"""
         FROM Papers
         WHERE DocType IN ({insert_questionmark_doctypes})
     ) USING(PaperId)
+    WHERE {partition_filter}
     {query_limit}
 """
 
 
 with con as c:
     logging.debug("Running base query")
-    c.execute(f"""
-        CREATE TEMP TABLE author_paper_field_temp AS 
-        {base_query}
-        """, 
-        keep_doctypes
-    )
+    create_table_partitioned(c, db_file, "author_paper_field_temp", base_query, keep_doctypes,
+                             key="AuthorId", ranges=key_ranges(c, "author_sample", "AuthorId", args.partitions),
+                             temporary=True)
 
     logging.debug("Creating temp tables")
     c.execute("""
@@ -114,6 +115,9 @@ with con as c:
     for idx in indexes:
         c.execute(f"CREATE {idx}")
 
+# cached concept vectors for topic_similarity are outdated now
+write_build_marker(con, "author_fields_detailed")
+
 
 # ## Run ANALYZE, finish
 with con as c:
@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Script collab_graph.py
+    Save author_collab as a graph in compressed sparse row (CSR) format;
+    see helpers/collab_graph.py for the format and for `CollabGraph` to read it.
+
+Run from src/dataprep with
+    python -m main.prep_mag.collab_graph --graph_dir ...
+"""
+
+import time
+import argparse
+import sqlite3 as sqlite
+
+from helpers.variables import db_file, collab_graph_path
+from helpers.collab_graph import build_collab_graph
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Save author_collab as graph")
+    parser.add_argument("--graph_dir", type=str, default=collab_graph_path,
+                        help="Directory to save the graph to.")
+    parser.add_argument("--batch_size", type=int, default=10_000_000,
+                        help="Number of rows of author_collab to process at once.")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    con = sqlite.connect(database="file:" + db_file + "?mode=ro",
+                         isolation_level=None, uri=True) # read-only connection
+    n_nodes, n_edges = build_collab_graph(con, args.graph_dir, args.batch_size)
+    con.close()
+    print(f"Saved graph with {n_nodes} authors and {n_edges} collaborations to {args.graph_dir}")
+    print(f"Done in {(time.time() - start_time)/60} minutes.")
@@ -0,0 +1,81 @@
+"""
+Sharded extraction of author-coauthor-year combinations for author_collab
+
+The authors in author_sample are split into ranges of AuthorId. Each range is
+queried in a worker process that writes the unique, sorted
+(AuthorId, CoAuthorId, Year) combinations of its authors into a scratch
+database; the scratch databases are then merged into author_collab in the
+order of the ranges (`helpers.partitions.create_table_partitioned`).
+author_collab is then sorted by the key of the unique index, which makes
+building the index cheap. The workers only read the database, so they do
+not wait for the writer.
+
+Papers without Year are dropped.
+"""
+
+from helpers.variables import keep_doctypes, insert_questionmark_doctypes
+from helpers.partitions import partition_filter, create_table_partitioned
+
+
+query_coauthors = f"""
+    SELECT DISTINCT a.AuthorId, d.AuthorId AS CoAuthorId, d.Year
+        FROM PaperAuthorUnique AS a
+        INNER JOIN (
+            SELECT b.*, c.Year
+            FROM PaperAuthorUnique AS b
+            INNER JOIN (
+                SELECT PaperId, Year
+                FROM Papers
+                WHERE DocType IN ({insert_questionmark_doctypes})
+                    AND Year IS NOT NULL
+            ) AS c
+            USING (PaperId)
+        ) AS d
+        ON (a.PaperId = d.PaperId and a.AuthorId != d.AuthorId)
+        -- drop authors not in author_sample
+        INNER JOIN (
+            SELECT AuthorId
+            FROM author_sample
+            WHERE {partition_filter}
+        ) AS e ON (a.AuthorId = e.AuthorId)
+        INNER JOIN (
+            SELECT AuthorId
+            FROM author_sample
+        ) AS f on (CoAuthorId = f.AuthorId)
+    ORDER BY a.AuthorId, CoAuthorId, d.Year
+    """
+
+
+def author_ranges(con, n_authors, chunk_size):
+    """Split the first `n_authors` AuthorIds in author_sample, in ascending order,
+    into ranges of `chunk_size` authors. Returns a list of (low, high) with the 
+    AuthorIds low < AuthorId <= high, as `helpers.partitions.key_ranges`; 
+    the first range has no lower bound.
+    """
+    authors = con.execute(
+        "SELECT DISTINCT AuthorId FROM author_sample ORDER BY AuthorId LIMIT ?", (n_authors,)
+    ).fetchall()
+    highs = [a for (a, ) in authors][chunk_size - 1::chunk_size]
+    if len(authors) % chunk_size != 0:
+        highs.append(authors[-1][0])
+    return list(zip([None] + highs[:-1], highs))
+
+
+def create_collab_table_partitioned(con, db_file, ranges, n_jobs):
+    """Create author_collab with `query_coauthors` on `con`, querying the `ranges` 
+    from `author_ranges` in `n_jobs` processes. Does not create the indexes.
+    """
+    con.execute("DROP TABLE IF EXISTS author_collab")
+    create_table_partitioned(con, db_file, "author_collab", query_coauthors, tuple(keep_doctypes),
+                             key="AuthorId", ranges=ranges, n_jobs=n_jobs)
+
+
+def create_collab_table(con):
+    con.execute("DROP TABLE IF EXISTS author_collab")
+    con.execute("CREATE TABLE author_collab (AuthorId INTEGER, CoAuthorId INTEGER, Year INTEGER)")
+
+
+def create_collab_indexes(con):
+    con.execute("CREATE UNIQUE INDEX idx_acllb_AuthorCoAuthorYear ON author_collab (AuthorId ASC, CoAuthorId ASC, Year)")
+    con.execute("CREATE INDEX idx_acllb_CoAuthorIdYear ON author_collab (CoAuthorId ASC, Year)")
+    con.execute("CREATE INDEX idx_acllb_AuthorIdYear ON author_collab (AuthorId ASC, Year)")
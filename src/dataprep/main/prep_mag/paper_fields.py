@@ -34,7 +34,7 @@ import sqlite3 as sqlite
 import time 
 import pandas as pd
 
-from helpers.functions import print_elapsed_time, analyze_db
+from helpers.functions import print_elapsed_time, analyze_db, write_build_marker
 from helpers.variables import db_file, insert_questionmark_doctypes, keep_doctypes
 
 # ## Variables; connect to db
@@ -178,6 +178,7 @@ con.execute("""CREATE TABLE PaperMainFieldsOfStudy AS
 con.execute("CREATE UNIQUE INDEX idx_pmf_PaperId ON PaperMainFieldsOfStudy (PaperId ASC) ")
 con.execute("CREATE INDEX idx_pmf_Field0 ON PaperMainFieldsOfStudy (Field0 ASC) ") # this is for quick sampling of papers by field of study id
 con.execute("CREATE INDEX idx_pmf_Field1 ON PaperMainFieldsOfStudy (Field1 ASC) ") # this is for quick sampling of papers by field of study id
+write_build_marker(con, "PaperMainFieldsOfStudy") # for prep_citations.py --incremental
 
 print_elapsed_time(start_time)
 
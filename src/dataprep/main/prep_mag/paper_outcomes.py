@@ -7,6 +7,11 @@ Script paper_outcomes.py
 Generate a table with paper variables:
 - number of authors per paper 
 - citation measures: number of citations in first x years
+
+With --incremental, only the rows of papers whose citations, publication year
+or team size changed are updated. The papers with changed citations are read
+from citations_changed, which is filled by prep_citations.py --incremental.
+If paper_outcomes or citations_changed do not exist, the table is built in full.
 """
 
 import sqlite3 as sqlite
@@ -18,7 +23,11 @@ from helpers.variables import db_file
 
 
 # ## Arguments
-
+parser = argparse.ArgumentParser()
+parser.add_argument("--incremental", action=argparse.BooleanOptionalAction,
+                    help="Only update the papers affected by changes since the last build.")
+parser.set_defaults(incremental=False)
+args = parser.parse_args()
 
 # ## Variables; connect to db
 start_time = time.time()
@@ -39,8 +48,43 @@ con.execute('''CREATE TEMPORARY TABLE paper_teamsize AS
                 ''')
 con.execute("CREATE UNIQUE INDEX idx_pa_PaperId on paper_teamsize (PaperId ASC)")
 
+# ## Papers to update
+def table_exists(con, table):
+    query = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?"
+    return con.execute(query, (table, )).fetchone()[0] > 0
+
+incremental = args.incremental and table_exists(con, "paper_outcomes") and table_exists(con, "citations_changed")
+if args.incremental and not incremental:
+    print("No previous build to update. Making the full table. \n")
+
+restriction = ""
+if incremental:
+    con.execute("DROP TABLE IF EXISTS affected_outcomes")
+    con.execute("CREATE TEMPORARY TABLE affected_outcomes (PaperId INTEGER PRIMARY KEY)")
+    con.execute("""INSERT OR IGNORE INTO affected_outcomes 
+                SELECT PaperId FROM citations_changed
+                UNION 
+                SELECT PaperId FROM (
+                    SELECT PaperId, AuthorCount FROM paper_teamsize
+                    WHERE PaperId IN (SELECT PaperId FROM Papers)
+                    EXCEPT 
+                    SELECT PaperId, AuthorCount FROM paper_outcomes
+                )
+                UNION 
+                SELECT PaperId FROM (
+                    SELECT PaperId, AuthorCount FROM paper_outcomes
+                    EXCEPT 
+                    SELECT PaperId, AuthorCount FROM paper_teamsize
+                )
+                UNION 
+                SELECT PaperId FROM paper_outcomes WHERE PaperId NOT IN (SELECT PaperId FROM Papers)
+                """)
+    n_affected = con.execute("SELECT COUNT(*) FROM affected_outcomes").fetchone()[0]
+    print(f"Updating {n_affected} papers. \n")
+    restriction = "AND b.PaperId IN (SELECT PaperId FROM affected_outcomes)"
+
 # ## Citation measures
-tablequery="""CREATE TEMPORARY TABLE citationtemp AS
+tablequery=f"""CREATE TEMPORARY TABLE citationtemp AS
     SELECT a.PaperReferenceId AS PaperId,
            SUM(a.CitationCount) AS CitationCount_y10,
         b.Year as YearPub
@@ -49,15 +93,17 @@ tablequery="""CREATE TEMPORARY TABLE citationtemp AS
         WHERE ReferencingDocType IS NOT NULL 
         AND ReferencingDocType IN ("Journal", "Book", "BookChapter", "Conference", "Thesis")
         AND  a.Year-b.Year <= 10
+        {restriction}
     GROUP BY a.PaperReferenceId
 """
 
-tablequery2="""CREATE TEMPORARY TABLE citationcount10 AS 
+tablequery2=f"""CREATE TEMPORARY TABLE citationcount10 AS 
     SELECT a.PaperId, 
         CASE WHEN b.CitationCount_y10 IS NULL THEN 0 ELSE b.CitationCount_y10 END
         AS CitationCount_y10
     FROM Papers a  
     LEFT JOIN citationtemp b USING(PaperId)
+    WHERE 1 {restriction.replace("b.PaperId", "a.PaperId")}
  """
 
 con.execute("""DROP TABLE IF EXISTS citationtemp""")
@@ -70,7 +116,7 @@ con.execute("CREATE UNIQUE INDEX id_paper_cite10 on citationcount10 (PaperId ASC
 
 ## Now repeat the same for 5 years.
 
-tablequery="""CREATE TEMPORARY TABLE citationtemp AS
+tablequery=f"""CREATE TEMPORARY TABLE citationtemp AS
     SELECT a.PaperReferenceId AS PaperId,
            SUM(a.CitationCount) AS CitationCount_y5,
         b.Year as YearPub
@@ -79,15 +125,17 @@ tablequery="""CREATE TEMPORARY TABLE citationtemp AS
         WHERE ReferencingDocType IS NOT NULL 
         AND ReferencingDocType IN ("Journal", "Book", "BookChapter", "Conference", "Thesis")
         AND  a.Year-b.Year <= 5
+        {restriction}
     GROUP BY a.PaperReferenceId
 """
 
-tablequery2="""CREATE TEMPORARY TABLE citationcount5 AS 
+tablequery2=f"""CREATE TEMPORARY TABLE citationcount5 AS 
     SELECT a.PaperId, 
         CASE WHEN b.CitationCount_y5 IS NULL THEN 0 ELSE b.CitationCount_y5 END
         AS CitationCount_y5
     FROM Papers a  
     LEFT JOIN citationtemp b USING(PaperId)
+    WHERE 1 {restriction.replace("b.PaperId", "a.PaperId")}
  """
 con.execute("""DROP TABLE IF EXISTS citationtemp""")
 con.execute(tablequery)
@@ -100,15 +148,25 @@ con.execute("CREATE UNIQUE INDEX id_paper_cite5 on citationcount5 (PaperId ASC)"
 
 
 # ## Final table 
-con.execute("DROP TABLE IF EXISTS paper_outcomes")
-con.execute("""CREATE TABLE paper_outcomes AS 
-            SELECT a.PaperId, a.CitationCount_y10, b.CitationCount_y5, c.AuthorCount
+query_outcomes = """SELECT a.PaperId, a.CitationCount_y10, b.CitationCount_y5, c.AuthorCount
             FROM citationcount10 a
             INNER JOIN citationcount5 b USING (PaperId)
             INNER JOIN paper_teamsize c USING (PaperId)
-""")
-
-con.execute("CREATE UNIQUE INDEX idx_po_PaperId on paper_outcomes (PaperId ASC)")
+"""
+if incremental:
+    con.execute("BEGIN")
+    con.execute("DELETE FROM paper_outcomes WHERE PaperId IN (SELECT PaperId FROM affected_outcomes)")
+    con.execute(f"INSERT INTO paper_outcomes {query_outcomes}")
+    con.execute("DELETE FROM citations_changed")
+    con.execute("COMMIT")
+else:
+    con.execute("DROP TABLE IF EXISTS paper_outcomes")
+    con.execute(f"CREATE TABLE paper_outcomes AS {query_outcomes}")
+    con.execute("CREATE UNIQUE INDEX idx_po_PaperId on paper_outcomes (PaperId ASC)")
+    # ## from now on, changes can be tracked 
+    if args.incremental:
+        con.execute("CREATE TABLE IF NOT EXISTS citations_changed (PaperId INTEGER PRIMARY KEY)")
+        con.execute("DELETE FROM citations_changed")
 
 
 # ## Run ANALYZE, finish
@@ -16,11 +16,17 @@ Generate tables:
 import sqlite3 as sqlite
 import warnings
 import time 
+import argparse
 from helpers.functions import analyze_db
 from helpers.variables import db_file, insert_questionmark_doctypes, keep_doctypes
+from helpers.partitions import partition_filter, key_ranges, create_table_partitioned
 
 
 # ## Arguments
+parser = argparse.ArgumentParser()
+parser.add_argument("--partitions", type = int, default = 1,
+                    help="Run the query in this many partitions of AuthorId in parallel.")
+args = parser.parse_args()
 
 # ## Variables; connect to db
 start_time = time.time()
@@ -31,8 +37,8 @@ con = sqlite.connect(database = db_file, isolation_level= None)
 print("Making AuthorAffiliation table ...\n")
 
 con.execute("DROP TABLE IF EXISTS AuthorAffiliation")
-con.execute(f"""CREATE TABLE AuthorAffiliation AS 
-            SELECT AuthorId, AffiliationId, Year
+create_table_partitioned(con, db_file, "AuthorAffiliation", 
+            f"""SELECT AuthorId, AffiliationId, Year
             FROM (
                 -- ## window function to calculate MaxPaperCount per author-year
                 SELECT *,
@@ -54,12 +60,14 @@ con.execute(f"""CREATE TABLE AuthorAffiliation AS
                         WHERE DocType IN ({insert_questionmark_doctypes})
                     ) c USING (PaperId)
                     WHERE AffiliationId != ""  -- ## These are missing affiliations
+                        AND {partition_filter}
                     GROUP BY a.AuthorId, a.AffiliationId, c.Year 
                 ) 
             )   
             WHERE PaperCount = MaxPaperCount        
             """,
-            (keep_doctypes)
+            (keep_doctypes),
+            key="a.AuthorId", ranges=key_ranges(con, "author_sample", "AuthorId", args.partitions)
             )
 con.execute("CREATE UNIQUE INDEX idx_aa_AuthorAffilYear ON AuthorAffiliation (AuthorId ASC, AffiliationId ASC, Year)")
 con.execute("CREATE INDEX idx_aa_Affil ON AuthorAffiliation (AffiliationId ASC) ")
@@ -19,8 +19,9 @@ import sqlite3 as sqlite
 import warnings
 import time 
 import argparse
-from helpers.functions import print_elapsed_time, analyze_db
+from helpers.functions import print_elapsed_time, analyze_db, write_build_marker
 from helpers.variables import db_file, insert_questionmark_doctypes, keep_doctypes
+from helpers.partitions import partition_filter, key_ranges, create_table_partitioned
 
 
 # ## Arguments
@@ -29,6 +30,8 @@ parser.add_argument("--years_first_field", type = int, default = 5,
                     help="How many years to consider when calculating the first field of the author?")
 parser.add_argument("--years_last_field", type = int, default = 5,
                     help="How many years to consider when calculating the last field of the author?")
+parser.add_argument("--partitions", type = int, default = 1,
+                    help="Run the queries in this many partitions of PaperId or AuthorId in parallel.")
 args = parser.parse_args()
 
 # ## Variables; connect to db
@@ -37,6 +40,9 @@ print(f"Start time: {start_time} \n")
 
 con = sqlite.connect(database = db_file, isolation_level= None)
 
+paper_ranges = key_ranges(con, "Papers", "PaperId", args.partitions)
+author_ranges = key_ranges(con, "Authors", "AuthorId", args.partitions)
+
 
 # ## PaperAuthorUnique 
 #   This is necessary because some authors publish papers with multiple affiliations 
@@ -45,14 +51,16 @@ con = sqlite.connect(database = db_file, isolation_level= None)
 
 print("Making PaperAuthorUnique table ...\n")
 con.execute("DROP TABLE IF EXISTS PaperAuthorUnique")
-con.execute("""CREATE TABLE PaperAuthorUnique AS 
-            SELECT DISTINCT PaperId, AuthorId 
+create_table_partitioned(con, db_file, "PaperAuthorUnique", 
+            f"""SELECT DISTINCT PaperId, AuthorId 
             FROM PaperAuthorAffiliations 
             INNER JOIN (
                 SELECT PaperId 
                 FROM PaperMainFieldsOfStudy 
             ) USING (PaperId)
-            """)
+            WHERE {partition_filter}
+            """,
+            key="PaperId", ranges=paper_ranges)
 con.execute("CREATE UNIQUE INDEX idx_pau_PaperAuthorId ON PaperAuthorUnique (PaperId ASC, AuthorId ASC)")
 con.execute("CREATE INDEX idx_pau_AuthorId ON PaperAuthorUnique (AuthorId)")
 con.execute("CREATE INDEX idx_pau_PaperId ON PaperAuthorUnique (PaperId)")
@@ -63,9 +71,8 @@ print_elapsed_time(start_time)
 print(f"Author sample with career restrictions, keeping DocTypes {keep_doctypes}... \n")
 
 con.execute("DROP TABLE IF EXISTS author_sample")
-con.execute(f"""CREATE TABLE 
-                    author_sample AS 
-                SELECT * 
+create_table_partitioned(con, db_file, "author_sample", 
+                f"""SELECT * 
                 FROM (
                     SELECT   
                         a.AuthorId, 
@@ -80,6 +87,7 @@ con.execute(f"""CREATE TABLE
                     ) b ON a.PaperId = b.PaperId 
                     WHERE 
                         b.DocType IN ({insert_questionmark_doctypes})
+                        AND {partition_filter}
                     GROUP BY a.AuthorId 
                     HAVING  
                         PaperCount >= 2 
@@ -91,11 +99,13 @@ con.execute(f"""CREATE TABLE
                             SUBSTR(TRIM(NormalizedName),1,instr(trim(NormalizedName)||' ',' ')-1) AS FirstName
                     FROM Authors 
                 ) d USING (AuthorId)
-                """, (keep_doctypes)
+                """, (keep_doctypes),
+                key="a.AuthorId", ranges=author_ranges
                 )
 
 con.execute("CREATE UNIQUE INDEX idx_as_AuthorId ON author_sample (AuthorId ASC) ")
 con.execute("CREATE INDEX idx_as_FirstName ON author_sample (FirstName ASC)")
+write_build_marker(con, "author_sample")
 
 # ## author_fields 
     # for now, follow Huang et al: assign the most common field to each author.
@@ -120,8 +130,8 @@ print(f"\t N years for last field: {args.years_last_field}")
         # assign to papers with missing field of study id a very small score. Dropping them would drop authors from the table
             # that only publish papers with missing field of study id.
 con.execute("DROP TABLE IF EXISTS temp1")
-con.execute(f""" CREATE TEMPORARY TABLE temp1 AS 
-            SELECT * 
+create_table_partitioned(con, db_file, "temp1", 
+            f"""SELECT * 
             FROM (
                 -- ## First fields: field at level 1 in first years of career 
                 SELECT  a.AuthorId, 
@@ -149,6 +159,7 @@ con.execute(f""" CREATE TEMPORARY TABLE temp1 AS
                     INNER JOIN PaperFieldsOfStudy f ON (e.PaperId = f.PaperId AND e.OriginalFieldId = f.FieldOfStudyId)
                 ) d USING (PaperId) 
                 WHERE c.Year <= b.YearFirstPub + (?) -- ## Variable input here, see bottom of the query
+                    AND {partition_filter}
                 GROUP BY a.AuthorId, d.FieldOfStudyId 
                 UNION 
                 -- ## Last fields: field at level 1 in last years of career 
@@ -177,6 +188,7 @@ con.execute(f""" CREATE TEMPORARY TABLE temp1 AS
                     INNER JOIN PaperFieldsOfStudy f ON (e.PaperId = f.PaperId AND e.OriginalFieldId = f.FieldOfStudyId)
                 ) d USING (PaperId) 
                 WHERE c.Year >= b.YearLastPub - (?) -- ## Variable input here, see bottom of the query
+                    AND {partition_filter}
                 GROUP BY a.AuthorId, d.FieldOfStudyId
                 UNION
                 -- ## Main fields: fields at level 0 ever published by the author 
@@ -204,10 +216,12 @@ con.execute(f""" CREATE TEMPORARY TABLE temp1 AS
                     FROM PaperMainFieldsOfStudy e 
                     INNER JOIN PaperFieldsOfStudy f ON (e.PaperId = f.PaperId AND e.OriginalFieldId = f.FieldOfStudyId)
                 ) d USING (PaperId) 
+                WHERE {partition_filter}
                 GROUP BY a.AuthorId, d.FieldOfStudyId 
             ) 
             """,
-            (keep_doctypes + (args.years_first_field,) + keep_doctypes + (args.years_last_field,) + keep_doctypes)
+            (keep_doctypes + (args.years_first_field,) + keep_doctypes + (args.years_last_field,) + keep_doctypes),
+            key="a.AuthorId", ranges=author_ranges, temporary=True
             )
 
 # ### Add share score by AuthorId-FieldClass
@@ -256,6 +270,7 @@ con.execute("""CREATE TABLE author_fields AS
             """)
 
 con.execute("CREATE UNIQUE INDEX idx_af_AuthorField ON author_fields (AuthorId ASC, FieldClass, FieldOfStudyId)")
+write_build_marker(con, "author_fields")
 
 # ## Run ANALYZE, finish
 analyze_db(con)
@@ -7,68 +7,37 @@ Script prep_citations.py
 Generate tables
 - paper_citations: citation history for each paper, by ReferencingDocType x Year
 
+With --incremental, only the citation history of papers whose citations may have 
+changed since the last incremental build is computed again; see helpers/citations_state.py.
+The first incremental build is a full build.
 """
 
 
 import sqlite3 as sqlite
 import time 
+import argparse
 
-from helpers.variables import db_file, keep_doctypes_citations, insert_questionmark_doctypes_citations
+from helpers.variables import db_file
+from helpers.citations_state import build_paper_citations
 
 # ## Arguments
-
+parser = argparse.ArgumentParser()
+parser.add_argument("--incremental", action=argparse.BooleanOptionalAction,
+                    help="Only update the citation history of papers affected by changes since the last build.")
+parser.add_argument("--n_jobs", type=int, default=4,
+                    help="Number of processes for the checksums of the inputs with --incremental.")
+parser.set_defaults(incremental=False)
+args = parser.parse_args()
 
 # ## Variables; connect to db
 start_time = time.time()
 print(f"Start time: {start_time} \n")
 
-start_year = 1950 
 con = sqlite.connect(database = db_file, isolation_level= None)
 
 
 # ## Citation history per paper 
-print('Citations per Paper-Year... \n')
-con.execute('DROP TABLE IF EXISTS paper_citations')
-con.execute(f"""CREATE TABLE paper_citations AS
-            SELECT  a.PaperReferenceId, 
-                    b.Year, 
-                    b.DocType AS ReferencingDocType, 
-                    COUNT(DISTINCT a.PaperId) AS CitationCount 
-            FROM PaperReferences a 
-            -- ## Restrictions on referencing papers
-            INNER JOIN (
-              SELECT PaperId, Year, DocType 
-              FROM Papers 
-              INNER JOIN (
-                  SELECT PaperId 
-                  FROM PaperMainFieldsOfStudy
-              ) USING (PaperId)
-              WHERE 
-                DocType IN ({insert_questionmark_doctypes_citations}) 
-                AND 
-                DocType IS NOT NULL 
-            ) b on a.PaperId = b.PaperId 
-            -- ## Restrictions on PaperReferenceId 
-            INNER JOIN (
-              SELECT PaperId, Year, DocType 
-              FROM Papers 
-              INNER JOIN ( -- ## this keeps only the citation history of papers in PaperMainFieldsOfStudy
-                  SELECT PaperId 
-                  FROM PaperMainFieldsOfStudy
-              ) USING (PaperId) 
-              WHERE 
-                DocType IN ({insert_questionmark_doctypes_citations}) 
-                AND 
-                DocType IS NOT NULL 
-                AND 
-                Year >= (?)
-            ) c on a.PaperReferenceId = c.PaperId 
-            GROUP BY a.PaperReferenceId, b.Year, ReferencingDocType
-          """,
-          (keep_doctypes_citations + keep_doctypes_citations + (start_year,))
-          )
-
-con.execute('CREATE INDEX idx_pc_PaperReferenceIdYear on paper_citations (PaperReferenceId ASC, Year)')
+build_paper_citations(con, db_file, incremental=args.incremental, n_jobs=args.n_jobs)
 
 
 # ## Run ANALYZE, finish
@@ -6,6 +6,10 @@ Script prep_collab.py
     Use multiprocessing to extract unique 
     author-coauthor-year combinations and save 
     as csv files
+
+    With --to_db, the authors are split into ranges of AuthorId (see collab_shards.py),
+    and the combinations are written directly into author_collab, including the indexes.
+    read_collab.py is then not needed. Papers without Year are dropped then.
 """
 
 import multiprocessing as mp
@@ -20,6 +24,7 @@ import sys
 
 from helpers.functions import print_elapsed_time, analyze_db
 from helpers.variables import db_file, keep_doctypes, insert_questionmark_doctypes
+from main.prep_mag.collab_shards import author_ranges, create_collab_table_partitioned, create_collab_indexes
 
 def get_coauthors(write_dir, chunk_id, authors):
     """
@@ -82,10 +87,14 @@ parser.add_argument("--ncores",
 parser.add_argument("--write_dir", 
                     dest = "write_dir", 
                     default = "collab_temp/")
+parser.add_argument("--to_db",
+                    action = argparse.BooleanOptionalAction,
+                    help = "Write into author_collab instead of csv files in write_dir.")
+parser.set_defaults(to_db = False)
 
 args = parser.parse_args()
 
-if os.path.isdir(args.write_dir):
+if not args.to_db and os.path.isdir(args.write_dir):
     sys.exit("You specified an existing directory.")
 
 if args.n_cores > mp.cpu_count():
@@ -96,7 +105,8 @@ if args.n_cores > mp.cpu_count():
 # ## Setup
 start_time = time.time()
 print(f"Start time: {start_time} \n")
-os.mkdir(args.write_dir)
+if not args.to_db:
+    os.mkdir(args.write_dir)
 
 con = sqlite.connect(database = "file:" + db_file + "?mode=ro", 
                      isolation_level = None, uri = True) # read-only connection 
@@ -107,26 +117,40 @@ if args.n_authors == "all":
 else:
     args.n_authors = int(args.n_authors)
 
-query = "SELECT DISTINCT AuthorId from author_sample LIMIT ?" 
-authors = pd.read_sql(sql = query, con = con, params = (args.n_authors,))
-
-# n_authors = authors.shape[0] 
-n_groups = math.ceil(args.n_authors / args.chunk_size)
-list_in = ([(args.write_dir, 
-             i, 
-             (authors.AuthorId
-                .iloc[range(i * args.chunk_size, 
-                            min(i * args.chunk_size + args.chunk_size,
-                                args.n_authors))
-                     ]
-                .tolist())
-            ) 
-             for i in range(n_groups)]
-          )
+if args.to_db:
+    ranges = author_ranges(con, args.n_authors, args.chunk_size)
+else:
+    query = "SELECT DISTINCT AuthorId from author_sample LIMIT ?" 
+    authors = pd.read_sql(sql = query, con = con, params = (args.n_authors,))
+
+    # n_authors = authors.shape[0] 
+    n_groups = math.ceil(args.n_authors / args.chunk_size)
+    list_in = ([(args.write_dir, 
+                i, 
+                (authors.AuthorId
+                    .iloc[range(i * args.chunk_size, 
+                                min(i * args.chunk_size + args.chunk_size,
+                                    args.n_authors))
+                        ]
+                    .tolist())
+                ) 
+                for i in range(n_groups)]
+            )
 
 # ## Map 
 print("Running queries...", flush = True)
-if __name__ == "__main__":
+if __name__ == "__main__" and args.to_db:
+    con_write = sqlite.connect(database = db_file, isolation_level = None)
+    # the ranges are merged in order, so author_collab is written sorted by (AuthorId, CoAuthorId, Year)
+    create_collab_table_partitioned(con_write, db_file, ranges, n_jobs = args.n_cores)
+    n_rows = con_write.execute("SELECT MAX(rowid) FROM author_collab").fetchone()[0] or 0
+    print(f"--queries finished. Wrote {n_rows} rows.", flush = True)
+
+    print("Creating indexes", flush = True)
+    create_collab_indexes(con_write)
+    analyze_db(con_write)
+    con_write.close()
+elif __name__ == "__main__":
     with Pool(processes = args.n_cores) as pool:
         results = pool.starmap(get_coauthors, list_in)
     print("--queries finished.")
@@ -7,6 +7,11 @@ Script prep_quantiles_papercites.py
     quantiles of citation distributions by field-Year
     and save as csv files.
     Field is at level 0 or 1 in MAG.
+
+    With --mode stream or --mode histogram, the quantiles of all field-years are
+    calculated in one pass over the data (see quantiles_papercites.py) and
+    written directly into quantiles_papercites, replacing the fields of --level.
+    read_quantiles_papercites.py is then not needed.
 """
 
 import multiprocessing as mp
@@ -21,9 +26,12 @@ import sys
 import numpy as np
 import logging 
 import itertools 
-from helpers.functions import enumerated_arguments
+from helpers.functions import enumerated_arguments, insert_batched, analyze_db
 
 from helpers.variables import db_file, keep_doctypes_citations, insert_questionmark_doctypes_citations
+from main.prep_mag.quantiles_papercites import (
+    stream_quantiles, histogram_quantiles, create_quantiles_table, create_quantiles_indexes
+)
 
 logging.basicConfig(level=logging.INFO)
 
@@ -121,10 +129,20 @@ parser.add_argument("--end_year",
                     dest="end_year",
                     type=int,
                     default=2020)
+parser.add_argument("--mode",
+                    type=str,
+                    default="per_group",
+                    choices=["per_group", "stream", "histogram"],
+                    help="per_group: one query per field-year, saved as csv files in write_dir. "
+                         "stream, histogram: one query for all field-years, written into the database.")
+parser.add_argument("--batch_size",
+                    type=int,
+                    default=1_000_000,
+                    help="Number of rows to fetch at once in modes stream and histogram.")
 
 args = parser.parse_args()
 
-if os.path.isdir(args.write_dir):
+if args.mode == "per_group" and os.path.isdir(args.write_dir):
     sys.exit("You specified an existing directory.")
 
 if args.n_cores > mp.cpu_count():
@@ -135,7 +153,8 @@ if args.n_cores > mp.cpu_count():
 # ## Setup
 start_time = time.time()
 print(f"Start time: {start_time} \n")
-os.mkdir(args.write_dir)
+if args.mode == "per_group":
+    os.mkdir(args.write_dir)
 
 con = sqlite.connect(database = "file:" + db_file + "?mode=ro", 
                      isolation_level = None, uri = True) # read-only connection 
@@ -158,7 +177,22 @@ inputs = itertools.product(
 # ## Map 
 enumerated_inputs = enumerated_arguments(inputs)
 print("Running queries...", flush=True)
-if __name__ == "__main__":
+if __name__ == "__main__" and args.mode != "per_group":
+    calculate = stream_quantiles if args.mode == "stream" else histogram_quantiles
+    quantile_rows = calculate(con, args.level, args.n_fields, args.start_year, args.end_year,
+                              quantiles=list(np.arange(0, 1, 0.01)), batch_size=args.batch_size)
+    print(f"--queries finished. Writing {len(quantile_rows)} rows.", flush=True)
+
+    con_write = sqlite.connect(database = db_file, isolation_level = None)
+    create_quantiles_table(con_write, drop=False)
+    con_write.execute("""DELETE FROM quantiles_papercites 
+                      WHERE FieldOfStudyId IN (SELECT FieldOfStudyId FROM FieldsOfStudy WHERE Level = ?)""",
+                      (args.level, ))
+    insert_batched(con_write, "INSERT INTO quantiles_papercites VALUES (?, ?, ?, ?, ?)", quantile_rows)
+    create_quantiles_indexes(con_write)
+    analyze_db(con_write)
+    con_write.close()
+elif __name__ == "__main__":
     with Pool(processes = args.n_cores) as pool:
         results = pool.starmap(calculate_quantiles, enumerated_inputs)
     print("--queries finished.")
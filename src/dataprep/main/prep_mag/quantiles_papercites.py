@@ -0,0 +1,119 @@
+"""
+Quantiles of citation distributions by field-Year in one pass over the data
+
+Used by prep_quantiles_papercites.py with --mode stream or --mode histogram.
+Both give the same quantiles as `calculate_quantiles` in prep_quantiles_papercites.py,
+but read the papers of all field-years with one query instead of one query per field-year:
+- stream: read the papers sorted by field and year, and calculate the quantiles
+  of each field-year with numpy when all its papers are read.
+  Holds the citations of one field-year in memory.
+- histogram: let sqlite count the papers by field, year and number of citations,
+  and calculate the quantiles from the counts. Citations are integers, so the
+  counts are an exact and small summary of the distribution of a field-year;
+  this needs neither the sort nor the citations of a field-year in memory.
+Papers with missing CitationCount_y10 are ignored.
+"""
+
+import numpy as np
+
+from helpers.functions import quantiles_from_histogram
+from helpers.variables import keep_doctypes_citations, insert_questionmark_doctypes_citations
+
+
+variable = "CitationCount_y10"
+
+
+def query_papercites(level, aggregate=False):
+    """Query for the citations of papers by field of `level` and year.
+    Parameters: DocTypes, level, number of fields, first year, last year + 1.
+    Rows are sorted by field and year, as `groups` needs; if `aggregate`, the query
+    returns the number of papers by field, year and citations, sorted by citations
+    within a field-year, as `quantiles_from_histogram` needs.
+    """
+    field_column = f"Field{level}"
+    select = f"c.{field_column}, a.Year, b.{variable}"
+    return f"""
+        SELECT {select} {", COUNT(*)" if aggregate else ""}
+        FROM Papers AS a
+        INNER JOIN
+        paper_outcomes AS b
+        USING(PaperId)
+        INNER JOIN
+        PaperMainFieldsOfStudy AS c
+        USING(PaperId)
+        WHERE a.DocType IN ({insert_questionmark_doctypes_citations})
+        AND c.{field_column} IN (
+            SELECT DISTINCT FieldOfStudyId FROM FieldsOfStudy WHERE Level = ? LIMIT ?
+        )
+        AND a.Year >= ? AND a.Year < ?
+        AND b.{variable} IS NOT NULL
+        {f"GROUP BY {select}" if aggregate else ""}
+        ORDER BY {select if aggregate else f"c.{field_column}, a.Year"}
+    """
+
+
+def groups(cur, batch_size):
+    "Yield (key, rows) from `cur`, where the rows are sorted by key = the first two columns."
+    current_key, current_rows = None, []
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+        for row in rows:
+            key = row[:2]
+            if key != current_key:
+                if current_key is not None:
+                    yield current_key, current_rows
+                current_key, current_rows = key, []
+            current_rows.append(row[2:])
+    if current_key is not None:
+        yield current_key, current_rows
+
+
+def quantile_rows(field, year, quantiles, values):
+    return [(year, field, q, v, variable) for q, v in zip(quantiles, values.tolist())]
+
+
+def stream_quantiles(con, level, n_fields, start_year, end_year, quantiles, batch_size=1_000_000):
+    """Quantiles of all field-years, as list of rows (Year, FieldOfStudyId, Quantile, Value, Variable)
+    for the table quantiles_papercites.
+    """
+    cur = con.execute(query_papercites(level),
+                      list(keep_doctypes_citations) + [level, n_fields, start_year, end_year])
+    out = []
+    for (field, year), rows in groups(cur, batch_size):
+        citations = np.array(rows, dtype=np.float64)[:, 0]
+        out += quantile_rows(field, year, quantiles, np.quantile(citations, quantiles))
+    return out
+
+
+def histogram_quantiles(con, level, n_fields, start_year, end_year, quantiles, batch_size=1_000_000):
+    "Same as `stream_quantiles`, calculated from the number of papers by citations."
+    cur = con.execute(query_papercites(level, aggregate=True),
+                      list(keep_doctypes_citations) + [level, n_fields, start_year, end_year])
+    out = []
+    for (field, year), rows in groups(cur, batch_size):
+        rows = np.array(rows, dtype=np.float64)
+        out += quantile_rows(field, year, quantiles, quantiles_from_histogram(rows[:, 0], rows[:, 1], quantiles))
+    return out
+
+
+def create_quantiles_table(con, drop=True):
+    if drop:
+        con.execute("DROP TABLE If EXISTS quantiles_papercites")
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS quantiles_papercites (
+            Year INTEGER
+            , FieldOfStudyId INTEGER
+            , Quantile REAL
+            , Value REAL
+            , Variable TEXT
+        )
+        """
+    )
+
+
+def create_quantiles_indexes(con):
+    con.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_qpc_FieldYear ON quantiles_papercites (FieldOfStudyId ASC, Year, Quantile)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_qp_Year ON quantiles_papercites (Year)")
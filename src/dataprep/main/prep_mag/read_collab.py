@@ -21,6 +21,7 @@ import shutil
 
 from helpers.functions import print_elapsed_time, analyze_db
 from helpers.variables import db_file 
+from main.prep_mag.collab_shards import create_collab_table, create_collab_indexes
 
 parser = argparse.ArgumentParser(description = 'Inputs for author_collab')
 parser.add_argument("--read_dir", dest="read_dir", default = "collab_temp/")
@@ -41,8 +42,7 @@ print("Combining files into one", flush = True)
 subprocess.run(f"tail -n +2 -q {read_dir}/part-*.csv >> {filename_full}", shell = True)
 
 print("Dropping existing table and creating new empty one", flush = True)
-con.execute("DROP TABLE If EXISTS author_collab")
-con.execute("CREATE TABLE author_collab (AuthorId INTEGER, CoAuthorId INTEGER, Year INTEGER)")
+create_collab_table(con)
 
 
 print("Reading into sqlite", flush = True)
@@ -56,9 +56,7 @@ os.remove(filename_full)
 shutil.rmtree(read_dir)
 
 print("Creating indexes", flush = True)
-con.execute("CREATE UNIQUE INDEX idx_acllb_AuthorCoAuthorYear ON author_collab (AuthorId ASC, CoAuthorId ASC, Year)")
-con.execute("CREATE INDEX idx_acllb_CoAuthorIdYear ON author_collab (CoAuthorId ASC, Year)")
-con.execute("CREATE INDEX idx_acllb_AuthorIdYear ON author_collab (AuthorId ASC, Year)")
+create_collab_indexes(con)
 
 
 # ## Run ANALYZE, finish
@@ -21,6 +21,7 @@ import shutil
 
 from helpers.functions import print_elapsed_time, analyze_db
 from helpers.variables import db_file 
+from main.prep_mag.quantiles_papercites import create_quantiles_table, create_quantiles_indexes
 
 parser = argparse.ArgumentParser()
 parser.add_argument(dest="read_dirs", nargs="+", help="from which directories to read files")
@@ -37,18 +38,7 @@ for dir in args.read_dirs:
     subprocess.run(f"tail -n +2 -q {dir}/part-*.csv >> {filename_full}", shell=True)
 
 print("Dropping existing table and creating new empty one", flush = True)
-con.execute("DROP TABLE If EXISTS quantiles_papercites")
-con.execute(
-    """ 
-    CREATE TABLE quantiles_papercites (
-        Year INTEGER
-        , FieldOfStudyId INTEGER
-        , Quantile REAL
-        , Value REAL
-        , Variable TEXT
-    )
-    """
-)
+create_quantiles_table(con)
 
 print("Reading into sqlite", flush=True)
 subprocess.run(
@@ -63,8 +53,7 @@ for dir in args.read_dirs:
 
 print("Creating indexes", flush=True)
 with con as c:
-    c.execute("CREATE UNIQUE INDEX idx_qpc_FieldYear ON quantiles_papercites (FieldOfStudyId ASC, Year, Quantile)")
-    c.execute("CREATE INDEX idx_qp_Year ON quantiles_papercites (Year)")
+    create_quantiles_indexes(c)
 
 
 # ## Run ANALYZE, finish
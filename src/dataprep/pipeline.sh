@@ -58,9 +58,9 @@ python3 $script_path/prep_mag/prep_authors.py --years_first_field 5 \
 
 python -m $script_path.prep_mag.authors_fields_detailed &> $logfile_path/authors_fields_detailed.log
 
-python3 -m $script_path.prep_mag.prep_collab --nauthors "all" --chunksize 10000 --ncores 10 \
+python3 -m $script_path.prep_mag.prep_collab --nauthors "all" --chunksize 10000 --ncores 10 --to_db \
     &> $logfile_path/prep_collab.log
-python3 -m $script_path.prep_mag.read_collab &> $logfile_path/read_collab.log
+python3 -m $script_path.prep_mag.collab_graph &> $logfile_path/collab_graph.log
 
 python3 $script_path/prep_mag/prep_affiliations.py &> $logfile_path/prep_affiliations.log
 
@@ -68,22 +68,16 @@ python3 $script_path/prep_mag/prep_citations.py &> $logfile_path/prep_citations.
 
 python3 -m $script_path.prep_mag.prep_quantiles_papercites \
     --nfields "all" \
-    --ncores 10 \
-    --write_dir "quantiles_lvl0_temp" \
+    --mode histogram \
     --level 0 \
     &> $logfile_path/prep_quantiles_papercites_lvl0.log
 
 python3 -m $script_path.prep_mag.prep_quantiles_papercites \
     --nfields "all" \
-    --ncores 10 \
-    --write_dir "quantiles_lvl1_temp" \
+    --mode histogram \
     --level 1 \
     &> $logfile_path/prep_quantiles_papercites_lvl1.log
 
-python3 -m $script_path.prep_mag.read_quantiles_papercites \
-    quantiles_lvl1_temp quantiles_lvl0_temp \
-    &> $logfile_path/read_quantiles_papercites.log
-
 python3 $script_path/prep_mag/paper_outcomes.py &> $logfile_path/paper_outcomes.log
 
 # TODO: add here venue_citations
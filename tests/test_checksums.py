@@ -0,0 +1,80 @@
+from src.dataprep.helpers.checksums import scan_tables, table_checksums, db_checksums, compare
+from src.dataprep.helpers.functions import write_build_marker
+
+import os
+import sqlite3 as sqlite
+
+
+def load(con, tbl, rows):
+    con.execute(f"DROP TABLE IF EXISTS {tbl}")
+    con.execute(f"CREATE TABLE {tbl} (Id INTEGER, Name TEXT, Score REAL)")
+    con.executemany(f"INSERT INTO {tbl} VALUES (?, ?, ?)", rows)
+    write_build_marker(con, tbl)
+
+
+def write_raw(path, rows):
+    with open(path, "w") as f:
+        f.writelines(f"{i}\t{name}\t{score}\r\n" for i, name, score in rows)
+
+
+def test_scan_tables(tmp_path):
+    db_file = str(tmp_path / "db.sqlite")
+    con = sqlite.connect(db_file, isolation_level=None)
+    rows = [(i, f"name {i}", i / 2) for i in range(0, 500, 7)]
+    files = {"Papers": str(tmp_path / "Papers.txt"), "Empty": str(tmp_path / "Empty.txt")}
+    write_raw(files["Papers"], rows)
+    write_raw(files["Empty"], [])
+    load(con, "Papers", rows)
+    load(con, "Empty", [])
+
+    def scan(rescan=False):
+        results, scanned = scan_tables(con, db_file, files, range_size=100, rescan=rescan)
+        return results, sorted(scanned)
+
+    all_sources = sorted((tbl, source) for tbl in files for source in ["file", "db"])
+    results, scanned = scan()
+    assert scanned == all_sources
+    assert compare(results["Papers"]["file"], results["Papers"]["db"]) == []
+    assert sum(n for n, _ in results["Papers"]["db"].values()) == len(rows)
+    assert results["Empty"] == {"file": {}, "db": {}}
+
+    # nothing changed, also not the empty file and table
+    cached, scanned = scan()
+    assert scanned == []
+    assert cached == results
+
+    # same number of rows, different content
+    changed = rows[:-1] + [(rows[-1][0], "other", 1.0)]
+    write_raw(files["Papers"], changed)
+    os.utime(files["Papers"], ns=(0, 0))
+    load(con, "Papers", changed)
+    results, scanned = scan()
+    assert scanned == [("Papers", "db"), ("Papers", "file")]
+    assert compare(results["Papers"]["file"], results["Papers"]["db"]) == []
+    assert results["Papers"]["db"] != cached["Papers"]["db"]
+
+    # a difference in the file only shows up in its range
+    write_raw(files["Papers"], rows[:-1] + [(rows[-1][0], "another", 1.0)])
+    results, scanned = scan()
+    assert scanned == [("Papers", "file")]
+    assert compare(results["Papers"]["file"], results["Papers"]["db"]) == [rows[-1][0] // 100]
+
+    results, scanned = scan(rescan=True)
+    assert scanned == all_sources
+
+
+def test_table_checksums_by_rowid_range(tmp_path):
+    db_file = str(tmp_path / "db.sqlite")
+    con = sqlite.connect(db_file, isolation_level=None)
+    rows = [(i, f"name {i}", i / 2) for i in range(0, 1000, 3)]
+    load(con, "Papers", rows)
+    load(con, "Empty", [])
+    con.execute("DELETE FROM Papers WHERE Id < 30") # rowids do not start at 1
+
+    values = table_checksums(con, db_file, ["Papers", "Empty"], range_size=100, n_jobs=3)
+    assert values == {"Papers": db_checksums(db_file, "Papers", 100), "Empty": {}}
+    # stored until the table gets a new build marker
+    con.execute("DELETE FROM Papers WHERE Id = 501")
+    assert table_checksums(con, db_file, ["Papers"], range_size=100)["Papers"] == values["Papers"]
+    write_build_marker(con, "Papers")
+    assert table_checksums(con, db_file, ["Papers"], range_size=100)["Papers"] == db_checksums(db_file, "Papers", 100)
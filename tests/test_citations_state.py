@@ -0,0 +1,76 @@
+from src.dataprep.helpers.citations_state import build_paper_citations, query_paper_citations, query_params
+from src.dataprep.helpers.functions import write_build_marker
+
+import sqlite3 as sqlite
+
+import numpy as np
+
+
+range_size = 50
+schemas = {
+    "Papers": "PaperId INTEGER, Year INTEGER, DocType TEXT",
+    "PaperReferences": "PaperId INTEGER, PaperReferenceId INTEGER",
+    "PaperMainFieldsOfStudy": "PaperId INTEGER, Field0 INTEGER"
+}
+
+
+def load(con, db_file, tbl, rows):
+    "Create `tbl` as the loader does, with a build marker."
+    con.execute(f"DROP TABLE IF EXISTS {tbl}")
+    con.execute(f"CREATE TABLE {tbl} ({schemas[tbl]})")
+    con.executemany(f"INSERT INTO {tbl} VALUES ({', '.join(['?'] * len(rows[0]))})", rows)
+    write_build_marker(con, tbl)
+
+
+def make_inputs(rng):
+    papers = [(p, int(rng.integers(1940, 2020)), str(rng.choice(["Journal", "Conference", "Patent", "Thesis"])))
+              for p in range(300)]
+    refs = sorted({(int(p), int(r)) for p, r in rng.integers(0, 300, (1500, 2)) if p != r})
+    fields = [(p, p % 5) for p in range(300) if p % 11 != 0]
+    return {"Papers": papers, "PaperReferences": refs, "PaperMainFieldsOfStudy": fields}
+
+
+def full_build(con):
+    query = f"SELECT * FROM ({query_paper_citations()}) ORDER BY 1, 2, 3"
+    return con.execute(query, query_params).fetchall()
+
+
+def stored(con):
+    return con.execute("SELECT * FROM paper_citations ORDER BY 1, 2, 3").fetchall()
+
+
+def test_incremental_same_as_full_build(tmp_path):
+    db_file = str(tmp_path / "db.sqlite")
+    con = sqlite.connect(db_file, isolation_level=None)
+    rng = np.random.default_rng(0)
+    inputs = make_inputs(rng)
+    for tbl, rows in inputs.items():
+        load(con, db_file, tbl, rows)
+
+    # the first incremental build is a full build
+    assert build_paper_citations(con, db_file, incremental=True, range_size=range_size) is None
+    assert stored(con) == full_build(con)
+    # nothing changed
+    assert build_paper_citations(con, db_file, incremental=True, range_size=range_size) == 0
+
+    # changes in a few ranges of PaperId
+    refs = [r for r in inputs["PaperReferences"] if not (r[0] == 17 or r[1] == 230)] + [(120, 5), (121, 5)]
+    other_doctype = {"Journal": "Patent", "Conference": "Patent", "Patent": "Journal", "Thesis": "Patent"}
+    papers = [(p, 1890 if p == 77 else y, other_doctype[d] if p == 260 else d) for p, y, d in inputs["Papers"]]
+    fields = [f for f in inputs["PaperMainFieldsOfStudy"] if f[0] != 201] + [(11, 3)]
+    load(con, db_file, "PaperReferences", refs)
+    load(con, db_file, "Papers", papers)
+    load(con, db_file, "PaperMainFieldsOfStudy", fields)
+
+    n_affected = build_paper_citations(con, db_file, incremental=True, range_size=range_size)
+    assert 0 < n_affected < 300
+    assert stored(con) == full_build(con)
+    changed = {p for (p, ) in con.execute("SELECT PaperId FROM citations_changed")}
+    assert {5, 11, 77, 201, 230, 260} <= changed
+
+    # a table updated in place with a new build marker: its checksums are computed again
+    con.execute("UPDATE Papers SET Year = 2001 WHERE PaperId = 150")
+    write_build_marker(con, "Papers")
+    assert build_paper_citations(con, db_file, incremental=True, range_size=range_size, n_jobs=2) > 0
+    assert stored(con) == full_build(con)
+    assert 150 in {p for (p, ) in con.execute("SELECT PaperId FROM citations_changed")}
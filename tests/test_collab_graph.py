@@ -0,0 +1,74 @@
+from src.dataprep.helpers.collab_graph import build_collab_graph, CollabGraph
+
+import sqlite3 as sqlite
+
+import numpy as np
+import pandas as pd
+
+
+def make_graph(tmp_path, batch_size):
+    rng = np.random.default_rng(0)
+    edges = pd.DataFrame({
+        "AuthorId": rng.choice([5, 8, 13, 21, 34], 60),
+        "CoAuthorId": rng.choice([5, 8, 13, 21, 34, 55, 89], 60),
+        "Year": rng.integers(2000, 2010, 60)
+    })
+    edges = (edges.loc[edges["AuthorId"] != edges["CoAuthorId"]]
+                .drop_duplicates()
+                .sort_values(["AuthorId", "CoAuthorId", "Year"])
+                .reset_index(drop=True))
+    con = sqlite.connect(str(tmp_path / f"db_{batch_size}.sqlite"), isolation_level=None)
+    con.execute("CREATE TABLE author_collab (AuthorId INTEGER, CoAuthorId INTEGER, Year INTEGER)")
+    con.executemany("INSERT INTO author_collab VALUES (?, ?, ?)", 
+                    edges.itertuples(index=False, name=None))
+    # rows without year are not edges
+    con.executemany("INSERT INTO author_collab VALUES (?, ?, ?)", [(5, 144, None), (144, 5, ""), (8, 13, None)])
+    n_nodes, n_edges = build_collab_graph(con, str(tmp_path / f"graph_{batch_size}"), batch_size=batch_size)
+    assert n_edges == edges.shape[0]
+    assert n_nodes == len(set(edges["AuthorId"]) | set(edges["CoAuthorId"]))
+    return CollabGraph(str(tmp_path / f"graph_{batch_size}")), edges
+
+
+def window(edges, first_year, last_year):
+    keep = np.ones(edges.shape[0], dtype=bool)
+    if first_year is not None:
+        keep &= edges["Year"] >= first_year
+    if last_year is not None:
+        keep &= edges["Year"] <= last_year
+    return edges.loc[keep]
+
+
+def test_collab_graph(tmp_path):
+    # batches of 7 rows split the edges of authors across batches
+    graph, edges = make_graph(tmp_path, batch_size=7)
+    graph_one_batch, _ = make_graph(tmp_path, batch_size=1000)
+    for name in ["nodes", "indptr", "neighbors", "years"]:
+        assert np.array_equal(getattr(graph, name), getattr(graph_one_batch, name))
+    assert (edges.groupby("AuthorId").size() > 7).any()
+
+    for first_year, last_year in [(None, None), (2003, None), (None, 2004), (2002, 2006), (2012, None)]:
+        w = window(edges, first_year, last_year)
+        for author in [5, 8, 34, 55]:
+            out = graph.edges(author, first_year, last_year)
+            expected = w.loc[w["AuthorId"] == author, ["CoAuthorId", "Year"]].reset_index(drop=True)
+            assert out.astype(np.int64).equals(expected.astype(np.int64))
+            assert graph.coauthors(author, first_year, last_year).tolist() == sorted(set(expected["CoAuthorId"]))
+
+            first_hop = set(expected["CoAuthorId"])
+            second_hop = set(w.loc[w["AuthorId"].isin(first_hop), "CoAuthorId"]) - {author}
+            assert graph.two_hop(author, first_year, last_year, exclude_coauthors=False).tolist() == sorted(second_hop)
+            assert graph.two_hop(author, first_year, last_year).tolist() == sorted(second_hop - first_hop)
+
+        counts = graph.collaborator_counts([5, 8, 13, 89], first_year, last_year)
+        expected = (w.loc[w["AuthorId"].isin([5, 8, 13, 89])]
+                    .groupby(["AuthorId", "Year"]).size().reset_index(name="n_coauthors"))
+        assert counts.astype(np.int64).equals(expected.astype(np.int64))
+
+
+def test_collab_graph_unknown_author(tmp_path):
+    graph, _ = make_graph(tmp_path, batch_size=7)
+    assert graph.node_index([5, 6, 144, 10 ** 12]).tolist()[1:] == [-1, -1, -1]
+    assert graph.edges(144).shape[0] == 0
+    assert len(graph.coauthors(6)) == 0
+    assert len(graph.two_hop(10 ** 12)) == 0
+    assert graph.collaborator_counts([6, 144]).shape[0] == 0
@@ -7,6 +7,8 @@ from nltk.metrics.distance import jaro_winkler_similarity
 from sklearn.feature_extraction.text import TfidfVectorizer
 
 import numpy 
+import pickle
+import time
 import pytest
 
 # run with python3 -m pytest!
@@ -154,4 +156,78 @@ def test_keyword_comparator():
     set2 = ("labor economics", "organic chemistry")
     set3 = ("inorganic chemistry", "computer science")
     assert cf.keyword_comparator(set1, set2) == 1
-    assert cf.keyword_comparator(set1, set3) == 0
\ No newline at end of file
+    assert cf.keyword_comparator(set1, set3) == 0
+
+def test_fitted_text_comparator():
+    corpus = thesis_title + paper_titles + long_set_of_titles
+    comparator = cf.FittedTextComparator(corpus, cache_size=2)
+    Vectorizer = TfidfVectorizer(
+        analyzer=cf.stemmed_words,
+        stop_words=ts.stop_words,
+        ngram_range=ts.ngram_range
+    )
+    tfidf = Vectorizer.fit(corpus).transform(thesis_title + paper_titles)
+    target = (tfidf * tfidf.T).toarray()[0, 1:].max()
+    assert comparator.text_comparator(thesis_title, paper_titles) == pytest.approx(target)
+    assert comparator.text_comparator(paper_titles, long_set_of_titles) == pytest.approx(1)
+
+    x = ((2000, thesis_title[0]), )
+    y = tuple((2001, t) for t in paper_titles)
+    assert comparator.year_title_comparator(x, y) == pytest.approx(target)
+
+    # the cache is rebuilt after pickling, e.g. in dedupe's settings file 
+    comparator = pickle.loads(pickle.dumps(comparator))
+    assert comparator.text_comparator(thesis_title, paper_titles) == pytest.approx(target)
+
+
+def test_range_comparators_batch():
+    a = [(1990, ), (1995, 2005), (1999, ), (2006, ), (2000, 2010)]
+    b = [(1995, 2005), (1990, ), (1995, 2005), (1995, 2005), (2003, )]
+    bounds_a, bounds_b = cf.tuple_bounds(a), cf.tuple_bounds(b)
+    assert list(cf.compare_range_from_tuple_batch(bounds_a, bounds_b)) == [cf.compare_range_from_tuple(x, y) for x, y in zip(a, b)]
+    assert list(cf.compare_startrange_from_tuple_batch(bounds_a, bounds_b)) == [cf.compare_startrange_from_tuple(x, y) for x, y in zip(a, b)]
+    assert list(cf.compare_endrange_from_tuple_batch(bounds_a, bounds_b)) == [cf.compare_endrange_from_tuple(x, y) for x, y in zip(a, b)]
+    with pytest.raises(ValueError, match="wrong length"):
+        cf.compare_range_from_tuple_batch(cf.tuple_bounds([(1995, 2005)]), cf.tuple_bounds([(1995, 2005)]))
+    with pytest.raises(ValueError, match="non-empty"):
+        cf.tuple_bounds([(1995, ), ()])
+
+    # pairs of records selected from the bounds of all records
+    index_a, index_b = numpy.array([4, 0, 2, 2]), numpy.array([1, 1, 3, 0])
+    pairs = [(a[i], b[j]) for i, j in zip(index_a, index_b)]
+    result = cf.compare_endrange_from_tuple_batch(cf.take_bounds(bounds_a, index_a), cf.take_bounds(bounds_b, index_b))
+    assert list(result) == [cf.compare_endrange_from_tuple(x, y) for x, y in pairs]
+
+    x = [n1, n2, 1994]
+    y = [n2, n2, 1995]
+    assert cf.number_comparator_batch(x, y) == pytest.approx([cf.number_comparator(i, j) for i, j in zip(x, y)])
+
+    compare = cf.pairwise_from_batch(cf.compare_range_from_tuple_batch, bounds=True)
+    assert compare((1999, ), (1995, 2005)) == 1
+    assert compare((1990, ), (1995, 2005)) == 0
+
+
+def test_range_comparators_batch_faster():
+    rng = numpy.random.default_rng(0)
+    n_records, n_pairs = 2000, 20000
+    starts = rng.integers(1960, 2015, n_records)
+    records = [(int(s), int(s + d)) if d > 0 else (int(s), ) for s, d in zip(starts, rng.integers(0, 30, n_records))]
+    index_a, index_b = rng.integers(0, n_records, n_pairs), rng.integers(0, n_records, n_pairs)
+    pairs = [(records[i], records[j]) for i, j in zip(index_a, index_b)]
+    bounds = cf.tuple_bounds(records) # once per set of records
+
+    def best_time(fnc):
+        times = []
+        for _ in range(3):
+            start = time.perf_counter()
+            fnc()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    for batch_fnc, fnc in [(cf.compare_startrange_from_tuple_batch, cf.compare_startrange_from_tuple),
+                           (cf.compare_endrange_from_tuple_batch, cf.compare_endrange_from_tuple)]:
+        batch = lambda: batch_fnc(cf.take_bounds(bounds, index_a), cf.take_bounds(bounds, index_b))
+        single = lambda: [fnc(x, y) for x, y in pairs]
+        assert list(batch()) == single()
+        # about 20 times faster; allow for noisy timings
+        assert best_time(batch) < best_time(single) / 3
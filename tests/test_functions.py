@@ -1,5 +1,11 @@
 
-from src.dataprep.helpers.functions import list_from_tuples
+from src.dataprep.helpers.functions import list_from_tuples, apply_to_unique, drop_firstword, quantiles_from_histogram, \
+    write_build_marker, read_build_markers, table_fingerprint
+
+import sqlite3 as sqlite
+
+import numpy as np
+import pandas as pd
 
 import pytest
 
@@ -19,3 +25,39 @@ def test_list_from_tuples():
         list_from_tuples(d)
 
 
+def test_apply_to_unique():
+    df = pd.DataFrame({"uni": ["the university of x usa", "the usa", "university of y", "the university of x usa"],
+                       "location": ["usa", "usa", "canada", "usa"]},
+                      index=[10, 3, 7, 1])
+    fnc = lambda uni, location: drop_firstword(uni.replace(location, ""), "the")
+    expected = df.apply(lambda row: fnc(row["uni"], row["location"]), axis="columns")
+    out = apply_to_unique(df, ["uni", "location"], fnc)
+    assert out.equals(expected)
+    assert list(out.index) == [10, 3, 7, 1]
+
+
+def test_quantiles_from_histogram():
+    quantiles = list(np.arange(0, 1, 0.01))
+    rng = np.random.default_rng(0)
+    for n in [1, 2, 7, 1000]:
+        citations = rng.poisson(3, n) * rng.integers(0, 50, n)
+        values, counts = np.unique(citations, return_counts=True)
+        expected = pd.Series(citations).quantile(quantiles).to_numpy()
+        assert np.array_equal(quantiles_from_histogram(values, counts, quantiles), expected)
+
+
+def test_build_markers():
+    con = sqlite.connect(":memory:", isolation_level=None)
+    assert read_build_markers(con, ["a"]) == {"a": None}
+    con.execute("CREATE TABLE a (x INTEGER)")
+    con.executemany("INSERT INTO a VALUES (?)", [(1, ), (2, )])
+    write_build_marker(con, "a")
+    fingerprint, markers = table_fingerprint(con, ["a", "b"]), read_build_markers(con, ["a", "b"])
+    assert fingerprint["b"] is None and markers["b"] is None
+    # rebuilt with the same number of rows: same fingerprint, new build id
+    con.execute("DROP TABLE a")
+    con.execute("CREATE TABLE a (x INTEGER)")
+    con.executemany("INSERT INTO a VALUES (?)", [(3, ), (4, )])
+    write_build_marker(con, "a")
+    assert table_fingerprint(con, ["a", "b"]) == fingerprint
+    assert read_build_markers(con, ["a"])["a"] not in [None, markers["a"]]
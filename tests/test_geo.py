@@ -0,0 +1,30 @@
+from src.dataprep.helpers.geo import geodesic_km, distance_blocks
+
+import numpy as np
+from geopy import distance
+
+
+def test_geodesic_km():
+    rng = np.random.default_rng(0)
+    lat1, lat2 = rng.uniform(-90, 90, (2, 200))
+    lon1, lon2 = rng.uniform(-180, 180, (2, 200))
+    lat2[:3], lon2[:3] = -lat1[:3], lon1[:3] + 179.9 # nearly antipodal
+    lat2[3:6], lon2[3:6] = lat1[3:6], lon1[3:6]
+    expected = [distance.distance((a, b), (c, d)).km for a, b, c, d in zip(lat1, lon1, lat2, lon2)]
+    assert np.allclose(geodesic_km(lat1, lon1, lat2, lon2), expected, rtol=0, atol=1e-6)
+    assert np.isnan(geodesic_km(np.nan, 0, 1, 1))
+
+
+def test_distance_blocks():
+    ids = np.array([10, 20, 30, 40, 50])
+    lat = np.array([41.79, 42.37, 40.73, 37.43, 41.88])
+    lon = np.array([-87.60, -71.12, -73.99, -122.17, -87.63])
+    full = geodesic_km(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+
+    blocks = [np.concatenate(x) for x in zip(*distance_blocks(ids, lat, lon, block_size=2))]
+    assert len(blocks[0]) == 25
+    assert np.array_equal(blocks[2], full.ravel())
+
+    id1, id2, d = [np.concatenate(x) for x in zip(*distance_blocks(ids, lat, lon, block_size=2, max_km=100))]
+    assert set(zip(id1, id2)) == {(i, i) for i in ids} | {(10, 50), (50, 10)}
+    assert np.all(d <= 100)
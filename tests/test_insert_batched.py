@@ -0,0 +1,16 @@
+from src.dataprep.helpers.functions import insert_batched
+
+import sqlite3
+
+
+def test_insert_batched():
+    con = sqlite3.connect(":memory:", isolation_level=None)
+    con.execute("CREATE TABLE links (id0 INT, id1 INT, score REAL)")
+    rows = ((i, i + 1, i / 10) for i in range(25))
+
+    n_rows = insert_batched(con, "INSERT INTO links VALUES (?, ?, ?)", rows, batch_size=10)
+    assert n_rows == 25
+    assert con.execute("SELECT COUNT(*), MAX(id1) FROM links").fetchone() == (25, 25)
+    assert not con.in_transaction
+
+    assert insert_batched(con, "INSERT INTO links VALUES (?, ?, ?)", [], batch_size=10) == 0
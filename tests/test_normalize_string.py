@@ -0,0 +1,29 @@
+from src.dataprep.helpers.functions import normalize_string, normalize_string_fast
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+strings = pd.Series([
+    "Université de Genève",
+    "UNIV. OF CALIFORNIA--BERKELEY",
+    "St. John's   College. ",
+    "A.B.C. Müller-Lüdenscheidt",
+    "Ñandú, Ìsla & Pàrís / Éclair (è)",
+    "  leading and trailing\twhitespace\n",
+    "under_score 42nd street.-dash. -x",
+    "İstanbul Teknik Üniversitesi",
+    "",
+    None,
+    np.nan,
+    "...---...",
+    "ça va? ø å ß",
+])
+
+
+@pytest.mark.parametrize("replace_hyphen", ["", " "])
+def test_normalize_string_fast(replace_hyphen):
+    target = normalize_string(strings, replace_hyphen=replace_hyphen)
+    pd.testing.assert_series_equal(normalize_string_fast(strings, replace_hyphen=replace_hyphen), target)
+    pd.testing.assert_series_equal(normalize_string_fast(strings, replace_hyphen=replace_hyphen, n_jobs=2), target)
@@ -0,0 +1,47 @@
+from src.dataprep.helpers.partitions import key_ranges, range_condition, create_table_partitioned, partition_filter
+
+import os
+import sqlite3 as sqlite
+
+
+def make_db(db_file):
+    con = sqlite.connect(db_file, isolation_level=None)
+    con.execute("CREATE TABLE PaperAuthorUnique (PaperId INTEGER, AuthorId INTEGER)")
+    con.executemany("INSERT INTO PaperAuthorUnique VALUES (?, ?)",
+                    [(p, (p * 7 + i) % 50) for p in range(300) for i in range(p % 4)])
+    con.execute("CREATE TABLE author_sample (AuthorId INTEGER)")
+    con.executemany("INSERT INTO author_sample VALUES (?)", [(a, ) for a in range(10, 40)])
+    return con
+
+
+def test_key_ranges(tmp_path):
+    con = make_db(str(tmp_path / "db.sqlite"))
+    assert key_ranges(con, "author_sample", "AuthorId", 1) is None
+    ranges = key_ranges(con, "author_sample", "AuthorId", 3)
+    assert ranges == [(None, 19), (19, 29), (29, None)]
+    assert range_condition("a.AuthorId", 19, 29) == "a.AuthorId > 19 AND a.AuthorId <= 29"
+    assert range_condition("a.AuthorId", None, None) == "a.AuthorId IS NOT NULL"
+
+
+def test_create_table_partitioned(tmp_path):
+    db_file = str(tmp_path / "db.sqlite")
+    con = make_db(db_file)
+    query = f"""
+        SELECT a.AuthorId, COUNT(*) AS PaperCount, MAX(a.PaperId) AS LastPaper
+        FROM PaperAuthorUnique AS a
+        WHERE {partition_filter} AND a.PaperId > ?
+        GROUP BY a.AuthorId
+    """
+    create_table_partitioned(con, db_file, "expected", query, (5, ))
+    # ranges from author_sample do not include all authors in PaperAuthorUnique
+    ranges = key_ranges(con, "author_sample", "AuthorId", 4)
+    create_table_partitioned(con, db_file, "partitioned", query, (5, ), key="a.AuthorId",
+                             ranges=ranges, n_jobs=2, scratch_dir=str(tmp_path))
+    create_table_partitioned(con, db_file, "partitioned_temp", query, (5, ), key="a.AuthorId",
+                             ranges=ranges, temporary=True, scratch_dir=str(tmp_path))
+
+    expected = con.execute("SELECT * FROM expected ORDER BY AuthorId").fetchall()
+    assert len(expected) == 50
+    assert con.execute("SELECT * FROM partitioned").fetchall() == expected
+    assert con.execute("SELECT * FROM temp.partitioned_temp").fetchall() == expected
+    assert sorted(os.listdir(tmp_path)) == ["db.sqlite"]
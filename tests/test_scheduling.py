@@ -0,0 +1,47 @@
+from src.dataprep.helpers.scheduling import run_scheduled
+
+import os
+import multiprocessing as mp
+
+
+def write_chunk(data):
+    "Write a file for the chunk; chunks named `die*` kill their worker."
+    out_dir, name = data
+    if name.startswith("die"):
+        marker = os.path.join(out_dir, f"{name}.started")
+        if name == "die_always" or not os.path.exists(marker):
+            open(marker, "w").close()
+            os._exit(1)
+    if name == "error":
+        raise ValueError("bad chunk")
+    open(os.path.join(out_dir, name), "w").close()
+
+
+def run(tmp_path, names, max_retries):
+    done = []
+    failed = run_scheduled(
+        func=write_chunk,
+        inputs=[(name, cost, (str(tmp_path), name)) for cost, name in enumerate(names)],
+        n_cores=2,
+        mp_context=mp.get_context("fork"),
+        max_retries=max_retries,
+        on_done=lambda data: done.append(data[1])
+    )
+    return failed, done
+
+
+def test_run_scheduled_worker_dies_once(tmp_path):
+    names = ["a", "b", "die_once", "c", "d", "e"]
+    failed, done = run(tmp_path, names, max_retries=1)
+    assert failed == []
+    assert sorted(done) == sorted(names)
+    assert all(os.path.exists(tmp_path / name) for name in names)
+
+
+def test_run_scheduled_worker_dies_always(tmp_path):
+    names = ["a", "b", "die_always", "error", "c", "d"]
+    failed, done = run(tmp_path, names, max_retries=1)
+    # only the chunk that kills its worker and the chunk that raises fail
+    assert sorted(failed) == ["die_always", "error"]
+    assert sorted(done) == sorted(names)
+    assert all(os.path.exists(tmp_path / name) for name in ["a", "b", "c", "d"])
@@ -0,0 +1,56 @@
+from src.dataprep.helpers.spatial_index import SpatialIndex, candidate_pairs
+from src.dataprep.helpers.geo import geodesic_km
+
+import numpy as np
+from geopy import distance
+
+
+def make_data(rng, n):
+    lat = rng.uniform(40, 42, n)
+    lon = rng.uniform(-89, -86, n)
+    data = {i: {"location": (a, b)} for i, (a, b) in enumerate(zip(lat, lon))}
+    data[n] = {"location": (np.nan, np.nan)}
+    return data
+
+
+def test_candidate_pairs():
+    rng = np.random.default_rng(0)
+    max_km = 25.0
+    data_1 = make_data(rng, 200)
+    data_2 = {k + 1000: v for k, v in make_data(rng, 150).items()}
+    # pairs just inside and just outside the cutoff; the spherical distance of the
+    # pair outside can be smaller than `max_km`
+    origin = (60.0, 10.0)
+    for i, km in [(5000, max_km - 0.01), (5001, max_km + 0.01)]:
+        point = distance.distance(kilometers=km).destination(origin, bearing=0)
+        data_2[i] = {"location": (point.latitude, point.longitude)}
+    data_1[5000] = {"location": origin}
+
+    pairs = list(candidate_pairs(data_1, data_2, radius_km=max_km))
+    found = {(id_1, id_2) for (id_1, _), (id_2, _) in pairs}
+    assert len(found) == len(pairs)
+    assert all(data_1[id_1] is r1 and data_2[id_2] is r2 for (id_1, r1), (id_2, r2) in pairs)
+
+    ids_1, ids_2 = np.array(list(data_1)), np.array(list(data_2))
+    loc_1 = np.array([r["location"] for r in data_1.values()])
+    loc_2 = np.array([r["location"] for r in data_2.values()])
+    d = geodesic_km(loc_1[:, [0]], loc_1[:, [1]], loc_2[None, :, 0], loc_2[None, :, 1])
+    rows, cols = np.nonzero(d <= max_km)
+    expected = set(zip(ids_1[rows].tolist(), ids_2[cols].tolist()))
+    assert found == expected
+    assert (5000, 5000) in found and (5000, 5001) not in found
+    assert len(found) > 100
+
+
+def test_nearest_and_distance():
+    ids = np.array([10, 20, 30, 40])
+    lat = np.array([41.79, 42.37, 40.73, np.nan])
+    lon = np.array([-87.60, -71.12, -73.99, 0.0])
+    index = SpatialIndex(ids, lat, lon)
+    assert len(index) == 3
+    out = index.nearest(["a", "b"], [41.88, 40.75], [-87.63, -73.98], k=2)
+    assert out["query_id"].tolist() == ["a", "a", "b", "b"]
+    assert out["id"].tolist() == [10, 30, 30, 20]
+    assert np.allclose(out["distance_km"], geodesic_km(np.repeat([41.88, 40.75], 2), np.repeat([-87.63, -73.98], 2),
+                                                       lat[[0, 2, 2, 1]], lon[[0, 2, 2, 1]]))
+    assert np.isclose(index.distance(20, 30), geodesic_km(42.37, -71.12, 40.73, -73.99))
@@ -0,0 +1,83 @@
+from src.dataprep.helpers.stream_load import read_rows, load_table, fast_load, Checkpoints
+
+import subprocess
+import sqlite3 as sqlite
+
+import pytest
+
+
+setup = {
+    "rawfile": "Table.txt",
+    "sql_create_table": """CREATE TABLE Table1 (
+        Id INTEGER, Name TEXT, Score REAL, Year INTEGER, Doi TEXT
+    )"""
+}
+
+
+def write_raw(path, lines):
+    with open(path, "wb") as f:
+        f.write("".join(lines).encode("utf-8"))
+
+
+lines = [
+    "1\tfirst\t0.5\t2001\t10.1/a\r\n",
+    "2\tsecond \t1e-3\t\t10.1/b\r\n",      # empty field
+    "3\tthird\t2\t1999\r\n",               # missing field at the end
+    "4\tfourth\t3.25\t2020\t10.1/d\textra\r\n", # additional field
+    "5\tÜmlaut – ünicode\tnan\tabc\t\r\n",
+    "6\t\"quoted\"\t-7\t2010\t10.1/f\n",
+]
+
+
+def test_load_table_same_as_import(tmp_path):
+    raw = tmp_path / "raw"
+    raw.mkdir()
+    write_raw(raw / "Table.txt", lines)
+
+    con = sqlite.connect(str(tmp_path / "streamed.sqlite"), isolation_level=None)
+    n_rows = load_table(con, "Table1", setup, f"{raw}/", batch_size=4)
+    assert n_rows == len(lines)
+
+    # the raw files were loaded with the sqlite3 shell before, after removing "\r"
+    with open(raw / "Table.txt", "rb") as f:
+        (raw / "trimmed.txt").write_bytes(f.read().replace(b"\r", b""))
+    imported = str(tmp_path / "imported.sqlite")
+    subprocess.run(["sqlite3", imported, setup["sql_create_table"]], check=True)
+    subprocess.run(["sqlite3", imported, ".mode ascii", '.separator "\\t" "\\n"',
+                    f".import {raw}/trimmed.txt Table1"], check=True, capture_output=True)
+
+    query = "SELECT *, typeof(Id), typeof(Score), typeof(Year), typeof(Doi) FROM Table1 ORDER BY rowid"
+    expected = sqlite.connect(imported).execute(query).fetchall()
+    assert con.execute(query).fetchall() == expected
+    assert len(expected) == len(lines)
+
+
+def test_read_rows_invalid_utf8(tmp_path):
+    path = tmp_path / "bad.txt"
+    path.write_bytes(b"1\tok\n2\tnot \xe9 utf-8\n")
+    rows = read_rows(str(path), 2)
+    assert next(rows) == ("1", "ok")
+    with pytest.raises(ValueError, match="line 2"):
+        next(rows)
+
+
+def test_checkpoints(tmp_path):
+    db_file = str(tmp_path / "db.sqlite")
+    checkpoint_file = str(tmp_path / "checkpoints.sqlite")
+    con = sqlite.connect(db_file, isolation_level=None)
+    checkpoints = Checkpoints(checkpoint_file)
+
+    def step(n):
+        with fast_load(con, db_file):
+            assert con.execute("PRAGMA journal_mode").fetchone()[0] == "off"
+            con.execute("CREATE TABLE t AS SELECT 1 AS x")
+        assert con.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+        return n
+
+    checkpoints.run("step", step, 3)
+    checkpoints.run("step", step, 3) # skipped, the table exists already
+    assert Checkpoints(checkpoint_file).done("step")
+    assert con.execute("SELECT name FROM sqlite_master").fetchall() == [("t", )]
+    assert not Checkpoints(checkpoint_file, restart=True).done("step")
+    checkpoints.clear()
+    assert not (tmp_path / "checkpoints.sqlite").exists()
@@ -0,0 +1,161 @@
+from src.dataprep.helpers.topic_cache import ConceptVectorCache
+from src.dataprep.helpers.topic_similarity_functions import QueryBuilder
+from src.dataprep.helpers.functions import write_build_marker
+
+import glob
+import os
+import sqlite3 as sqlite
+
+import numpy as np
+import pandas as pd
+
+
+years = list(range(2000, 2011))
+authors = list(range(100, 120))
+
+
+def create_table(con, tbl, df):
+    "Create `tbl` from `df` as the scripts that create the source tables do, with a build marker."
+    con.execute(f"DROP TABLE IF EXISTS {tbl}")
+    df.to_sql(tbl, con, index=False)
+    write_build_marker(con, tbl)
+
+
+def affiliation_fields(rng):
+    df = pd.DataFrame({
+        "AffiliationId": rng.choice([10, 11, 12], 200),
+        "Field0": rng.choice([1, 2], 200),
+        "Year": rng.choice(years, 200),
+        "FieldOfStudyId": rng.integers(0, 8, 200),
+        "Score": rng.random(200)
+    })
+    return df.drop_duplicates(["AffiliationId", "Field0", "Year", "FieldOfStudyId"])
+
+
+def make_db(db_file, rng):
+    con = sqlite.connect(db_file, isolation_level=None)
+    create_table(con, "affiliations", pd.DataFrame({"AffiliationId": [10, 11, 12]}))
+    create_table(con, "links_to_cng", pd.DataFrame({
+        "from_id": [10, 11, 12], "unitid": [1, 2, 3], "from_dataset": ["mag", "mag", "other"]
+    }))
+    # fields of level 2 are not in the concept vectors
+    create_table(con, "FieldsOfStudy", pd.DataFrame({"FieldOfStudyId": range(8), "Level": [1] * 6 + [2] * 2}))
+    create_table(con, "affiliation_fields", affiliation_fields(rng))
+    create_table(con, "affiliation_outcomes", pd.DataFrame(
+        [(a, f, y, int(rng.integers(1, 5))) for a in [10, 11, 12] for f in [1, 2] for y in years],
+        columns=["AffiliationId", "Field0", "Year", "PaperCount"]
+    ))
+    author_fields_detailed = pd.DataFrame({
+        "AuthorId": rng.choice(authors, 400),
+        "FieldOfStudyId": rng.integers(0, 5, 400),
+        "Year": rng.choice(years, 400),
+        "Score": rng.random(400),
+        "PaperCount": rng.integers(1, 5, 400).astype(float)
+    }).drop_duplicates(["AuthorId", "FieldOfStudyId", "Year"])
+    create_table(con, "author_fields_detailed", author_fields_detailed)
+    create_table(con, "author_fields", pd.DataFrame({
+        "AuthorId": authors, "FieldOfStudyId": [1 + a % 2 for a in authors], "FieldClass": "main"
+    }))
+    return con
+
+
+def make_queries(degree_year, field=1):
+    return QueryBuilder(degree_year_to_query=degree_year, window_size=2, field_to_query=field,
+                        qmarks_doctypes="?", keep_doctypes=("Journal", ), max_level=1)
+
+
+def assert_same(left, right):
+    "Same rows up to the order of the rows and columns."
+    assert set(left.columns) == set(right.columns)
+    right = right.loc[:, left.columns]
+    left = left.sort_values(list(left.columns)).reset_index(drop=True)
+    right = right.sort_values(list(right.columns)).reset_index(drop=True)
+    pd.testing.assert_frame_equal(left, right, check_dtype=False)
+
+
+def uncached_collaborators_topics(con, queries, author_ids):
+    df = pd.read_sql(con=con, sql=queries.query_collaborators_topics(author_ids_to_query=author_ids))
+    return df.drop(columns=["PaperCount"])
+
+
+def author_files(cache_dir, kind):
+    return glob.glob(os.path.join(cache_dir, f"author-field1-maxlevel1-{kind}-*.npy"))
+
+
+def test_cache_same_as_queries(tmp_path):
+    con = make_db(str(tmp_path / "db.sqlite"), np.random.default_rng(0))
+    cache_dir = str(tmp_path / "cache")
+    cache = ConceptVectorCache(cache_dir=cache_dir, max_level=1)
+    cache.validate(con)
+
+    for degree_year in [2001, 2005, 2010]:
+        queries = make_queries(degree_year)
+        expected = pd.read_sql(con=con, sql=queries.query_affiliation_topics())
+        assert expected.shape[0] > 0
+        assert_same(cache.affiliation_topics(con, queries), expected)
+
+    # overlapping sets of authors: the second call adds a part with the missing authors only
+    queries = make_queries(2005)
+    author_sets = [authors[:12], authors[8:], authors[::3]]
+    for author_ids in author_sets:
+        assert_same(cache.collaborators_topics(con, queries, author_ids),
+                    uncached_collaborators_topics(con, queries, author_ids))
+    assert len(author_files(cache_dir, "part")) == 2
+
+    # results read across parts do not change when the parts are merged;
+    # a part of a chunk that failed before writing its ids file is removed
+    stale_part = os.path.join(cache_dir, "author-field1-maxlevel1-part-stale.npy")
+    np.save(stale_part, np.load(author_files(cache_dir, "part")[0]))
+    cache.compact(1)
+    assert len(author_files(cache_dir, "part")) == 1
+    assert len(author_files(cache_dir, "ids")) == 1
+    assert not os.path.exists(stale_part)
+    for degree_year in [2001, 2005, 2010]:
+        queries = make_queries(degree_year)
+        assert_same(cache.collaborators_topics(con, queries, authors),
+                    uncached_collaborators_topics(con, queries, authors))
+    assert len(author_files(cache_dir, "part")) == 1
+
+
+def test_cache_invalidated(tmp_path):
+    rng = np.random.default_rng(1)
+    con = make_db(str(tmp_path / "db.sqlite"), rng)
+    cache_dir = str(tmp_path / "cache")
+    cache = ConceptVectorCache(cache_dir=cache_dir, max_level=1)
+    queries = make_queries(2005)
+
+    def fill():
+        cache.validate(con)
+        cache.affiliation_topics(con, queries)
+        cache.collaborators_topics(con, queries, authors)
+
+    def cached_files():
+        return glob.glob(os.path.join(cache_dir, "*-field*.npy"))
+
+    fill()
+    n_files = len(cached_files())
+    assert n_files == 3
+    # nothing changed
+    cache.validate(con)
+    assert len(cached_files()) == n_files
+
+    # a source table is created again with other scores: new build marker
+    create_table(con, "affiliation_fields", affiliation_fields(rng))
+    cache.validate(con)
+    assert cached_files() == []
+    assert_same(cache.affiliation_topics(con, queries),
+                pd.read_sql(con=con, sql=queries.query_affiliation_topics()))
+
+    # rows added without a new build marker: the fingerprint changes
+    fill()
+    con.execute("INSERT INTO author_fields_detailed VALUES (100, 5, 2005, 0.5, 1.0)")
+    cache.validate(con)
+    assert cached_files() == []
+    assert_same(cache.collaborators_topics(con, queries, authors),
+                uncached_collaborators_topics(con, queries, authors))
+
+    # a new build marker only
+    fill()
+    write_build_marker(con, "links_to_cng")
+    cache.validate(con)
+    assert cached_files() == []
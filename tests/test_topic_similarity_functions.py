@@ -0,0 +1,122 @@
+import src.dataprep.helpers.topic_similarity_functions as tsf
+
+import numpy as np
+import pandas as pd
+
+
+groupvars = ["period", "Field0"]
+
+
+def make_topics(rng, unit, ids, n_rows):
+    "Topics of the units `ids` with scores by FieldOfStudyId, period and Field0."
+    df = pd.DataFrame({
+        unit: rng.choice(ids, n_rows),
+        "FieldOfStudyId": rng.integers(0, 8, n_rows),
+        "period": rng.choice(["pre_phd", "post_phd"], n_rows),
+        "Field0": rng.choice([1, 2], n_rows),
+        "Score": rng.random(n_rows)
+    })
+    return df.drop_duplicates([unit, "FieldOfStudyId", "period", "Field0"]).reset_index(drop=True)
+
+
+def student_topics(rng):
+    df_A = make_topics(rng, "AuthorId", [1, 2, 3, 4], 30)
+    extra = pd.DataFrame({
+        "AuthorId": [5, 6],
+        "FieldOfStudyId": [99, np.nan], # 5: no FieldOfStudyId in df_B; 6: no topics
+        "period": ["pre_phd", "pre_phd"],
+        "Field0": [3, 1], # Field0 3 is not in df_B
+        "Score": [0.5, np.nan]
+    })
+    return pd.concat([df_A, extra], ignore_index=True)
+
+
+def assert_same(left, right):
+    "Same rows up to the order and floating point rounding."
+    keys = [c for c in left.columns if c != "sim"]
+    assert list(left.columns) == list(right.columns)
+    left = left.sort_values(keys).reset_index(drop=True)
+    right = right.sort_values(keys).reset_index(drop=True)
+    pd.testing.assert_frame_equal(left, right, check_dtype=False, atol=1e-9)
+
+
+def test_compute_similarity_sparse():
+    rng = np.random.default_rng(0)
+    df_A = student_topics(rng)
+    df_B = make_topics(rng, "AffiliationId", [10, 11, 12], 30)
+    for fill_A_units in [False, True]:
+        for B in [df_B, df_B.iloc[:0]]:
+            kwargs = dict(df_A=df_A, df_B=B, unit_A=["AuthorId"], unit_B=["AffiliationId"],
+                          groupvars=groupvars, fill_A_units=fill_A_units)
+            d_pandas = tsf.compute_similarity(engine="pandas", **kwargs)
+            d_sparse = tsf.compute_similarity(engine="sparse", **kwargs)
+            assert_same(d_pandas, d_sparse)
+            if fill_A_units:
+                assert set(d_sparse["AuthorId"]) == {1, 2, 3, 4, 5, 6}
+                assert (d_sparse.loc[d_sparse["AuthorId"].isin([5, 6]), "sim"] == 0).all()
+            else:
+                assert not d_sparse["AuthorId"].isin([5, 6]).any()
+    assert d_sparse.shape[0] == 6
+
+
+def test_most_similar_sparse():
+    rng = np.random.default_rng(1)
+    df_A = student_topics(rng)
+    collaborators = make_topics(rng, "CoAuthorId", [20, 21, 22, 23, 24, 25], 40)
+    # 26 has the same topics as 20: ties at the same affiliation
+    collaborators = pd.concat([collaborators, collaborators.loc[collaborators["CoAuthorId"] == 20].assign(CoAuthorId=26)])
+    affiliations = pd.DataFrame({"CoAuthorId": [20, 21, 22, 23, 24, 25, 26], "AffiliationId": [10, 10, 11, 11, 11, 12, 10]})
+    df_B = collaborators.merge(affiliations, on="CoAuthorId")
+    kwargs = dict(df_A=df_A, df_B=df_B, unit_A=["AuthorId"], unit_B=["CoAuthorId", "AffiliationId"], groupvars=groupvars)
+
+    expected = tsf.keep_most_similar(tsf.compute_similarity(**kwargs), ["AuthorId"] + groupvars + ["AffiliationId"])
+    for block_size in [1, 2, 4, 10_000]:
+        d_most_similar = tsf.most_similar_sparse(group_B=["AffiliationId"], block_size=block_size, **kwargs)
+        assert_same(expected, d_most_similar)
+
+    # ties are all kept; graduates without common fields with any collaborator are dropped
+    top = d_most_similar.loc[d_most_similar["AffiliationId"] == 10]
+    assert any(set(g) == {20, 26} for _, g in top.groupby(["AuthorId"] + groupvars)["CoAuthorId"])
+    assert not d_most_similar["AuthorId"].isin([5, 6]).any()
+    assert d_most_similar["AuthorId"].nunique() == 4
+
+
+def per_year(df, keys, value, degree_year, window_size):
+    "Sums over the window of `degree_year` as from the queries of one degree year."
+    in_window = (df["Year"] - degree_year).abs() <= window_size
+    d = tsf.sim_helpers.split_year_pre_post(df=df.loc[in_window].copy(), ref_year=degree_year)
+    return d.groupby(keys + ["period"])[value].sum().reset_index()
+
+
+def test_rolling_window_sums():
+    rng = np.random.default_rng(2)
+    window_size = 2
+    # years 2000-2012 without 2004 and 2008; units only appear in some years
+    years = [y for y in range(2000, 2013) if y not in [2004, 2008]]
+    affiliation_topics = pd.DataFrame({
+        "AffiliationId": rng.choice([10, 11, 12], 300),
+        "Field0": 1,
+        "FieldOfStudyId": rng.integers(0, 6, 300),
+        "Year": rng.choice(years, 300),
+        "Score": rng.random(300)
+    }).drop_duplicates(["AffiliationId", "FieldOfStudyId", "Year"])
+    papercount = pd.DataFrame({"AuthorId": rng.choice(np.arange(20), 60), "Year": rng.choice(years, 60), "PaperCount": 1})
+    papercount = papercount.groupby(["AuthorId", "Year"], as_index=False).sum()
+    df_A = make_topics(rng, "AuthorId", [1, 2, 3], 20).assign(Field0=1)
+
+    keys = ["AffiliationId", "Field0", "FieldOfStudyId"]
+    rolling_topics = tsf.RollingWindowSums(df=affiliation_topics, keys=keys, value="Score", window_size=window_size)
+    rolling_papercount = tsf.RollingWindowSums(df=papercount, keys=["AuthorId"], value="PaperCount", window_size=window_size)
+    # steps of one and two years, a jump that resets the sums, windows without data at the end
+    for degree_year in [2001, 2002, 2003, 2005, 2006, 2011, 2012, 2013, 2014, 2015]:
+        rolling_topics.move_to(degree_year)
+        rolling_papercount.move_to(degree_year)
+        for rolling, expected_keys, value, df in [(rolling_topics, keys, "Score", affiliation_topics),
+                                                  (rolling_papercount, ["AuthorId"], "PaperCount", papercount)]:
+            expected = per_year(df, expected_keys, value, degree_year, window_size)
+            assert_same(expected, rolling.get().loc[:, expected.columns])
+
+        kwargs = dict(df_A=df_A, unit_A=["AuthorId"], unit_B=["AffiliationId"], groupvars=groupvars)
+        expected = tsf.compute_similarity(df_B=per_year(affiliation_topics, keys, "Score", degree_year, window_size), **kwargs)
+        assert_same(expected, tsf.compute_similarity(df_B=rolling_topics.get(), **kwargs))
+    assert rolling_topics.get().shape[0] == 0